@@ -26,6 +26,18 @@ class AST(object):
     def interpret_simple(self, env):
         raise NotImplementedError("abstract base class")
 
+    def direct_safe(self):
+        """ Whether the AST can be evaluated by interpret_direct. """
+        return self.simple
+
+    def interpret_direct(self, env, depth, next_ast):
+        """ Evaluates the AST in direct style and returns its values, see
+        DirectReify in pycket.interpreter. next_ast is the AST that runs
+        afterwards, depth the number of calls made in direct style so far. """
+        # default implementation for simple AST forms
+        assert self.simple
+        return self.interpret_simple(env)
+
     def set_surrounding_lambda(self, lam):
         from pycket.interpreter import Lambda
         assert isinstance(lam, Lambda)
@@ -0,0 +1,452 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Binary cache for assign-converted modules.
+#
+# Loading a module from its expanded JSON means parsing the JSON text,
+# converting it to an AST and running assign conversion.  The result of all
+# that work only depends on the JSON file, so we store the converted module in
+# a compact binary form next to the JSON file and load it directly on later
+# runs.  The header records a hash of the JSON text the module was converted
+# from, a cache written for other contents is never used.  Environment structures (SymLists) are written once and referenced by
+# index, so sharing between the AST nodes survives the round trip.
+
+import os
+
+from rpython.rlib import streamio
+from rpython.rlib.rsha import RSHA
+
+from pycket import config
+from pycket.env import SymList
+from pycket.interpreter import (Module, Require, Quote, QuoteSyntax,
+    VariableReference, WithContinuationMark, App, Begin0, Begin,
+    BeginForSyntax, CellRef, LexicalVar, ModuleVar, ToplevelVar, SetBang, If,
+    CaseLambda, Lambda, Letrec, Let, DefineValues, Cell)
+from pycket.serialize import Writer, Reader, SerializationError
+
+MAGIC = "PYCKETAST"
+# bump whenever the encoding below or the AST classes change
+FORMAT_VERSION = 3
+
+AST_NONE         = 0
+AST_MODULE       = 1
+AST_REQUIRE      = 2
+AST_QUOTE        = 3
+AST_QUOTE_SYNTAX = 4
+AST_VARREF       = 5
+AST_WCM          = 6
+AST_APP          = 7
+AST_BEGIN0       = 8
+AST_BEGIN        = 9
+AST_BEGIN_FOR_SYNTAX = 10
+AST_CELLREF      = 11
+AST_LEXICAL      = 12
+AST_MODULEVAR    = 13
+AST_TOPLEVEL     = 14
+AST_SETBANG      = 15
+AST_IF           = 16
+AST_CASE_LAMBDA  = 17
+AST_LAMBDA       = 18
+AST_LETREC       = 19
+AST_LET          = 20
+AST_DEFINE_VALUES = 21
+AST_CELL         = 22
+
+def _config_flags():
+    flags = 0
+    if config.prune_env:
+        flags |= 1
+    if config.optimize_ast:
+        flags |= 2
+    return flags
+
+class ASTWriter(Writer):
+    def __init__(self):
+        Writer.__init__(self)
+        self.symlists = {}
+
+    def write_symlist(self, symlist):
+        if symlist is None:
+            self.write_uint(0)
+            return
+        index = self.symlists.get(symlist, -1)
+        if index >= 0:
+            self.write_uint(index + 1)
+            return
+        index = len(self.symlists)
+        self.symlists[symlist] = index
+        self.write_uint(index + 1)
+        self.write_symbols(symlist.elems)
+        self.write_symlist(symlist.prev)
+
+    def write_int_list(self, l):
+        self.write_uint(len(l))
+        for i in l:
+            self.write_int(i)
+
+    def write_bool_list(self, l):
+        self.write_uint(len(l))
+        for b in l:
+            self.write_bool(b)
+
+    def write_asts(self, asts):
+        self.write_uint(len(asts))
+        for ast in asts:
+            self.write_ast(ast)
+
+    def write_ast(self, ast):
+        if ast is None:
+            self.write_byte(AST_NONE)
+        elif isinstance(ast, Module):
+            self.write_byte(AST_MODULE)
+            self.write_str(ast.name)
+            self.write_uint(len(ast.config))
+            for k, v in ast.config.iteritems():
+                self.write_str(k)
+                self.write_str(v)
+            self.write_ast(ast.lang)
+            self.write_uint(len(ast.provides))
+            for name, w_sym in ast.provides.iteritems():
+                self.write_str(name)
+                self.write_symbol(w_sym)
+            self.write_asts(ast.rebuild_body())
+        elif isinstance(ast, Require):
+            self.write_byte(AST_REQUIRE)
+            self.write_str_or_none(ast.fname)
+            self.write_bool(ast.modtable is not None)
+            self.write_str_list(ast.path)
+        elif isinstance(ast, Quote):
+            self.write_byte(AST_QUOTE)
+            self.write_value(ast.w_val)
+        elif isinstance(ast, QuoteSyntax):
+            self.write_byte(AST_QUOTE_SYNTAX)
+            self.write_value(ast.w_val)
+        elif isinstance(ast, VariableReference):
+            self.write_byte(AST_VARREF)
+            self.write_ast(ast.var)
+            self.write_str_or_none(ast.path)
+            self.write_bool(ast.is_mut)
+        elif isinstance(ast, WithContinuationMark):
+            self.write_byte(AST_WCM)
+            self.write_ast(ast.key)
+            self.write_ast(ast.value)
+            self.write_ast(ast.body)
+        elif isinstance(ast, App):
+            # the specialized primitive applications are recreated by App.make
+            self.write_byte(AST_APP)
+            self.write_ast(ast.rator)
+            self.write_asts(ast.rands)
+            self.write_symlist(ast.env_structure)
+        elif isinstance(ast, Begin0):
+            self.write_byte(AST_BEGIN0)
+            self.write_ast(ast.first)
+            self.write_ast(ast.body)
+        elif isinstance(ast, Begin):
+            self.write_byte(AST_BEGIN)
+            self.write_asts(ast.body)
+        elif isinstance(ast, BeginForSyntax):
+            self.write_byte(AST_BEGIN_FOR_SYNTAX)
+            self.write_asts(ast.body)
+        elif isinstance(ast, CellRef):
+            self.write_byte(AST_CELLREF)
+            self.write_symbol(ast.sym)
+            self.write_symlist(ast.env_structure)
+        elif isinstance(ast, LexicalVar):
+            self.write_byte(AST_LEXICAL)
+            self.write_symbol(ast.sym)
+            self.write_symlist(ast.env_structure)
+        elif isinstance(ast, ModuleVar):
+            self.write_byte(AST_MODULEVAR)
+            self.write_symbol(ast.sym)
+            self.write_str_or_none(ast.srcmod)
+            self.write_symbol(ast.srcsym)
+            self.write_str_list(ast.path)
+        elif isinstance(ast, ToplevelVar):
+            self.write_byte(AST_TOPLEVEL)
+            self.write_symbol(ast.sym)
+            self.write_symlist(ast.env_structure)
+        elif isinstance(ast, SetBang):
+            self.write_byte(AST_SETBANG)
+            self.write_ast(ast.var)
+            self.write_ast(ast.rhs)
+        elif isinstance(ast, If):
+            self.write_byte(AST_IF)
+            self.write_ast(ast.tst)
+            self.write_ast(ast.thn)
+            self.write_ast(ast.els)
+        elif isinstance(ast, CaseLambda):
+            self.write_byte(AST_CASE_LAMBDA)
+            self.write_asts(ast.lams)
+            self.write_symbol_or_none(ast.recursive_sym)
+        elif isinstance(ast, Lambda):
+            self.write_byte(AST_LAMBDA)
+            self.write_symbols(ast.formals)
+            self.write_symbol_or_none(ast.rest)
+            self.write_symlist(ast.args)
+            self.write_symlist(ast.frees)
+            self.write_asts(ast.body)
+            self.write_int(ast.srcpos)
+            self.write_str_or_none(ast.srcfile)
+            self.write_symlist(ast.enclosing_env_structure)
+            self.write_symlist(ast.env_structure)
+        elif isinstance(ast, Letrec):
+            self.write_byte(AST_LETREC)
+            self.write_symlist(ast.args)
+            self.write_int_list(ast.counts)
+            self.write_asts(ast.rhss)
+            self.write_asts(ast.body)
+        elif isinstance(ast, Let):
+            self.write_byte(AST_LET)
+            self.write_symlist(ast.args)
+            self.write_int_list(ast.counts)
+            self.write_asts(ast.rhss)
+            self.write_asts(ast.body)
+            self.write_int_list(ast.remove_num_envs)
+        elif isinstance(ast, DefineValues):
+            self.write_byte(AST_DEFINE_VALUES)
+            self.write_symbols(ast.names)
+            self.write_ast(ast.rhs)
+            self.write_symbols(ast.display_names)
+        elif isinstance(ast, Cell):
+            self.write_byte(AST_CELL)
+            self.write_ast(ast.expr)
+            self.write_bool_list(ast.need_cell_flags)
+        else:
+            raise SerializationError("cannot serialize AST node %s" % ast.tostring())
+
+
+class ASTReader(Reader):
+    def __init__(self, data, modtable, pos=0):
+        Reader.__init__(self, data, pos)
+        self.modtable = modtable
+        self.symlists = []
+
+    def read_symlist(self):
+        index = self.read_uint()
+        if index == 0:
+            return None
+        index -= 1
+        if index < len(self.symlists):
+            result = self.symlists[index]
+            # a None entry is a symlist currently being read, which would
+            # mean that its prev chain contains itself
+            if result is None:
+                raise SerializationError("cyclic environment structure")
+            return result
+        if index != len(self.symlists):
+            raise SerializationError("bad environment structure reference")
+        self.symlists.append(None)
+        elems = self.read_symbols()
+        prev = self.read_symlist()
+        result = SymList(elems, prev)
+        self.symlists[index] = result
+        return result
+
+    def read_int_list(self):
+        return [self.read_int() for i in range(self.read_uint())]
+
+    def read_bool_list(self):
+        return [self.read_bool() for i in range(self.read_uint())]
+
+    def read_asts(self):
+        return [self.read_ast() for i in range(self.read_uint())]
+
+    def read_require(self, fname, path):
+        from pycket.expand import load_required_module
+        modtable = self.modtable
+        assert modtable is not None
+        load_required_module(fname, modtable)
+        return Require(fname, modtable, path=path)
+
+    def read_ast(self):
+        tag = self.read_byte()
+        if tag == AST_NONE:
+            return None
+        if tag == AST_MODULE:
+            name = self.read_str()
+            config = {}
+            for i in range(self.read_uint()):
+                k = self.read_str()
+                config[k] = self.read_str()
+            lang = self.read_ast()
+            provides = {}
+            for i in range(self.read_uint()):
+                k = self.read_str()
+                provides[k] = self.read_symbol()
+            body = self.read_asts()
+            return Module(name, body, config, lang=lang, provides=provides)
+        if tag == AST_REQUIRE:
+            fname = self.read_str_or_none()
+            has_modtable = self.read_bool()
+            path = self.read_str_list()
+            if not has_modtable:
+                return Require(fname, None, path=path)
+            assert fname is not None
+            return self.read_require(fname, path)
+        if tag == AST_QUOTE:
+            return Quote(self.read_value())
+        if tag == AST_QUOTE_SYNTAX:
+            return QuoteSyntax(self.read_value())
+        if tag == AST_VARREF:
+            var = self.read_ast()
+            path = self.read_str_or_none()
+            is_mut = self.read_bool()
+            return VariableReference(var, path, is_mut)
+        if tag == AST_WCM:
+            key = self.read_ast()
+            value = self.read_ast()
+            body = self.read_ast()
+            return WithContinuationMark(key, value, body)
+        if tag == AST_APP:
+            rator = self.read_ast()
+            rands = self.read_asts()
+            env_structure = self.read_symlist()
+            return App.make(rator, rands, env_structure)
+        if tag == AST_BEGIN0:
+            first = self.read_ast()
+            body = self.read_ast()
+            return Begin0(first, body)
+        if tag == AST_BEGIN:
+            return Begin(self.read_asts())
+        if tag == AST_BEGIN_FOR_SYNTAX:
+            return BeginForSyntax(self.read_asts())
+        if tag == AST_CELLREF:
+            sym = self.read_symbol()
+            return CellRef(sym, self.read_symlist())
+        if tag == AST_LEXICAL:
+            sym = self.read_symbol()
+            return LexicalVar(sym, self.read_symlist())
+        if tag == AST_MODULEVAR:
+            sym = self.read_symbol()
+            srcmod = self.read_str_or_none()
+            srcsym = self.read_symbol()
+            path = self.read_str_list()
+            return ModuleVar(sym, srcmod, srcsym, path)
+        if tag == AST_TOPLEVEL:
+            sym = self.read_symbol()
+            return ToplevelVar(sym, self.read_symlist())
+        if tag == AST_SETBANG:
+            var = self.read_ast()
+            rhs = self.read_ast()
+            return SetBang(var, rhs)
+        if tag == AST_IF:
+            tst = self.read_ast()
+            thn = self.read_ast()
+            els = self.read_ast()
+            return If(tst, thn, els)
+        if tag == AST_CASE_LAMBDA:
+            lams = self.read_asts()
+            recursive_sym = self.read_symbol_or_none()
+            return CaseLambda(lams, recursive_sym)
+        if tag == AST_LAMBDA:
+            formals = self.read_symbols()
+            rest = self.read_symbol_or_none()
+            args = self.read_symlist()
+            frees = self.read_symlist()
+            body = self.read_asts()
+            srcpos = self.read_int()
+            srcfile = self.read_str_or_none()
+            enclosing_env_structure = self.read_symlist()
+            env_structure = self.read_symlist()
+            return Lambda(formals, rest, args, frees, body, srcpos, srcfile,
+                          enclosing_env_structure, env_structure)
+        if tag == AST_LETREC:
+            args = self.read_symlist()
+            counts = self.read_int_list()
+            rhss = self.read_asts()
+            body = self.read_asts()
+            return Letrec(args, counts, rhss, body)
+        if tag == AST_LET:
+            args = self.read_symlist()
+            counts = self.read_int_list()
+            rhss = self.read_asts()
+            body = self.read_asts()
+            remove_num_envs = self.read_int_list()
+            return Let(args, counts, rhss, body, remove_num_envs)
+        if tag == AST_DEFINE_VALUES:
+            names = self.read_symbols()
+            rhs = self.read_ast()
+            display_names = self.read_symbols()
+            return DefineValues(names, rhs, display_names)
+        if tag == AST_CELL:
+            expr = self.read_ast()
+            return Cell(expr, self.read_bool_list())
+        raise SerializationError("unknown AST tag %d in serialized data" % tag)
+
+
+def _file_hash(fname):
+    """ The hash of the contents of fname, or "" if it cannot be read. """
+    try:
+        f = streamio.open_file_as_stream(fname)
+        try:
+            data = f.readall()
+        finally:
+            f.close()
+    except OSError:
+        return ""
+    return RSHA(data).hexdigest()
+
+def serialize_module(module, source_hash=""):
+    body = ASTWriter()
+    body.write_ast(module)
+    header = Writer()
+    header.write_raw(MAGIC)
+    header.write_uint(FORMAT_VERSION)
+    header.write_uint(_config_flags())
+    header.write_str(source_hash)
+    header.write_raw(body.getvalue())
+    return header.getvalue()
+
+def deserialize_module(data, modtable, source_hash=""):
+    """ Returns None if the data was written by an incompatible version or
+    for a different source file. """
+    if not data.startswith(MAGIC):
+        return None
+    reader = ASTReader(data, modtable, len(MAGIC))
+    if reader.read_uint() != FORMAT_VERSION:
+        return None
+    if reader.read_uint() != _config_flags():
+        return None
+    if reader.read_str() != source_hash:
+        return None
+    module = reader.read_ast()
+    if not isinstance(module, Module) or not reader.at_end():
+        raise SerializationError("malformed AST cache")
+    return module
+
+def load_module(cache_file, source_file, modtable):
+    """ Load the module cached for source_file or return None if the cache
+    cannot be used. """
+    try:
+        f = streamio.open_file_as_stream(cache_file)
+        data = f.readall()
+        f.close()
+    except OSError:
+        return None
+    try:
+        return deserialize_module(data, modtable, _file_hash(source_file))
+    except SerializationError:
+        return None
+
+def save_module(module, cache_file, source_file):
+    """ Write the module cache for source_file. Failing to do so is not an
+    error, the module is simply loaded from source next time. """
+    try:
+        data = serialize_module(module, _file_hash(source_file))
+    except SerializationError:
+        return False
+    # write to a temporary file first so that concurrent runs never see a
+    # partially written cache
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    try:
+        f = streamio.open_file_as_stream(tmp_file, "w")
+        f.write(data)
+        f.close()
+        os.rename(tmp_file, cache_file)
+    except OSError:
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+        return False
+    return True
@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Benchmark harness for the programs in pycket/test.
+#
+# Every benchmark is run several times, each time in a fresh pycket process.
+# The first runs are warmup runs (they also make sure the json and AST caches
+# are up to date) and are reported separately. For the remaining runs the
+# harness records the wall-clock time, the maximal resident set size and the
+# times the program prints itself with Racket's `time` form, of which the
+# first ones can be dropped as in-process warmup iterations. Allocations are
+# not counted, changes that save allocations only show up in these times and
+# in the gc time printed by `time`.
+#
+# This is a development tool run with CPython, it is not part of the
+# translated interpreter.
+
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test")
+
+# name -> (file, arguments)
+BENCHMARKS = {
+    "nbody": ("nbody.rkt", ["1000000"]),
+    "bubble": ("bubble.rkt", []),
+    "bubble-unsafe2": ("bubble-unsafe2.rkt", []),
+    "vector-iterate": ("vector_iterate.rkt", []),
+    "vector-iterate-unsafe": ("vector_iterate_unsafe.rkt", []),
+    "church-simple": ("church-simple.rkt", []),
+    "church-con": ("church-con.rkt", []),
+    "microkanren": ("microkanren.rkt", []),
+    "fannkuch-redux": ("fannkuch-redux.rkt", ["10"]),
+    "spectral-norm": ("spectral-norm.rkt", ["1000"]),
+    "spectral-norm-simple": ("spectral-norm-simple.rkt", ["1000"]),
+    "spectral-norm-safe": ("spectral-norm-safe.rkt", ["1000"]),
+    "earley": ("earley.rkt", []),
+    "nucleic2": ("nucleic2.rkt", []),
+    "ctak": ("ctak.rkt", []),
+    "paraffins": ("paraffins.rkt", []),
+    "hashtable-benchmark": ("hashtable-benchmark.rkt", []),
+    "equal-hashtable-benchmark": ("equal-hashtable-benchmark.rkt", []),
+    "weak-hash-memory": ("weak-hash-memory.rkt", []),
+    "place-spectral-norm": ("place-spectral-norm.rkt", ["1000", "4"]),
+    "future-spectral-norm": ("future-spectral-norm.rkt", ["1000", "4"]),
+}
+
+DEFAULT_VARIANT = "default"
+
+USAGE = """usage: pycket-bench [options] [benchmark ...]
+
+  -n <runs>                measured runs per benchmark (default 5)
+  -w <runs>                warmup runs per benchmark (default 1)
+  --warmup-iterations <n>  timings printed by the program to skip (default 0)
+  --variant <name>         also run the executable translated with this
+                           option, e.g. no-callgraph or no-strategies
+  --executable <file>      pycket executable (default $PYCKET or pycket-c)
+  -o <file>                write the results as JSON to <file>
+  --baseline <file>        compare with earlier results, fail on regressions
+  --threshold <x>          relative slowdown counted as a regression
+                           (default 0.1)
+
+Without benchmark arguments all of %s are run."""
+
+TIME_RE = re.compile(r"cpu time: (\d+) real time: (\d+) gc time: (\d+)")
+
+class BenchError(Exception):
+    pass
+
+def variant_executable(executable, variant):
+    """ The name of the executable translated with the option in variant, as
+    computed by pycket.config.compute_executable_suffix. """
+    if variant == DEFAULT_VARIANT:
+        return executable
+    from pycket.config import get_testing_config, compute_executable_suffix
+    if variant.startswith("no-"):
+        name, value = variant[len("no-"):], False
+    else:
+        name, value = variant, True
+    option = "pycket." + name.replace("-", "_")
+    try:
+        config = get_testing_config(**{option: value})
+    except (AttributeError, KeyError, ValueError):
+        raise BenchError("unknown variant %s" % variant)
+    return executable + compute_executable_suffix(config)
+
+def parse_timings(output):
+    """ The real times in seconds of the `time` forms in the output. """
+    return [int(m.group(2)) / 1000.0 for m in TIME_RE.finditer(output)]
+
+def median(xs):
+    xs = sorted(xs)
+    n = len(xs)
+    if n == 0:
+        return None
+    if n % 2:
+        return xs[n // 2]
+    return (xs[n // 2 - 1] + xs[n // 2]) / 2.0
+
+def stddev(xs):
+    n = len(xs)
+    if n < 2:
+        return 0.0
+    mean = sum(xs) / float(n)
+    return math.sqrt(sum([(x - mean) ** 2 for x in xs]) / (n - 1))
+
+def run_once(cmd):
+    """ Run cmd in a fresh process and return (seconds, max rss in KB,
+    output). """
+    start = time.time()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, cwd=TEST_DIR)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.time() - start
+    process.returncode = 0 # reaped above
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise BenchError("%s failed:\n%s" % (" ".join(cmd), output))
+    return seconds, rusage.ru_maxrss, output
+
+def summarize(times, warmup_times, rss, timings, warmup_iterations):
+    steady = []
+    for t in timings:
+        steady.extend(t[warmup_iterations:])
+    return {
+        "times": times,
+        "warmup_times": warmup_times,
+        "median": median(times),
+        "stddev": stddev(times),
+        "max_rss_kb": max(rss) if rss else None,
+        "steady_median": median(steady),
+        "steady_stddev": stddev(steady),
+    }
+
+def run_benchmark(executable, name, runs, warmup, warmup_iterations):
+    fname, args = BENCHMARKS[name]
+    cmd = [executable, fname] + args
+    warmup_times = [run_once(cmd)[0] for i in range(warmup)]
+    times, rss, timings = [], [], []
+    for i in range(runs):
+        seconds, maxrss, output = run_once(cmd)
+        times.append(seconds)
+        rss.append(maxrss)
+        timings.append(parse_timings(output))
+    return summarize(times, warmup_times, rss, timings, warmup_iterations)
+
+def compare(results, baseline, threshold):
+    """ Returns a list of (benchmark, variant, old median, new median) for
+    every result that is slower than its baseline by more than threshold. """
+    regressions = []
+    for name, variants in sorted(results.items()):
+        for variant, result in sorted(variants.items()):
+            old = baseline.get(name, {}).get(variant)
+            if old is None or old.get("median") is None or result.get("median") is None:
+                continue
+            if result["median"] > old["median"] * (1 + threshold):
+                regressions.append((name, variant, old["median"], result["median"]))
+    return regressions
+
+def parse_args(argv):
+    options = {
+        "runs": 5,
+        "warmup": 1,
+        "warmup_iterations": 0,
+        "variants": [DEFAULT_VARIANT],
+        "executable": os.environ.get("PYCKET", "pycket-c"),
+        "output": None,
+        "baseline": None,
+        "threshold": 0.1,
+        "benchmarks": [],
+    }
+    args = argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg in ["-h", "--help"]:
+            print USAGE % ", ".join(sorted(BENCHMARKS))
+            return None
+        if arg in ["-n", "-w", "--warmup-iterations", "--variant",
+                   "--executable", "-o", "--baseline", "--threshold"]:
+            if not args:
+                raise BenchError("missing argument after %s" % arg)
+            value = args.pop(0)
+            if arg == "-n":
+                options["runs"] = int(value)
+            elif arg == "-w":
+                options["warmup"] = int(value)
+            elif arg == "--warmup-iterations":
+                options["warmup_iterations"] = int(value)
+            elif arg == "--variant":
+                options["variants"].append(value)
+            elif arg == "--executable":
+                options["executable"] = value
+            elif arg == "-o":
+                options["output"] = value
+            elif arg == "--baseline":
+                options["baseline"] = value
+            else:
+                options["threshold"] = float(value)
+        elif arg in BENCHMARKS:
+            options["benchmarks"].append(arg)
+        else:
+            raise BenchError("unknown benchmark or option %s" % arg)
+    if not options["benchmarks"]:
+        options["benchmarks"] = sorted(BENCHMARKS)
+    return options
+
+def main(argv):
+    try:
+        options = parse_args(argv)
+    except (BenchError, ValueError), e:
+        print >> sys.stderr, e
+        return 2
+    if options is None:
+        return 0
+    executable = os.path.abspath(options["executable"])
+    results = {}
+    failed = False
+    for name in options["benchmarks"]:
+        results[name] = {}
+        for variant in options["variants"]:
+            try:
+                exe = variant_executable(executable, variant)
+                result = run_benchmark(exe, name, options["runs"],
+                                       options["warmup"],
+                                       options["warmup_iterations"])
+            except (BenchError, OSError), e:
+                print >> sys.stderr, "%s (%s): %s" % (name, variant, e)
+                failed = True
+                continue
+            results[name][variant] = result
+            print "%-22s %-14s median %8.3fs  stddev %7.3fs  rss %8d KB" % (
+                name, variant, result["median"], result["stddev"],
+                result["max_rss_kb"])
+    if options["output"] is not None:
+        f = open(options["output"], "w")
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+    if options["baseline"] is not None:
+        f = open(options["baseline"])
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(results, baseline, options["threshold"])
+        for name, variant, old, new in regressions:
+            print "REGRESSION %s (%s): %.3fs -> %.3fs (%+.1f%%)" % (
+                name, variant, old, new, (new / old - 1) * 100)
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -22,22 +22,75 @@ class CallGraph(object):
     def __init__(self):
         self.calls     = {}
         self.recursive = {}
+        self.profile   = None
+        self.jit_profile = None
+
+    def start_profile(self):
+        from pycket import profiler
+        self.profile = profiler.Profile()
+        profiler.state.profile = self.profile
+
+    def stop_profile(self):
+        from pycket import profiler
+        profiler.state.profile = None
+
+    def load_jit_profile(self, path):
+        """ Reads a warm-start profile, see pycket.jit_profile. Returns False
+        if it can't be read. """
+        from pycket.jit_profile import JitProfile
+        profile = JitProfile()
+        try:
+            if not profile.read(path):
+                return False
+        except OSError:
+            return False
+        self.jit_profile = profile
+        return True
+
+    def warm_start(self, module):
+        if self.jit_profile is not None:
+            self.jit_profile.apply(module)
+
+    def write_jit_profile(self, path):
+        from pycket.jit_profile import JitProfile
+        profile = JitProfile()
+        if self.jit_profile is not None:
+            # keep what was loaded, also for the modules not used this time
+            profile.entries.update(self.jit_profile.entries)
+        for lam in self.calls:
+            profile.record(lam)
+        profile.write(path)
 
     def register_call(self, lam, calling_app, cont, env):
         if jit.we_are_jitted():
             return
+        if self.profile is not None:
+            self.profile.record_call(lam)
         if not calling_app:
             return
         calling_lam = calling_app.surrounding_lambda
         if not calling_lam:
             return
+        self._register_call(lam, calling_lam, cont.get_next_executed_ast(), env)
+
+    def register_direct_call(self, lam, calling_app, cont_ast, env):
+        """ Like register_call, for a call made in direct style (see
+        DirectReify in pycket.interpreter), where cont_ast is the AST that
+        runs when the call returns. """
+        if self.profile is not None:
+            self.profile.record_call(lam)
+        calling_lam = calling_app.surrounding_lambda
+        if not calling_lam:
+            return
+        self._register_call(lam, calling_lam, cont_ast, env)
+
+    def _register_call(self, lam, calling_lam, cont_ast, env):
         subdct = self.calls.get(calling_lam, None)
         if subdct is None:
             self.calls[calling_lam] = subdct = {}
             lam_in_subdct = False
         else:
             lam_in_subdct = lam in subdct
-        cont_ast = cont.get_next_executed_ast()
         config = env.pycketconfig()
         is_recursive = False
         if not lam_in_subdct:
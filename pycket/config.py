@@ -23,6 +23,10 @@ pycketoption_descr = OptionDescription(
                default=True, cmdline="--type-size-specialization"),
     BoolOption("prune_env", "prune environment",
                default=True, cmdline="--prune-env"),
+    BoolOption("optimize_ast", "fold constants and drop dead bindings before interpretation",
+               default=False, cmdline="--optimize-ast"),
+    BoolOption("direct_stack", "evaluate subexpressions that can't capture continuations on the native stack; this code is not traced by the JIT, so it only speeds up the interpreter before a loop gets compiled",
+               default=False, cmdline="--direct-stack"),
     BoolOption("immutable_boolean_field_elision", "elide immutable boolean fields from structs",
                default=False, cmdline="--ibfe"),
 ])
@@ -41,6 +45,10 @@ def compute_executable_suffix(config):
         res.append("-no-callgraph")
     if not config.prune_env:
         res.append("-no-prune-env")
+    if config.optimize_ast:
+        res.append("-optimize-ast")
+    if config.direct_stack:
+        res.append("-direct-stack")
     if not config.two_state:
         res.append("-no-two-state")
     if not config.strategies:
@@ -65,6 +73,7 @@ def compute_executable_suffix(config):
 exposed_options = ['strategies',
                    'type_size_specialization',
                    'prune_env',
+                   'optimize_ast',
                    'immutable_boolean_field_elision',
 ]
 
@@ -8,11 +8,19 @@ from rpython.rlib          import jit, objectmodel
 from rpython.rlib.nonconst import NonConstant
 
 def make_entry_point(pycketconfig=None):
-    from pycket.expand import load_json_ast_rpython, expand_to_ast, PermException, ModTable
+    from pycket.expand import (load_json_ast_cached, expand_to_ast,
+        expand_module_graph, precompile, PermException, ModTable)
+    from pycket.expander_pool import start_pool, shutdown_pool, ExpanderPool
+    from pycket.expansion_cache import start_cache
+    from pycket.snapshot import load_snapshot, save_snapshot
     from pycket.interpreter import interpret_one, ToplevelEnv, interpret_module
     from pycket.error import SchemeException
-    from pycket.option_helper import parse_args, ensure_json_ast
+    from pycket.option_helper import (parse_args, ensure_json_ast,
+        expander_workers, future_workers, compile_roots, expansion_cache_dir,
+        expansion_cache_size)
+    from pycket.future import pool as future_pool
     from pycket.values_string import W_String
+    from pycket.jit_stats import stats as jit_stats, enable_timing
 
 
     def entry_point(argv):
@@ -38,28 +46,87 @@ def make_entry_point(pycketconfig=None):
         config, names, args, retval = parse_args(argv)
         if retval != 0 or config is None:
             return retval
+        cache = start_cache(expansion_cache_dir(names),
+                            expansion_cache_size(names))
+        if config.get('compile-only', False):
+            workers = expander_workers(names)
+            failures = precompile(compile_roots(names),
+                                  ExpanderPool(workers if workers > 0 else 1))
+            if cache is not None and config.get('cache-stats', False):
+                print cache.stats()
+            return 1 if failures else 0
+
+        future_pool.size = future_workers(names)
         args_w = [W_String.fromstr_utf8(arg) for arg in args]
-        module_name, json_ast = ensure_json_ast(config, names)
+        pool = start_pool(expander_workers(names))
+        try:
+            module_name, json_ast = ensure_json_ast(config, names)
+            if pool is not None and json_ast is not None:
+                # expand the dependencies concurrently before loading them
+                expand_module_graph([module_name], pool)
 
-        modtable = ModTable()
-        modtable.enter_module(module_name)
-        if json_ast is None:
-            ast = expand_to_ast(module_name, modtable)
-        else:
-            ast = load_json_ast_rpython(json_ast, modtable)
-        modtable.exit_module(module_name, ast)
+            modtable = ModTable()
+            if 'restore' in names and not load_snapshot(names['restore'], modtable):
+                print "ignoring out of date snapshot %s" % names['restore']
+                modtable = ModTable()
+            modtable.enter_module(module_name)
+            if json_ast is None:
+                ast = expand_to_ast(module_name, modtable)
+            else:
+                ast = load_json_ast_cached(json_ast, modtable)
+            modtable.exit_module(module_name, ast)
+        finally:
+            shutdown_pool()
 
         env = ToplevelEnv(pycketconfig)
         env.globalconfig.load(ast)
+        env.module_env.lazy_instantiation = config.get('lazy-modules', False)
         env.commandline_arguments = args_w
+        if 'profile' in names:
+            if not env.pycketconfig().callgraph:
+                print "--profile needs an executable translated with the callgraph"
+                return 1
+            env.callgraph.start_profile()
+        if 'load-jit-profile' in names:
+            if not env.callgraph.load_jit_profile(names['load-jit-profile']):
+                print "ignoring unreadable jit profile %s" % names['load-jit-profile']
+        if config.get('jit-stats', False):
+            enable_timing()
         env.module_env.add_module(module_name, ast)
         try:
             val = interpret_module(ast, env)
+            if 'make-snapshot' in names:
+                try:
+                    save_snapshot(names['make-snapshot'], env.module_env)
+                except OSError:
+                    print "could not write snapshot %s" % names['make-snapshot']
+                    return 1
+            if 'serve' in names:
+                from pycket.server import serve
+                return serve(names['serve'], ast, env)
         finally:
             from pycket.prims.input_output import shutdown
             if config.get('save-callgraph', False):
                 with open('callgraph.dot', 'w') as outfile:
                     env.callgraph.write_dot_file(outfile)
+            if 'save-jit-profile' in names:
+                try:
+                    env.callgraph.write_jit_profile(names['save-jit-profile'])
+                except OSError:
+                    print "could not write jit profile %s" % names['save-jit-profile']
+            if env.callgraph.profile is not None:
+                env.callgraph.stop_profile()
+                with open(names['profile'], 'w') as outfile:
+                    env.callgraph.profile.write_flat(outfile)
+                with open(names['profile'] + '.folded', 'w') as outfile:
+                    env.callgraph.profile.write_collapsed(outfile)
+            if cache is not None and config.get('cache-stats', False):
+                print cache.stats()
+            if config.get('jit-stats', False):
+                print jit_stats.format()
+            if config.get('ast-stats', False):
+                from pycket.optimizer import stats as ast_stats
+                print ast_stats.format()
             shutdown(env)
         return 0
     return entry_point
@@ -86,6 +153,11 @@ def target(driver, args): #pragma: no cover
     entry_point = make_entry_point(config)
     return entry_point, None
 
+def jitpolicy(driver): #pragma: no cover
+    from rpython.jit.codewriter.policy import JitPolicy
+    from pycket.jit_stats import hooks
+    return JitPolicy(hooks)
+
 def get_additional_config_options(): #pragma: no cover
     from pycket.config import pycketoption_descr
     return pycketoption_descr
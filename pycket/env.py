@@ -71,12 +71,50 @@ class SymList(object):
     def __repr__(self):
         return "SymList(%r, %r)" % (self.elems, self.prev)
 
+class LexicalAddress(object):
+    """ Where a variable is found in environments of a given shape: in the
+    environment of shape frame, at index, after skipping hops environments.
+    Computed once from the env_structure, so that lookups don't need to
+    compare symbols. """
+    _immutable_fields_ = ["hops", "index", "frame"]
+
+    def __init__(self, hops, index, frame):
+        self.hops = hops
+        self.index = index
+        self.frame = frame
+
+    @staticmethod
+    def make(sym, env_structure):
+        """ None if sym is not bound by env_structure. """
+        hops = 0
+        while env_structure is not None:
+            for i, x in enumerate(env_structure.elems):
+                if x is sym:
+                    return LexicalAddress(hops, i, env_structure)
+            # empty environments are not allocated, see ConsEnv.make
+            if env_structure.elems:
+                hops += 1
+            env_structure = env_structure.prev
+        return None
+
+    @jit.unroll_safe
+    def lookup(self, env):
+        for i in range(self.hops):
+            assert isinstance(env, ConsEnv)
+            env = env._prev
+        assert isinstance(env, ConsEnv)
+        return env.get_slot(self.index, self.frame)
+
 class ModuleEnv(object):
     _immutable_fields_ = ["modules", "toplevel_env"]
     def __init__(self, toplevel_env):
         self.modules = {}
         self.current_module = None
         self.toplevel_env = toplevel_env
+        # When set, definitions of lambdas and constants in module bodies are
+        # only evaluated when the variable is first looked up, see
+        # Module._interpret_mod.
+        self.lazy_instantiation = False
 
     def require(self, module_name):
         assert 0
@@ -225,5 +263,12 @@ class ConsEnv(Env):
             return self._prev
         return self
 
+    def get_slot(self, index, frame):
+        """ The value of the variable at index in frame, the env_structure
+        of this environment. """
+        v = self._get_list(index)
+        assert v is not None
+        return v
+
     def __repr__(self):
         return "<%s %r %r>" % (self.__class__.__name__, [x.tostring() for  x in self._get_full_list()], self._prev)
@@ -3,13 +3,18 @@
 #
 import os
 import sys
+import time
 
 from rpython.rlib import streamio
 from rpython.rlib.rbigint import rbigint
+from rpython.rlib.rfloat import formatd
 from rpython.rlib.objectmodel import specialize, we_are_translated
 from rpython.rlib.rstring import ParseStringError, ParseStringOverflowError
 from rpython.rlib.rarithmetic import string_to_int
 from pycket import pycket_json
+from pycket import astcache
+from pycket import expander_pool
+from pycket import expansion_cache
 from pycket.error import SchemeException
 from pycket.interpreter import *
 from pycket import values, values_string
@@ -98,6 +103,9 @@ def expand_file_rpython(rkt_file):
     cmd = "racket %s --stdout \"%s\" 2>&1" % (fn, rkt_file)
     if not os.access(rkt_file, os.R_OK):
         raise ValueError("Cannot access file %s" % rkt_file)
+    pool = expander_pool.get_pool()
+    if pool is not None:
+        return pool.expand(rkt_file)
     pipe = create_popen_file(cmd, "r")
     out = pipe.read()
     err = os.WEXITSTATUS(pipe.close())
@@ -110,12 +118,12 @@ def expand_file_cached(rkt_file, modtable):
         json_file = ensure_json_ast_run(rkt_file)
     except PermException:
         return expand_to_ast(rkt_file, modtable)
-    return load_json_ast_rpython(json_file, modtable)
+    return load_json_ast_cached(json_file, modtable)
 
 # Expand and load the module without generating intermediate JSON files.
 def expand_to_ast(fname, modtable):
     data = expand_file_rpython(fname)
-    return _to_module(pycket_json.loads(data), modtable).assign_convert_module()
+    return to_module_streaming(data, modtable).assign_convert_module()
 
 def expand(s, wrap=False, stdlib=False):
     data = expand_string(s)
@@ -149,7 +157,6 @@ def expand_file_to_json(rkt_file, json_file):
     return _expand_file_to_json(rkt_file, json_file)
 
 def _expand_file_to_json(rkt_file, json_file):
-    from rpython.rlib.rfile import create_popen_file
     if not os.access(rkt_file, os.R_OK):
         raise ValueError("Cannot access file %s" % rkt_file)
     if not os.access(rkt_file, os.W_OK):
@@ -162,6 +169,14 @@ def _expand_file_to_json(rkt_file, json_file):
     except OSError:
         pass
     print "Expanding %s to %s" % (rkt_file, json_file)
+    return _run_expander(rkt_file, json_file)
+
+def _run_expander(rkt_file, json_file):
+    from rpython.rlib.rfile import create_popen_file
+    pool = expander_pool.get_pool()
+    if pool is not None:
+        write_file_atomic(json_file, pool.expand(rkt_file))
+        return json_file
     cmd = "racket %s --output \"%s\" \"%s\" 2>&1" % (
         fn,
         json_file, rkt_file)
@@ -173,6 +188,23 @@ def _expand_file_to_json(rkt_file, json_file):
         raise ExpandException("Racket produced an error and said '%s'" % out)
     return json_file
 
+# Expand into the shared cache directory, see expansion_cache.py.
+def expand_file_to_cache(cache, rkt_file):
+    if not os.access(rkt_file, os.R_OK):
+        raise ValueError("Cannot access file %s" % rkt_file)
+    try:
+        json_file = cache.json_name(rkt_file)
+        if cache.lookup(json_file):
+            return json_file
+        tmp_file = cache.temp_name(json_file)
+        print "Expanding %s to %s" % (rkt_file, json_file)
+        _run_expander(rkt_file, tmp_file)
+        cache.insert(tmp_file, json_file)
+    except OSError:
+        # the cache directory is not writable
+        raise PermException(rkt_file)
+    return json_file
+
 def expand_code_to_json(code, json_file, stdlib=True, mcons=False, wrap=True):
     from rpython.rlib.rfile import create_popen_file
     try:
@@ -194,6 +226,17 @@ def expand_code_to_json(code, json_file, stdlib=True, mcons=False, wrap=True):
     return json_file
 
 
+# Write to a temporary file first, so that concurrent readers never see a
+# partially written file.
+def write_file_atomic(fname, data):
+    tmp_name = "%s.%d.tmp" % (fname, os.getpid())
+    f = streamio.open_file_as_stream(tmp_name, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmp_name, fname)
+
 def needs_update(file_name, json_name):
     try:
         file_mtime = os.stat(file_name).st_mtime
@@ -208,7 +251,17 @@ def needs_update(file_name, json_name):
 def _json_name(file_name):
     return file_name + '.json'
 
+def _ast_cache_name(json_name):
+    if json_name.endswith('.json'):
+        end = len(json_name) - len('.json')
+        assert end >= 0
+        json_name = json_name[:end]
+    return json_name + '.ast'
+
 def ensure_json_ast_run(file_name):
+    cache = expansion_cache.get_cache()
+    if cache is not None:
+        return expand_file_to_cache(cache, file_name)
     json = _json_name(file_name)
     if needs_update(file_name, json):
         return expand_file_to_json(file_name, json)
@@ -223,11 +276,163 @@ def ensure_json_ast_eval(code, file_name, stdlib=True, mcons=False, wrap=True):
         return json
 
 
+#### ========================== Expanding whole dependency graphs
+
+def _collect_dependencies(json, acc):
+    if json.is_array:
+        for j in json.value_array():
+            _collect_dependencies(j, acc)
+    elif json.is_object:
+        obj = json.value_object()
+        if "require" in obj:
+            for path in obj["require"].value_array():
+                path = path.value_array()
+                if path:
+                    acc.append(path[0].value_string())
+        if "language" in obj and obj["language"].is_array:
+            lang = obj["language"].value_array()
+            if lang:
+                acc.append(lang[0].value_string())
+        for j in obj.values():
+            _collect_dependencies(j, acc)
+
+def module_dependencies(json):
+    """ The files that the expanded module in json requires directly. """
+    acc = []
+    _collect_dependencies(json, acc)
+    return [fname for fname in acc
+                if fname not in [".", ".."] and not ModTable.builtin(fname)]
+
+def expand_module_graph(roots, pool, scan_all=False):
+    """ Expand the roots and everything they require, transitively, using the
+    workers of the expander pool concurrently. Modules with an up-to-date
+    json file are not expanded again. Their dependencies are only looked at
+    if scan_all is set or if the module's AST cache is out of date, otherwise
+    they are checked lazily when the module is loaded.
+
+    With a shared expansion cache the json files are looked up and stored
+    there instead of next to the sources.
+
+    Returns a list of (file name, seconds) for every module expanded. """
+    cache = expansion_cache.get_cache()
+    expanded = []
+    error = None
+    seen = {}
+    todo = []
+    _enqueue(roots, seen, todo)
+    while (todo and error is None) or pool.busy():
+        while todo and error is None and pool.has_idle_worker():
+            fname = todo.pop()
+            if cache is not None:
+                json_file = cache.json_name(fname)
+                stale = not cache.lookup(json_file)
+            else:
+                json_file = _json_name(fname)
+                stale = needs_update(fname, json_file)
+            if stale:
+                if cache is None and not os.access(fname, os.W_OK):
+                    # loaded without a json file, see expand_file_cached
+                    continue
+                pool.submit(fname)
+            elif scan_all or needs_update(json_file, _ast_cache_name(json_file)):
+                json = pycket_json.loads(readfile_rpython(json_file))
+                _enqueue(module_dependencies(json), seen, todo)
+        if pool.busy():
+            fname, ok, data, seconds = pool.wait_any()
+            if not ok:
+                if error is None:
+                    error = "Racket produced an error for %s and said '%s'" % (fname, data)
+                continue
+            if cache is not None:
+                try:
+                    cache.store(cache.json_name(fname), data)
+                except OSError:
+                    # the module is loaded without a json file, see
+                    # expand_file_cached
+                    pass
+            else:
+                write_file_atomic(_json_name(fname), data)
+            expanded.append((fname, seconds))
+            _enqueue(module_dependencies(pycket_json.loads(data)), seen, todo)
+    if error is not None:
+        raise ExpandException(error)
+    return expanded
+
+def _enqueue(fnames, seen, todo):
+    for fname in fnames:
+        if fname not in seen:
+            seen[fname] = None
+            todo.append(fname)
+
+def find_racket_files(path, acc):
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            find_racket_files(os.path.join(path, name), acc)
+    elif path.endswith(".rkt"):
+        acc.append(path)
+    return acc
+
+def _seconds(t):
+    return formatd(t, 'f', 3)
+
+def precompile(roots, pool):
+    """ Expand the roots and all their dependencies to json and build the AST
+    caches for them, reporting the time spent on every module. Returns the
+    number of modules that failed. """
+    start = time.time()
+    failures = 0
+    try:
+        expanded = expand_module_graph(roots, pool, scan_all=True)
+    except SchemeException, e:
+        print "error: %s" % e.msg
+        return 1
+    finally:
+        pool.shutdown()
+    expand_time = 0.0
+    for fname, seconds in expanded:
+        print "expanded %ss %s" % (_seconds(seconds), fname)
+        expand_time += seconds
+    print "expanded %d modules, %ss of expansion in %ss" % (
+        len(expanded), _seconds(expand_time), _seconds(time.time() - start))
+    load_start = time.time()
+    modtable = ModTable()
+    for fname in roots:
+        if modtable.has_module(fname):
+            continue
+        try:
+            load_required_module(fname, modtable)
+        except SchemeException, e:
+            print "error: could not load %s: %s" % (fname, e.msg)
+            failures += 1
+    print "loaded %d modules in %ss" % (len(modtable.table), _seconds(time.time() - load_start))
+    return failures
+
+
 #### ========================== Functions for parsing json to an AST
 
 def load_json_ast_rpython(fname, modtable):
     data = readfile_rpython(fname)
-    return _to_module(pycket_json.loads(data), modtable).assign_convert_module()
+    return to_module_streaming(data, modtable).assign_convert_module()
+
+# Like load_json_ast_rpython, but goes through the binary AST cache next to the
+# json file. The cache is used if it is newer than the json file and was
+# written for a json file with the same contents (by hash), otherwise it is
+# (re)generated.
+def load_json_ast_cached(json_file, modtable):
+    cache_file = _ast_cache_name(json_file)
+    if not needs_update(json_file, cache_file):
+        module = astcache.load_module(cache_file, json_file, modtable)
+        if module is not None:
+            return module
+    module = load_json_ast_rpython(json_file, modtable)
+    cache = expansion_cache.get_cache()
+    if cache is not None and cache.contains(cache_file):
+        old_size = expansion_cache.file_size(cache_file)
+        if astcache.save_module(module, cache_file, json_file):
+            cache.file_written(cache_file, old_size)
+    else:
+        astcache.save_module(module, cache_file, json_file)
+    return module
 
 def parse_ast(json_string):
     json = pycket_json.loads(json_string)
@@ -299,24 +504,125 @@ def mksym(json):
     assert 0, json.tostring()
 
 def _to_module(json, modtable):
+    from pycket.interpreter import Module
     # YYY
     v = json.value_object()
     if "body-forms" in v:
         config = {}
         if "config" in v:
-            for (k, _v) in v["config"].value_object().iteritems():
-                config[k] = _v.value_string()
+            config = to_module_config(v["config"])
 
         if "language" in v:
-            lang = [parse_require([b.value_string()], modtable) for b in v["language"].value_array()]
+            lang = to_module_lang(v["language"], modtable)
         else:
             lang = None
-        lang = lang[0] if lang else None
-        body = [_to_ast(x, modtable) for x in v["body-forms"].value_array()]
-        return Module(v["module-name"].value_string(), body, config, lang=lang)
+        body = []
+        provides = {}
+        for x in v["body-forms"].value_array():
+            _collect_provides(x, provides)
+            body.append(_to_ast(x, modtable))
+        return Module(v["module-name"].value_string(), body, config, lang=lang,
+                      provides=provides)
     else:
         assert 0
 
+def _identifier_name(obj):
+    """ The name an identifier is written with in the source. """
+    if "module" in obj and obj["module"].is_string:
+        return obj["module"].value_string()
+    for key in ["source-name", "toplevel", "lexical"]:
+        if key in obj:
+            return obj[key].value_string()
+    return None
+
+def _collect_provides(json, provides):
+    """ Adds the names exported by json to provides if it is a #%provide
+    form, see Module.provides. Only identifiers, renames and protected specs
+    are understood, other specs (for other phases, say) export nothing. """
+    if not json.is_array:
+        return
+    arr = json.value_array()
+    if not arr or not arr[0].is_object:
+        return
+    head = arr[0].value_object()
+    if not ("source-name" in head and
+            ("source-module" not in head or
+             head["source-module"].value_string() == "#%kernel") and
+            head["source-name"].value_string() == "#%provide"):
+        return
+    for spec in arr[1:]:
+        _collect_provide_spec(spec, provides)
+
+def _collect_provide_spec(spec, provides):
+    if spec.is_object:
+        obj = spec.value_object()
+        name = _identifier_name(obj)
+        if name is not None and "source-name" in obj:
+            provides[name] = values.W_Symbol.make(obj["source-name"].value_string())
+        return
+    if not spec.is_array:
+        return
+    arr = spec.value_array()
+    if not arr or not arr[0].is_object:
+        return
+    kind = _identifier_name(arr[0].value_object())
+    if kind == "protect":
+        for sub in arr[1:]:
+            _collect_provide_spec(sub, provides)
+    elif kind == "rename" and len(arr) == 3:
+        if arr[1].is_object and arr[2].is_object:
+            local = arr[1].value_object()
+            name = _identifier_name(arr[2].value_object())
+            if name is not None and "source-name" in local:
+                provides[name] = values.W_Symbol.make(local["source-name"].value_string())
+
+def to_module_config(json):
+    config = {}
+    for (k, _v) in json.value_object().iteritems():
+        config[k] = _v.value_string()
+    return config
+
+def to_module_lang(json, modtable):
+    lang = [parse_require([b.value_string()], modtable) for b in json.value_array()]
+    return lang[0] if lang else None
+
+# Same as _to_module, but the body forms are decoded and converted one at a
+# time, so that the json tree of the whole module is never alive at once.
+def _to_module_stream(parser, modtable):
+    from pycket.interpreter import Module
+    name = None
+    body = None
+    config = {}
+    lang = None
+    provides = {}
+    parser.start_object()
+    while True:
+        key = parser.next_key()
+        if key is None:
+            break
+        if key == "body-forms":
+            body = []
+            parser.start_array()
+            while parser.next_element():
+                form = parser.read_value()
+                _collect_provides(form, provides)
+                body.append(_to_ast(form, modtable))
+        elif key == "module-name":
+            name = parser.read_value().value_string()
+        elif key == "config":
+            config = to_module_config(parser.read_value())
+        elif key == "language":
+            lang = to_module_lang(parser.read_value(), modtable)
+        else:
+            parser.read_value()
+    parser.finish()
+    if name is None or body is None:
+        raise ExpandException("malformed module json")
+    return Module(name, body, config, lang=lang, provides=provides)
+
+def to_module_streaming(data, modtable):
+    return _to_module_stream(pycket_json.JsonPullParser(data), modtable)
+
 # A table listing all the module files that have been loaded.
 # A module need only be loaded once.
 # Modules (aside from builtins like #%kernel) are listed in the table
@@ -380,15 +686,18 @@ def shorten_submodule_path(path):
             acc.append(p)
     return acc[:]
 
-def _to_require(fname, modtable, path=None):
-    path = shorten_submodule_path(path)
+def load_required_module(fname, modtable):
     if modtable.has_module(fname):
-        if modtable.builtin(fname):
-            return VOID
-        return Require(fname, modtable, path=path)
+        return
     modtable.enter_module(fname)
     module = expand_file_cached(fname, modtable)
     modtable.exit_module(fname, module)
+
+def _to_require(fname, modtable, path=None):
+    path = shorten_submodule_path(path)
+    if modtable.builtin(fname):
+        return VOID
+    load_required_module(fname, modtable)
     return Require(fname, modtable, path=path)
 
 def parse_require(path, modtable):
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A pool of resident Racket expander processes.
+#
+# Starting Racket and loading the expander takes much longer than expanding a
+# typical module, so instead of running `racket -l pycket/expand` once per
+# file we keep a few `expand.rkt --server` processes around for the whole
+# session. Requests and replies are length-prefixed frames on the processes'
+# stdin and stdout (see the server mode in pycket-lang/expand.rkt). Several
+# workers can expand independent modules at the same time.
+
+import os
+import time
+
+from rpython.rlib import rpoll
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.rstring import ParseStringError
+
+from pycket.error import SchemeException
+
+SERVER_CMD = "exec racket -l pycket/expand -- --server"
+
+DEFAULT_WORKERS = 4
+
+class ExpanderError(SchemeException):
+    pass
+
+def _write_all(fd, data):
+    while data:
+        written = os.write(fd, data)
+        if written <= 0:
+            raise ExpanderError("could not write to expander process")
+        data = data[written:]
+
+class ExpanderWorker(object):
+    def __init__(self, pid, write_fd, read_fd):
+        self.pid = pid
+        self.write_fd = write_fd
+        self.read_fd = read_fd
+        # name of the file currently being expanded, None when idle
+        self.current = None
+        self.start_time = 0.0
+        self._reset_frame()
+
+    @staticmethod
+    def spawn():
+        to_child_read, to_child_write = os.pipe()
+        from_child_read, from_child_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # child
+            try:
+                os.dup2(to_child_read, 0)
+                os.dup2(from_child_write, 1)
+                for fd in [to_child_read, to_child_write,
+                           from_child_read, from_child_write]:
+                    os.close(fd)
+                os.execv("/bin/sh", ["/bin/sh", "-c", SERVER_CMD])
+            finally:
+                os._exit(127)
+        os.close(to_child_read)
+        os.close(from_child_write)
+        return ExpanderWorker(pid, to_child_write, from_child_read)
+
+    def _reset_frame(self):
+        self.chunks = []
+        self.size = 0
+        self.expected = -1
+        self.is_error = False
+
+    def is_idle(self):
+        return self.current is None
+
+    def submit(self, fname):
+        assert self.current is None
+        self.current = fname
+        self.start_time = time.time()
+        _write_all(self.write_fd, "%d\n%s" % (len(fname), fname))
+
+    def _parse_header(self):
+        data = "".join(self.chunks)
+        newline = data.find("\n")
+        if newline < 0:
+            self.chunks = [data]
+            return
+        header = data[:newline]
+        if header.startswith("!"):
+            self.is_error = True
+            header = header[1:]
+        try:
+            self.expected = string_to_int(header)
+        except ParseStringError:
+            raise ExpanderError("malformed reply from expander process")
+        rest = data[newline + 1:]
+        self.chunks = [rest]
+        self.size = len(rest)
+
+    def receive(self):
+        """ Read what is available from the process. Returns True once the
+        reply to the current request is complete. """
+        data = os.read(self.read_fd, 65536)
+        if not data:
+            raise ExpanderError("expander process for %s exited unexpectedly" % self.current)
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.expected < 0:
+            self._parse_header()
+        return self.expected >= 0 and self.size >= self.expected
+
+    def take_reply(self):
+        """ Returns (file name, success, json or error message, seconds) for
+        the completed request and makes the worker idle again. """
+        data = "".join(self.chunks)
+        if len(data) != self.expected:
+            raise ExpanderError("malformed reply from expander process")
+        result = (self.current, not self.is_error, data,
+                  time.time() - self.start_time)
+        self.current = None
+        self._reset_frame()
+        return result
+
+    def shutdown(self):
+        try:
+            os.close(self.write_fd)
+            os.close(self.read_fd)
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+
+
+class ExpanderPool(object):
+    """ Workers are started lazily, so a session in which every module is
+    already expanded never starts Racket at all. """
+
+    def __init__(self, size=DEFAULT_WORKERS):
+        assert size > 0
+        self.size = size
+        self.workers = []
+
+    def _idle_worker(self):
+        for w in self.workers:
+            if w.is_idle():
+                return w
+        if len(self.workers) < self.size:
+            w = ExpanderWorker.spawn()
+            self.workers.append(w)
+            return w
+        return None
+
+    def has_idle_worker(self):
+        if len(self.workers) < self.size:
+            return True
+        for w in self.workers:
+            if w.is_idle():
+                return True
+        return False
+
+    def busy(self):
+        for w in self.workers:
+            if not w.is_idle():
+                return True
+        return False
+
+    def submit(self, fname):
+        w = self._idle_worker()
+        assert w is not None
+        w.submit(fname)
+
+    def wait_any(self):
+        """ Block until one of the submitted requests is done and return its
+        (file name, success, json or error message, seconds). """
+        while True:
+            fds = {}
+            for w in self.workers:
+                if not w.is_idle():
+                    fds[w.read_fd] = rpoll.POLLIN
+            assert fds, "no expansion in progress"
+            ready = rpoll.poll(fds, -1)
+            for fd, _ in ready:
+                for w in self.workers:
+                    if w.read_fd == fd and not w.is_idle():
+                        if w.receive():
+                            return w.take_reply()
+
+    def expand(self, fname):
+        """ Expand a single file and return its json. """
+        assert not self.busy()
+        self.submit(fname)
+        _, ok, data, _ = self.wait_any()
+        if not ok:
+            raise ExpanderError("Racket produced an error and said '%s'" % data)
+        return data
+
+    def shutdown(self):
+        for w in self.workers:
+            w.shutdown()
+        self.workers = []
+
+
+class PoolState(object):
+    def __init__(self):
+        self.pool = None
+
+state = PoolState()
+
+def get_pool():
+    return state.pool
+
+def start_pool(size):
+    if size > 0 and state.pool is None:
+        state.pool = ExpanderPool(size)
+    return state.pool
+
+def shutdown_pool():
+    if state.pool is not None:
+        state.pool.shutdown()
+        state.pool = None
@@ -0,0 +1,265 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A content-addressed cache directory for expanded modules.
+#
+# By default the json for foo.rkt is written to foo.rkt.json next to the
+# source and is considered valid as long as it is newer than the source. With
+# a cache directory (--cache-dir or PYCKET_CACHE_DIR) the json is instead
+# stored under a key computed from the contents of the source and the version
+# of the expander, so read-only source trees work, a fresh checkout does not
+# cause re-expansion, and any number of pycket processes on one host can share
+# the expansions. The binary AST cache (see astcache.py) is kept next to the
+# json in the cache directory.
+#
+# Layout: <dir>/<key[:2]>/<key>.json and <key>.ast. The expanded json contains
+# absolute paths, so the path of the source is part of the key as well.
+#
+# Entries are written atomically and evicted in least recently used order
+# once the directory grows beyond its size limit. Every hit touches the entry,
+# so its modification time records when it was last used.
+
+import os
+
+from rpython.rlib import streamio
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rsha import RSHA
+
+DEFAULT_SIZE = 512 # megabytes
+
+# Evicting stops once the cache is this fraction of its maximal size, so that
+# not every insertion into a full cache triggers an eviction.
+EVICT_TO = 0.9
+
+def _expander_version():
+    "NOT_RPYTHON"
+    import hashlib
+    expander = os.path.join(os.path.dirname(__file__), "pycket-lang", "expand.rkt")
+    try:
+        f = open(expander)
+        try:
+            return hashlib.sha1(f.read()).hexdigest()
+        finally:
+            f.close()
+    except IOError:
+        return "unknown"
+
+EXPANDER_VERSION = _expander_version()
+
+
+def _make_dir(path):
+    if not os.path.isdir(path):
+        try:
+            os.mkdir(path)
+        except OSError:
+            # created concurrently by another process
+            if not os.path.isdir(path):
+                raise
+
+
+def file_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+class SourceKey(object):
+    """ The key computed for a source file while it had the given
+    modification time and size. """
+    def __init__(self, key, mtime, size):
+        self.key = key
+        self.mtime = mtime
+        self.size = size
+
+
+class CacheEntry(object):
+    def __init__(self, key):
+        self.key = key
+        self.files = []
+        self.size = 0
+        self.last_used = 0.0
+
+    def add_file(self, path, st):
+        self.files.append(path)
+        self.size += st.st_size
+        if st.st_mtime > self.last_used:
+            self.last_used = st.st_mtime
+
+BaseSorter = make_timsort_class()
+
+class EntrySorter(BaseSorter):
+    def lt(self, a, b):
+        return a.last_used < b.last_used
+
+
+class ExpansionCache(object):
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        # estimate of the size of the directory, -1 until it is first scanned
+        self.size = -1
+        # source file -> SourceKey
+        self.keys = {}
+        # the json files whose lookup was counted already
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, rkt_file):
+        """ The key of the current contents of rkt_file. It is computed again
+        when the modification time or the size of the file changed. """
+        st = os.stat(rkt_file)
+        known = self.keys.get(rkt_file, None)
+        if (known is not None and known.mtime == st.st_mtime and
+                known.size == st.st_size):
+            return known.key
+        f = streamio.open_file_as_stream(rkt_file)
+        try:
+            source = f.readall()
+        finally:
+            f.close()
+        sha = RSHA(EXPANDER_VERSION)
+        sha.update("\0")
+        sha.update(os.path.abspath(rkt_file))
+        sha.update("\0")
+        sha.update(source)
+        key = sha.hexdigest()
+        self.keys[rkt_file] = SourceKey(key, st.st_mtime, st.st_size)
+        return key
+
+    def json_name(self, rkt_file):
+        key = self.key(rkt_file)
+        return os.path.join(os.path.join(self.directory, key[:2]), key + ".json")
+
+    def lookup(self, json_file):
+        """ Whether the cache has an entry for json_file, records the use of
+        the entry. Only the first lookup of an entry in a run is counted. """
+        if json_file in self.used:
+            return os.access(json_file, os.F_OK)
+        if not os.access(json_file, os.F_OK):
+            self.misses += 1
+            return False
+        self.used[json_file] = None
+        self.hits += 1
+        # Touch the AST cache rather than the json if there is one, the AST
+        # cache is only used while it is newer than the json.
+        from pycket.expand import _ast_cache_name
+        ast_file = _ast_cache_name(json_file)
+        try:
+            if os.access(ast_file, os.F_OK):
+                os.utime(ast_file, None)
+            else:
+                os.utime(json_file, None)
+        except OSError:
+            pass
+        return True
+
+    def temp_name(self, json_file):
+        """ A file name to expand json_file to before inserting it. """
+        _make_dir(self.directory)
+        _make_dir(os.path.dirname(json_file))
+        return "%s.%d.tmp" % (json_file, os.getpid())
+
+    def insert(self, tmp_file, json_file):
+        """ Move the expansion in tmp_file into the cache. """
+        size = os.stat(tmp_file).st_size
+        os.rename(tmp_file, json_file)
+        self.grown(size)
+
+    def contains(self, path):
+        return path.startswith(os.path.join(self.directory, ""))
+
+    def file_written(self, path, old_size):
+        """ Counts a file written into the cache next to an entry (an AST
+        cache), which replaced a file of old_size bytes. """
+        self.grown(file_size(path) - old_size)
+
+    def grown(self, size):
+        if self.size < 0:
+            self.scan()
+        else:
+            self.size += size
+        if self.size > self.max_size:
+            self.evict()
+
+    def store(self, json_file, data):
+        tmp_file = self.temp_name(json_file)
+        f = streamio.open_file_as_stream(tmp_file, "w")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        self.insert(tmp_file, json_file)
+
+    def scan(self):
+        """ Group the files in the cache by key and compute the total size. """
+        entries = {}
+        total = 0
+        if not os.path.isdir(self.directory):
+            self.size = 0
+            return []
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.endswith(".tmp"):
+                    # still being written
+                    continue
+                dot = name.find(".")
+                key = name[:dot] if dot >= 0 else name
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if key in entries:
+                    entry = entries[key]
+                else:
+                    entry = CacheEntry(key)
+                    entries[key] = entry
+                entry.add_file(path, st)
+                total += st.st_size
+        self.size = total
+        return entries.values()
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is well
+        below its maximal size. Other processes may evict concurrently, so
+        files that are already gone are ignored. """
+        entries = self.scan()
+        EntrySorter(entries).sort()
+        limit = int(self.max_size * EVICT_TO)
+        for entry in entries:
+            if self.size <= limit:
+                break
+            for path in entry.files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.size -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        return "expansion cache: %d hits, %d misses, %d evictions" % (
+            self.hits, self.misses, self.evictions)
+
+
+class CacheState(object):
+    def __init__(self):
+        self.cache = None
+
+state = CacheState()
+
+def get_cache():
+    return state.cache
+
+def start_cache(directory, max_size):
+    if directory:
+        state.cache = ExpansionCache(directory, max_size)
+    else:
+        state.cache = None
+    return state.cache
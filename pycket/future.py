@@ -0,0 +1,338 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Futures, run in forked worker processes.
+#
+# A future whose thunk only refers to numbers and other immutable atoms,
+# vectors of numbers and closures over these is run by a forked process,
+# up to --future-workers of them at a time; the others wait for a worker or
+# are run inline when they are touched first. All other futures run inline,
+# on their first touch. This includes what the code of the closures reaches
+# through module-level variables: they must not be set! and their values
+# must be of the same kinds. The worker sends back the result together with
+# the elements of the thunk's vectors that the thunk changed, which are
+# written into the parent's vectors. Futures that write to disjoint parts of
+# a vector can therefore work on it in parallel. If the worker fails or its
+# result can't be serialized the future runs inline instead, to report the
+# error in the parent. Output of the thunk is flushed before the worker
+# ends.
+
+import os
+
+from pycket           import values, values_string
+from pycket.cont      import BaseCont
+from pycket.env       import ConsEnv
+from pycket.error     import SchemeException
+from pycket.scheduler import scheduler, ThreadSwitch
+from pycket.serialize import Reader, SerializationError, Writer
+from pycket.vector    import (W_Vector, W_FlVector, FixnumVectorStrategy,
+                              FlonumVectorStrategy)
+from rpython.rlib     import rpoll
+
+DEFAULT_WORKERS = 4
+
+# closures nested deeper than this are not shipped to a worker
+MAX_DEPTH = 8
+
+READ_SIZE = 65536
+
+# future states
+INLINE  = 0
+QUEUED  = 1
+RUNNING = 2
+DONE    = 3
+
+def numeric_vector(w_vec):
+    strategy = w_vec.get_strategy()
+    return (isinstance(strategy, FixnumVectorStrategy) or
+            isinstance(strategy, FlonumVectorStrategy))
+
+class Eligibility(object):
+    """ Decides whether a worker can run code that refers to some values,
+    collecting the mutable vectors reachable from them. """
+    def __init__(self, env):
+        self.env = env
+        self.vectors = []
+        # the lambdas whose code was checked
+        self.checked = {}
+
+    def value_ok(self, w_obj, depth):
+        if depth > MAX_DEPTH:
+            return False
+        if (isinstance(w_obj, values.W_Number) or
+                isinstance(w_obj, values.W_Bool) or
+                isinstance(w_obj, values.W_Character) or
+                isinstance(w_obj, values.W_Symbol) or
+                isinstance(w_obj, values.W_Prim) or
+                w_obj is values.w_null or w_obj is values.w_void):
+            return True
+        if isinstance(w_obj, values_string.W_String):
+            return w_obj.immutable()
+        if isinstance(w_obj, W_FlVector) or isinstance(w_obj, W_Vector):
+            if not numeric_vector(w_obj):
+                return False
+            if not w_obj.immutable() and w_obj not in self.vectors:
+                self.vectors.append(w_obj)
+            return True
+        if isinstance(w_obj, values.W_PromotableClosure):
+            return self.code_ok(w_obj.closure.caselam, depth)
+        if isinstance(w_obj, values.W_Closure):
+            for i in range(w_obj._get_size_list()):
+                env = w_obj._get_list(i)
+                if isinstance(env, ConsEnv) and not self.env_ok(env, depth):
+                    return False
+            return self.code_ok(w_obj.caselam, depth)
+        if isinstance(w_obj, values.W_Closure1AsEnv):
+            return (self.env_ok(w_obj, depth) and
+                    self.code_ok(w_obj.caselam, depth))
+        return False
+
+    def env_ok(self, env, depth):
+        for i in range(env._get_size_list()):
+            if not self.value_ok(env._get_list(i), depth + 1):
+                return False
+        return True
+
+    def code_ok(self, caselam, depth):
+        """ Whether the module-level variables the code of caselam refers to
+        are never set! and bound to values a worker can use. """
+        from pycket.interpreter import ModuleVar, ToplevelVar
+        for lam in caselam.lams:
+            if lam in self.checked:
+                continue
+            self.checked[lam] = None
+            todo = lam.body[:]
+            while todo:
+                ast = todo.pop()
+                if isinstance(ast, ToplevelVar):
+                    return False
+                if isinstance(ast, ModuleVar) and not ast.is_primitive():
+                    if not self.module_var_ok(ast, depth):
+                        return False
+                todo.extend(ast.direct_children())
+        return True
+
+    def module_var_ok(self, var, depth):
+        if self.env is None:
+            return False
+        try:
+            if var.is_mutable(self.env):
+                return False
+            w_val = var._lookup(self.env)
+        except SchemeException:
+            return False
+        if w_val is None:
+            # not defined yet
+            return False
+        return self.value_ok(w_val, depth + 1)
+
+def same_element(w_a, w_b):
+    if isinstance(w_a, values.W_Flonum) and isinstance(w_b, values.W_Flonum):
+        return w_a.value == w_b.value
+    if isinstance(w_a, values.W_Fixnum) and isinstance(w_b, values.W_Fixnum):
+        return w_a.value == w_b.value
+    return w_a is w_b
+
+class W_Future(values.W_Object):
+    errorname = "future"
+    _attrs_ = ['thunk', 'env', 'paramz', 'vectors', 'state', 'pid', 'fd',
+               'buffer', 'result']
+
+    def __init__(self, thunk, env, paramz, vectors, state):
+        self.thunk = thunk
+        self.env = env
+        # the parameterization the thunk runs with in a worker
+        self.paramz = paramz
+        self.vectors = vectors
+        self.state = state
+        self.pid = 0
+        self.fd = -1
+        self.buffer = ""
+        self.result = None
+
+    def poll(self):
+        """ Reads from the worker without blocking. Returns True once the
+        worker has ended. """
+        assert self.state == RUNNING
+        while True:
+            try:
+                if not rpoll.poll({self.fd: rpoll.POLLIN}, 0):
+                    return False
+            except rpoll.PollError:
+                pass
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError:
+                data = ""
+            if not data:
+                break
+            self.buffer += data
+        os.close(self.fd)
+        os.waitpid(self.pid, 0)
+        self.finish(self.buffer)
+        self.buffer = ""
+        pool.worker_done(self)
+        return True
+
+    def finish(self, data):
+        """ Takes the result from the message of the worker. If there is no
+        result the future runs inline on touch. """
+        self.state = INLINE
+        if not data:
+            pool.failures += 1
+            return
+        reader = Reader(data)
+        try:
+            if not reader.read_bool():
+                pool.failures += 1
+                return
+            w_result = reader.read_value()
+            for i in range(reader.read_uint()):
+                w_vec = self.vectors[reader.read_uint()]
+                index = reader.read_uint()
+                w_vec.set(index, reader.read_value())
+        except SchemeException:
+            pool.failures += 1
+            return
+        self.set_result(values.Values.make1(w_result))
+
+    def set_result(self, vals):
+        self.result = vals
+        self.state = DONE
+        self.thunk = None
+        self.env = None
+        self.paramz = None
+        self.vectors = None
+
+    def tostring(self):
+        return "#<future>"
+
+class FutureEvt(values.W_Evt):
+    """ Ready when the worker of the future has ended. """
+    _immutable_fields_ = ['future']
+
+    def __init__(self, future):
+        self.future = future
+
+    def try_sync(self):
+        if self.future.state != RUNNING or self.future.poll():
+            return self
+        return None
+
+    def needs_polling(self):
+        return True
+
+class FutureDoneCont(BaseCont):
+    """ Sends the result of the thunk to the parent and ends the worker. """
+    _immutable_fields_ = ['future', 'fd', 'snapshot']
+
+    def __init__(self, future, fd, snapshot):
+        BaseCont.__init__(self)
+        self.future = future
+        self.fd = fd
+        self.snapshot = snapshot
+
+    def _clone(self):
+        return FutureDoneCont(self.future, self.fd, self.snapshot)
+
+    def message(self, vals):
+        writer = Writer()
+        if vals.num_values() != 1:
+            writer.write_bool(False)
+            return writer.getvalue()
+        writer.write_bool(True)
+        try:
+            writer.write_value(vals.get_value(0))
+            changes = Writer()
+            count = 0
+            for i, w_vec in enumerate(self.future.vectors):
+                old = self.snapshot[i]
+                for j in range(w_vec.length()):
+                    w_elem = w_vec.ref(j)
+                    if j >= len(old) or not same_element(old[j], w_elem):
+                        changes.write_uint(i)
+                        changes.write_uint(j)
+                        changes.write_value(w_elem)
+                        count += 1
+        except SerializationError:
+            writer = Writer()
+            writer.write_bool(False)
+            return writer.getvalue()
+        writer.write_uint(count)
+        writer.write_raw(changes.getvalue())
+        return writer.getvalue()
+
+    def plug_reduce(self, vals, env):
+        from pycket.prims.input_output import shutdown
+        shutdown(env)
+        data = self.message(vals)
+        while data:
+            try:
+                written = os.write(self.fd, data)
+            except OSError:
+                break
+            data = data[written:]
+        os._exit(0)
+
+class FuturePool(object):
+    def __init__(self):
+        self.size = DEFAULT_WORKERS
+        self.running = []
+        self.queued = []
+        # the futures started in a worker, and those that ran inline after
+        # their worker gave no result
+        self.started = 0
+        self.failures = 0
+
+    def submit(self, future):
+        if len(self.running) < self.size:
+            self.start(future)
+        else:
+            future.state = QUEUED
+            self.queued.append(future)
+
+    def start(self, future):
+        from pycket.prims.input_output import shutdown
+        # output that is still buffered would be written by both processes
+        shutdown(future.env)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid != 0:
+            os.close(write_fd)
+            future.state = RUNNING
+            future.pid = pid
+            future.fd = read_fd
+            self.running.append(future)
+            self.started += 1
+            return
+        os.close(read_fd)
+        snapshot = [[w_vec.ref(j) for j in range(w_vec.length())]
+                        for w_vec in future.vectors]
+        thread = values.W_Thread(future.thunk)
+        cont = FutureDoneCont(future, write_fd, snapshot)
+        cont.update_cm(values.parameterization_key, future.paramz)
+        thread.env = future.env
+        thread.cont = cont
+        scheduler.enter_child(False, thread)
+        raise ThreadSwitch
+
+    def unqueue(self, future):
+        self.queued.remove(future)
+        future.state = INLINE
+
+    def worker_done(self, future):
+        self.running.remove(future)
+        while self.queued and len(self.running) < self.size:
+            self.start(self.queued.pop(0))
+
+pool = FuturePool()
+
+def make_future(thunk, env, paramz, inline):
+    if inline or pool.size == 0:
+        return W_Future(thunk, env, paramz, None, INLINE)
+    eligibility = Eligibility(env)
+    if not eligibility.value_ok(thunk, 0):
+        return W_Future(thunk, env, paramz, None, INLINE)
+    future = W_Future(thunk, env, paramz, eligibility.vectors, QUEUED)
+    pool.submit(future)
+    return future
@@ -43,6 +43,13 @@ class W_HashTable(W_Object):
         # see get_dict_item at the bottom of the file for the interface
         raise NotImplementedError("abstract method")
 
+    def next_position(self, i):
+        """ The iteration position after i (-1 for the first one), -1 if
+        there is none. """
+        if i + 1 >= self.length():
+            return -1
+        return i + 1
+
 class W_MutableHashTable(W_HashTable):
     _attrs_ = []
     _immutable_fields_ = []
@@ -1,51 +1,209 @@
 
 from pycket                   import config
-from pycket                   import values, values_string
+from pycket                   import values, values_string, values_struct
+from pycket                   import vector as values_vector
 from pycket.base              import SingletonMeta
-from pycket.hash.base         import W_HashTable, get_dict_item, w_missing
+from pycket.hash.base         import (W_HashTable, W_ImmutableHashTable,
+    get_dict_item, w_missing)
+from pycket.hash.persistent_hash_map import make_persistent_hash_type
 from pycket.error             import SchemeException
 from pycket.cont              import continuation, loop_label
 from rpython.rlib             import rerased
+from rpython.rlib.rarithmetic import intmask, r_uint
 from rpython.rlib.objectmodel import compute_hash, import_from_mixin, r_dict, specialize
 
+class UnhashableKey(Exception):
+    pass
+
+# keys nested deeper than this are not hashed, this also stops at cycles
+MAX_HASH_DEPTH = 32
+
+def _equal_hash(w_obj, depth):
+    """ A hash of w_obj that is the same for all values equal? to it. Leaves
+    use their hash_equal methods, compound values are traversed here because
+    the hash_equal of conses and vectors falls back to the identity hash for
+    elements like structs. Raises UnhashableKey if w_obj contains a value whose
+    equality cannot be decided without running Racket code, such as
+    impersonators and structs with prop:equal+hash. Two values that can be
+    hashed can be compared with equal_simple. """
+    if depth > MAX_HASH_DEPTH:
+        raise UnhashableKey
+    if w_obj.is_proxy():
+        raise UnhashableKey
+    if isinstance(w_obj, values.W_Cons):
+        x = 0x345678
+        while isinstance(w_obj, values.W_Cons):
+            y = _equal_hash(w_obj.car(), depth + 1)
+            x = intmask((1000003 * x) ^ y)
+            w_obj = w_obj.cdr()
+        return intmask(x ^ _equal_hash(w_obj, depth + 1))
+    if (isinstance(w_obj, values.W_Number) or
+        isinstance(w_obj, values_string.W_String) or
+        isinstance(w_obj, values.W_Bytes) or
+        isinstance(w_obj, values.W_Character) or
+        isinstance(w_obj, values_vector.W_FlVector)):
+        return w_obj.hash_equal()
+    if (isinstance(w_obj, values.W_Symbol) or
+        isinstance(w_obj, values.W_Keyword) or
+        isinstance(w_obj, values.W_Bool) or
+        isinstance(w_obj, values.W_Null) or
+        isinstance(w_obj, values.W_Void) or
+        isinstance(w_obj, values.W_Procedure)):
+        return compute_hash(w_obj)
+    if isinstance(w_obj, values_vector.W_Vector):
+        x = 0x456789
+        for i in range(w_obj.length()):
+            y = _equal_hash(w_obj.ref(i), depth + 1)
+            x = intmask((1000003 * x) ^ y)
+        return x
+    if isinstance(w_obj, values.W_MBox) or isinstance(w_obj, values.W_IBox):
+        return intmask(0x234567 ^ _equal_hash(_box_value(w_obj), depth + 1))
+    if isinstance(w_obj, values.W_MCons):
+        x = intmask((1000003 * 0x567890) ^ _equal_hash(w_obj.car(), depth + 1))
+        return intmask((1000003 * x) ^ _equal_hash(w_obj.cdr(), depth + 1))
+    if isinstance(w_obj, values_struct.W_RootStruct):
+        w_type = w_obj.struct_type()
+        if w_type.read_prop(values_struct.w_prop_equal_hash):
+            raise UnhashableKey
+        if w_type.isopaque:
+            return compute_hash(w_obj)
+        x = compute_hash(w_type.name.utf8value)
+        for w_val in w_obj.vals():
+            y = _equal_hash(w_val, depth + 1)
+            x = intmask((1000003 * x) ^ y)
+        return x
+    raise UnhashableKey
+
+def _box_value(w_box):
+    if isinstance(w_box, values.W_MBox):
+        return w_box.value
+    assert isinstance(w_box, values.W_IBox)
+    return w_box.value
+
+def equal_simple(a, b):
+    """ equal? for two values that _equal_hash accepts, following
+    pycket.prims.equal.equal_func_impl without continuations. """
+    while True:
+        if a.eqv(b):
+            return True
+        if isinstance(a, values.W_Cons) and isinstance(b, values.W_Cons):
+            if not equal_simple(a.car(), b.car()):
+                return False
+            a, b = a.cdr(), b.cdr()
+            continue
+        break
+    if isinstance(a, values_string.W_String) and isinstance(b, values_string.W_String):
+        return a.equal(b)
+    if isinstance(a, values.W_Bytes) and isinstance(b, values.W_Bytes):
+        return a.equal(b)
+    if isinstance(a, values.W_MCons) and isinstance(b, values.W_MCons):
+        return equal_simple(a.car(), b.car()) and equal_simple(a.cdr(), b.cdr())
+    if isinstance(a, values.W_Box) and isinstance(b, values.W_Box):
+        return equal_simple(_box_value(a), _box_value(b))
+    if isinstance(a, values_vector.W_Vector) and isinstance(b, values_vector.W_Vector):
+        if a.length() != b.length():
+            return False
+        for i in range(a.length()):
+            if not equal_simple(a.ref(i), b.ref(i)):
+                return False
+        return True
+    if (isinstance(a, values_struct.W_RootStruct) and
+        isinstance(b, values_struct.W_RootStruct)):
+        a_type = a.struct_type()
+        b_type = b.struct_type()
+        if not a_type.isopaque and not b_type.isopaque:
+            if a_type.name.utf8value != b_type.name.utf8value:
+                return False
+            a_vals = a.vals()
+            b_vals = b.vals()
+            if len(a_vals) != len(b_vals):
+                return False
+            for i in range(len(a_vals)):
+                if not equal_simple(a_vals[i], b_vals[i]):
+                    return False
+            return True
+    return a.equal(b)
+
+def equal_hash_key(w_key):
+    """ Returns (hashable, hash) for w_key. """
+    try:
+        return True, _equal_hash(w_key, 0)
+    except UnhashableKey:
+        return False, 0
+
+class EqualBuckets(object):
+    """ Storage of the object strategy: the entries in insertion order and, per
+    hash, the indices of the entries whose keys have that hash. Keys that
+    cannot be hashed are kept in a separate list that is searched on every
+    lookup. """
+
+    def __init__(self):
+        self.entries = []
+        self.buckets = {}
+        self.unhashed = []
+
+    def candidates(self, hashable, h):
+        """ The indices of the entries whose key can be equal? to a key with
+        the given hash. """
+        if not hashable:
+            return range(len(self.entries))
+        bucket = self.buckets.get(h, None)
+        if bucket is None:
+            return self.unhashed
+        if not self.unhashed:
+            return bucket
+        return bucket + self.unhashed
+
+    def add(self, hashable, h, w_key, w_val):
+        index = len(self.entries)
+        self.entries.append((w_key, w_val))
+        if not hashable:
+            self.unhashed.append(index)
+            return
+        bucket = self.buckets.get(h, None)
+        if bucket is None:
+            self.buckets[h] = [index]
+        else:
+            bucket.append(index)
+
 @loop_label
-def equal_hash_ref_loop(data, idx, key, env, cont):
+def equal_hash_ref_loop(storage, indices, idx, key, env, cont):
     from pycket.interpreter import return_value
     from pycket.prims.equal import equal_func, EqualInfo
-    if idx >= len(data):
+    if idx >= len(indices):
         return return_value(w_missing, env, cont)
-    k, v = data[idx]
+    k, v = storage.entries[indices[idx]]
     info = EqualInfo.BASIC_SINGLETON
     return equal_func(k, key, info, env,
-            catch_ref_is_equal_cont(data, idx, key, v, env, cont))
+            catch_ref_is_equal_cont(storage, indices, idx, key, v, env, cont))
 
 @continuation
-def catch_ref_is_equal_cont(data, idx, key, v, env, cont, _vals):
+def catch_ref_is_equal_cont(storage, indices, idx, key, v, env, cont, _vals):
     from pycket.interpreter import check_one_val, return_value
     val = check_one_val(_vals)
     if val is not values.w_false:
         return return_value(v, env, cont)
-    return equal_hash_ref_loop(data, idx + 1, key, env, cont)
+    return equal_hash_ref_loop(storage, indices, idx + 1, key, env, cont)
 
-def equal_hash_set_loop(data, idx, key, val, env, cont):
-    from pycket.interpreter import check_one_val, return_value
+def equal_hash_set_loop(storage, indices, idx, hashable, h, key, val, env, cont):
+    from pycket.interpreter import return_value
     from pycket.prims.equal import equal_func, EqualInfo
-    if idx >= len(data):
-        data.append((key, val))
+    if idx >= len(indices):
+        storage.add(hashable, h, key, val)
         return return_value(values.w_void, env, cont)
-    k, _ = data[idx]
+    k, _ = storage.entries[indices[idx]]
     info = EqualInfo.BASIC_SINGLETON
     return equal_func(k, key, info, env,
-            catch_set_is_equal_cont(data, idx, key, val, env, cont))
+            catch_set_is_equal_cont(storage, indices, idx, hashable, h, key, val, env, cont))
 
 @continuation
-def catch_set_is_equal_cont(data, idx, key, val, env, cont, _vals):
+def catch_set_is_equal_cont(storage, indices, idx, hashable, h, key, val, env, cont, _vals):
     from pycket.interpreter import check_one_val, return_value
     cmp = check_one_val(_vals)
     if cmp is not values.w_false:
-        data[idx] = (key, val)
+        storage.entries[indices[idx]] = (key, val)
         return return_value(values.w_void, env, cont)
-    return equal_hash_set_loop(data, idx + 1, key, val, env, cont)
+    return equal_hash_set_loop(storage, indices, idx + 1, hashable, h, key, val, env, cont)
 
 
 class HashmapStrategy(object):
@@ -187,25 +345,35 @@ class ObjectHashmapStrategy(HashmapStrategy):
     erase, unerase = rerased.new_static_erasing_pair("object-hashmap-strategry")
 
     def get(self, w_dict, w_key, env, cont):
-        return equal_hash_ref_loop(self.unerase(w_dict.hstorage), 0, w_key, env, cont)
+        storage = self.unerase(w_dict.hstorage)
+        hashable, h = equal_hash_key(w_key)
+        indices = storage.candidates(hashable, h)
+        return equal_hash_ref_loop(storage, indices, 0, w_key, env, cont)
 
     def set(self, w_dict, w_key, w_val, env, cont):
-        return equal_hash_set_loop(self.unerase(w_dict.hstorage), 0, w_key, w_val, env, cont)
+        storage = self.unerase(w_dict.hstorage)
+        hashable, h = equal_hash_key(w_key)
+        indices = storage.candidates(hashable, h)
+        return equal_hash_set_loop(storage, indices, 0, hashable, h, w_key, w_val, env, cont)
 
     def items(self, w_dict):
-        return self.unerase(w_dict.hstorage)
+        return self.unerase(w_dict.hstorage).entries
 
     def get_item(self, w_dict, i):
         try:
-            return self.unerase(w_dict.hstorage)[i]
+            return self.unerase(w_dict.hstorage).entries[i]
         except IndexError:
             raise
 
     def length(self, w_dict):
-        return len(self.unerase(w_dict.hstorage))
+        return len(self.unerase(w_dict.hstorage).entries)
 
     def create_storage(self, keys, vals):
-        return self.erase([(k, vals[i]) for i, k in enumerate(keys)])
+        storage = EqualBuckets()
+        for i, w_key in enumerate(keys):
+            hashable, h = equal_hash_key(w_key)
+            storage.add(hashable, h, w_key, vals[i])
+        return self.erase(storage)
 
 
 class FixnumHashmapStrategy(HashmapStrategy):
@@ -330,3 +498,169 @@ class W_EqualHashTable(W_HashTable):
         lst = [values.W_Cons.make(k, v).tostring() for k, v in self.hash_items()]
         return "#hash(%s)" % " ".join(lst)
 
+
+EqualHashMap = make_persistent_hash_type(
+        name="EqualHashMap",
+        hashfun=lambda x: r_uint(_equal_hash(x, 0)),
+        equal=equal_simple)
+
+def make_equal_immutable_table(keys, vals):
+    hamt = EqualHashMap.EMPTY
+    others = []
+    for i, w_key in enumerate(keys):
+        try:
+            hamt = hamt.assoc(w_key, vals[i])
+        except UnhashableKey:
+            others.append((w_key, vals[i]))
+    return W_EqualImmutableHashTable(hamt, others)
+
+@loop_label
+def equal_find_loop(items, idx, key, env, cont):
+    """ Returns the index of the first of items whose key is equal? to key,
+    or #f. """
+    from pycket.interpreter import return_value
+    from pycket.prims.equal import equal_func, EqualInfo
+    if idx >= len(items):
+        return return_value(values.w_false, env, cont)
+    k, _ = items[idx]
+    info = EqualInfo.BASIC_SINGLETON
+    return equal_func(k, key, info, env,
+            equal_find_cont(items, idx, key, env, cont))
+
+@continuation
+def equal_find_cont(items, idx, key, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    val = check_one_val(_vals)
+    if val is not values.w_false:
+        return return_value(values.W_Fixnum(idx), env, cont)
+    return equal_find_loop(items, idx + 1, key, env, cont)
+
+@continuation
+def immutable_ref_found_cont(items, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_idx = check_one_val(_vals)
+    if not isinstance(w_idx, values.W_Fixnum):
+        return return_value(w_missing, env, cont)
+    return return_value(items[w_idx.value][1], env, cont)
+
+@continuation
+def immutable_set_found_cont(table, items, in_hamt, hashable, key, val, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_idx = check_one_val(_vals)
+    if not isinstance(w_idx, values.W_Fixnum):
+        if hashable:
+            result = table.with_hamt(table.hamt.assoc(key, val))
+        else:
+            result = table.with_others(table.others + [(key, val)])
+        return return_value(result, env, cont)
+    idx = w_idx.value
+    old_key = items[idx][0]
+    if idx < in_hamt:
+        result = table.with_hamt(table.hamt.assoc(old_key, val))
+    else:
+        others = table.others[:]
+        others[idx - in_hamt] = (old_key, val)
+        result = table.with_others(others)
+    return return_value(result, env, cont)
+
+@continuation
+def immutable_remove_found_cont(table, items, in_hamt, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_idx = check_one_val(_vals)
+    if not isinstance(w_idx, values.W_Fixnum):
+        return return_value(table, env, cont)
+    idx = w_idx.value
+    if idx < in_hamt:
+        result = table.with_hamt(table.hamt.without(items[idx][0]))
+    else:
+        others = table.others[:]
+        del others[idx - in_hamt]
+        result = table.with_others(others)
+    return return_value(result, env, cont)
+
+class W_EqualImmutableHashTable(W_ImmutableHashTable):
+    """ An immutable equal?-based table. The keys that _equal_hash accepts are
+    stored in a persistent hash map, the others in a list that is searched
+    with the CPS equal_func. """
+    _attrs_ = ['hamt', 'others']
+    _immutable_fields_ = ['hamt', 'others[*]']
+
+    def __init__(self, hamt, others):
+        self.hamt = hamt
+        self.others = others
+
+    def with_hamt(self, hamt):
+        if hamt is self.hamt:
+            return self
+        return W_EqualImmutableHashTable(hamt, self.others)
+
+    def with_others(self, others):
+        return W_EqualImmutableHashTable(self.hamt, others)
+
+    def length(self):
+        return len(self.hamt) + len(self.others)
+
+    def make_copy(self):
+        return self
+
+    def make_empty(self):
+        return W_EqualImmutableHashTable.EMPTY
+
+    def hash_items(self):
+        items = [self.hamt.get_item(i) for i in range(len(self.hamt))]
+        return items + self.others
+
+    def get_item(self, i):
+        n = len(self.hamt)
+        if i < n:
+            return self.hamt.get_item(i)
+        return self.others[i - n]
+
+    def hash_ref(self, key, env, cont):
+        from pycket.interpreter import return_value
+        try:
+            result = self.hamt.val_at(key, w_missing)
+        except UnhashableKey:
+            items = self.hash_items()
+        else:
+            if result is not w_missing or not self.others:
+                return return_value(result, env, cont)
+            items = self.others
+        return equal_find_loop(items, 0, key, env,
+                immutable_ref_found_cont(items, env, cont))
+
+    def hash_assoc(self, key, val, env, cont):
+        """ Returns a table that also maps key to val. """
+        from pycket.interpreter import return_value
+        hashable, _ = equal_hash_key(key)
+        if hashable and not self.others:
+            return return_value(self.with_hamt(self.hamt.assoc(key, val)), env, cont)
+        if hashable:
+            items = self.others
+            in_hamt = 0
+        else:
+            items = self.hash_items()
+            in_hamt = len(self.hamt)
+        return equal_find_loop(items, 0, key, env,
+                immutable_set_found_cont(self, items, in_hamt, hashable, key, val, env, cont))
+
+    def hash_remove(self, key, env, cont):
+        from pycket.interpreter import return_value
+        hashable, _ = equal_hash_key(key)
+        if hashable:
+            hamt = self.hamt.without(key)
+            if hamt is not self.hamt or not self.others:
+                return return_value(self.with_hamt(hamt), env, cont)
+            items = self.others
+            in_hamt = 0
+        else:
+            items = self.hash_items()
+            in_hamt = len(self.hamt)
+        return equal_find_loop(items, 0, key, env,
+                immutable_remove_found_cont(self, items, in_hamt, env, cont))
+
+    def tostring(self):
+        lst = [values.W_Cons.make(k, v).tostring() for k, v in self.hash_items()]
+        return "#hash(%s)" % " ".join(lst)
+
+W_EqualImmutableHashTable.EMPTY = W_EqualImmutableHashTable(EqualHashMap.EMPTY, [])
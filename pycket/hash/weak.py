@@ -0,0 +1,276 @@
+from pycket                   import values
+from pycket.cont              import continuation
+from pycket.hash.base         import W_MutableHashTable, w_missing
+from pycket.hash.equal        import equal_hash_key, equal_simple, equal_find_loop
+from pycket.hash.simple       import W_EqMutableHashTable, W_EqvMutableHashTable
+from rpython.rlib             import rweakref
+
+# Weak hash tables hold their keys through weak references. An entry whose
+# key was collected is ignored by all operations and dropped the next time the
+# table is purged, which happens on an insert once the entries list has grown
+# to twice its size after the last purge. Like W_Ephemeron, an entry holds its
+# value strongly for as long as the entry exists.
+
+# the entries list is not purged before it reaches this size
+MIN_PURGE = 32
+
+class WeakEntry(object):
+    _attrs_ = ['ref', 'strong', 'w_val', 'hashable', 'hash']
+    _immutable_fields_ = ['ref', 'strong', 'hashable', 'hash']
+
+    def __init__(self, w_key, w_val, hashable, hash):
+        self.ref = rweakref.ref(w_key)
+        # fixnums and characters are eq? by value, their entries must stay
+        # alive as long as equal ones can still be looked up
+        if isinstance(w_key, values.W_Fixnum) or isinstance(w_key, values.W_Character):
+            self.strong = w_key
+        else:
+            self.strong = None
+        self.w_val = w_val
+        self.hashable = hashable
+        self.hash = hash
+
+    def get_key(self):
+        return self.ref()
+
+@continuation
+def weak_ref_found_cont(items, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_idx = check_one_val(_vals)
+    if not isinstance(w_idx, values.W_Fixnum):
+        return return_value(w_missing, env, cont)
+    return return_value(items[w_idx.value][1], env, cont)
+
+@continuation
+def weak_set_found_cont(table, positions, hashable, h, key, val, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_idx = check_one_val(_vals)
+    if isinstance(w_idx, values.W_Fixnum):
+        table.entries[positions[w_idx.value]].w_val = val
+    else:
+        table.add(hashable, h, key, val)
+    return return_value(values.w_void, env, cont)
+
+@continuation
+def weak_remove_found_cont(table, positions, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_idx = check_one_val(_vals)
+    if isinstance(w_idx, values.W_Fixnum):
+        table.remove_at(positions[w_idx.value])
+    return return_value(values.w_void, env, cont)
+
+class W_WeakHashTable(W_MutableHashTable):
+    """ The entries are kept in a list, and per hash the indices of the
+    entries with that hash. Keys without a hash (only in equal? tables) are
+    listed separately and compared with the CPS equal_func. """
+    _attrs_ = ['entries', 'buckets', 'unhashed', 'purge_at']
+
+    def __init__(self):
+        self.entries = []
+        self.buckets = {}
+        self.unhashed = []
+        self.purge_at = MIN_PURGE
+
+    def hash_key(self, w_key):
+        """ Returns (hashable, hash) for w_key. """
+        raise NotImplementedError("abstract method")
+
+    def same_key(self, w_a, w_b):
+        raise NotImplementedError("abstract method")
+
+    def make_empty(self):
+        raise NotImplementedError("abstract method")
+
+    def find(self, h, w_key):
+        bucket = self.buckets.get(h, None)
+        if bucket is None:
+            return -1
+        for idx in bucket:
+            w_k = self.entries[idx].get_key()
+            if w_k is not None and self.same_key(w_k, w_key):
+                return idx
+        return -1
+
+    def _index(self, entry, idx):
+        if not entry.hashable:
+            self.unhashed.append(idx)
+            return
+        bucket = self.buckets.get(entry.hash, None)
+        if bucket is None:
+            self.buckets[entry.hash] = [idx]
+        else:
+            bucket.append(idx)
+
+    def _unindex(self, entry, idx):
+        if not entry.hashable:
+            self.unhashed.remove(idx)
+            return
+        bucket = self.buckets[entry.hash]
+        bucket.remove(idx)
+        if not bucket:
+            del self.buckets[entry.hash]
+
+    def add(self, hashable, h, w_key, w_val):
+        if len(self.entries) >= self.purge_at:
+            self.purge()
+        entry = WeakEntry(w_key, w_val, hashable, h)
+        self.entries.append(entry)
+        self._index(entry, len(self.entries) - 1)
+
+    def remove_at(self, idx):
+        """ Removes the entry at idx, moving the last entry into its place. """
+        last = len(self.entries) - 1
+        self._unindex(self.entries[idx], idx)
+        if idx != last:
+            moved = self.entries[last]
+            self._unindex(moved, last)
+            self.entries[idx] = moved
+            self._index(moved, idx)
+        self.entries.pop()
+
+    def purge(self):
+        """ Drops the entries whose keys were collected. """
+        entries = []
+        for entry in self.entries:
+            if entry.get_key() is not None:
+                entries.append(entry)
+        self.entries = entries
+        self.buckets = {}
+        self.unhashed = []
+        for i, entry in enumerate(entries):
+            self._index(entry, i)
+        self.purge_at = max(2 * len(entries), MIN_PURGE)
+
+    def _live_items(self, indices):
+        """ The keys and values of the live entries at indices, and their
+        positions in the entries list. """
+        items = []
+        positions = []
+        for idx in indices:
+            entry = self.entries[idx]
+            w_key = entry.get_key()
+            if w_key is not None:
+                items.append((w_key, entry.w_val))
+                positions.append(idx)
+        return items, positions
+
+    def _candidates(self, hashable):
+        if hashable:
+            return self.unhashed
+        return range(len(self.entries))
+
+    def hash_ref(self, w_key, env, cont):
+        from pycket.interpreter import return_value
+        hashable, h = self.hash_key(w_key)
+        if hashable:
+            idx = self.find(h, w_key)
+            if idx >= 0:
+                return return_value(self.entries[idx].w_val, env, cont)
+            if not self.unhashed:
+                return return_value(w_missing, env, cont)
+        items, _ = self._live_items(self._candidates(hashable))
+        return equal_find_loop(items, 0, w_key, env,
+                weak_ref_found_cont(items, env, cont))
+
+    def hash_set(self, w_key, w_val, env, cont):
+        from pycket.interpreter import return_value
+        hashable, h = self.hash_key(w_key)
+        if hashable:
+            idx = self.find(h, w_key)
+            if idx >= 0:
+                self.entries[idx].w_val = w_val
+                return return_value(values.w_void, env, cont)
+            if not self.unhashed:
+                self.add(True, h, w_key, w_val)
+                return return_value(values.w_void, env, cont)
+        items, positions = self._live_items(self._candidates(hashable))
+        return equal_find_loop(items, 0, w_key, env,
+                weak_set_found_cont(self, positions, hashable, h, w_key, w_val, env, cont))
+
+    def hash_remove_inplace(self, w_key, env, cont):
+        from pycket.interpreter import return_value
+        hashable, h = self.hash_key(w_key)
+        if hashable:
+            idx = self.find(h, w_key)
+            if idx >= 0:
+                self.remove_at(idx)
+                return return_value(values.w_void, env, cont)
+            if not self.unhashed:
+                return return_value(values.w_void, env, cont)
+        items, positions = self._live_items(self._candidates(hashable))
+        return equal_find_loop(items, 0, w_key, env,
+                weak_remove_found_cont(self, positions, env, cont))
+
+    def hash_items(self):
+        items, _ = self._live_items(range(len(self.entries)))
+        return items
+
+    def get_item(self, i):
+        entry = self.entries[i]
+        w_key = entry.get_key()
+        if w_key is None:
+            raise KeyError
+        return w_key, entry.w_val
+
+    def length(self):
+        count = 0
+        for entry in self.entries:
+            if entry.get_key() is not None:
+                count += 1
+        return count
+
+    def next_position(self, i):
+        # the positions are those of the entries list, skipping the entries
+        # whose keys were collected
+        i += 1
+        while i < len(self.entries):
+            if self.entries[i].get_key() is not None:
+                return i
+            i += 1
+        return -1
+
+    def tostring(self):
+        lst = [values.W_Cons.make(k, v).tostring() for k, v in self.hash_items()]
+        return "#hash(%s)" % " ".join(lst)
+
+class W_WeakEqHashTable(W_WeakHashTable):
+    def hash_key(self, w_key):
+        return True, W_EqMutableHashTable.hash_value(w_key)
+
+    def same_key(self, w_a, w_b):
+        return W_EqMutableHashTable.cmp_value(w_a, w_b)
+
+    def make_empty(self):
+        return W_WeakEqHashTable()
+
+class W_WeakEqvHashTable(W_WeakHashTable):
+    def hash_key(self, w_key):
+        return True, W_EqvMutableHashTable.hash_value(w_key)
+
+    def same_key(self, w_a, w_b):
+        return W_EqvMutableHashTable.cmp_value(w_a, w_b)
+
+    def make_empty(self):
+        return W_WeakEqvHashTable()
+
+class W_WeakEqualHashTable(W_WeakHashTable):
+    def hash_key(self, w_key):
+        return equal_hash_key(w_key)
+
+    def same_key(self, w_a, w_b):
+        return equal_simple(w_a, w_b)
+
+    def make_empty(self):
+        return W_WeakEqualHashTable()
+
+def make_weak_table(table, keys, vals):
+    """ Fills the empty table with keys and vals, for keys that occur more
+    than once the last value is kept if the key can be hashed. """
+    for i, w_key in enumerate(keys):
+        hashable, h = table.hash_key(w_key)
+        idx = table.find(h, w_key) if hashable else -1
+        if idx >= 0:
+            table.entries[idx].w_val = vals[i]
+        else:
+            table.add(hashable, h, w_key, vals[i])
+    return table
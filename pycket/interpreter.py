@@ -4,9 +4,11 @@ from pycket                   import vector
 from pycket.prims.expose      import prim_env, make_call_method
 from pycket.error             import SchemeException
 from pycket.cont              import Cont, NilCont, label
-from pycket.env               import SymList, ConsEnv, ToplevelEnv
+from pycket.env               import SymList, ConsEnv, ToplevelEnv, LexicalAddress
 from pycket.arity             import Arity
 from pycket                   import config
+from pycket.scheduler         import scheduler, ThreadSwitch
+from pycket                   import profiler
 
 from rpython.rlib             import jit, debug, objectmodel
 from rpython.rlib.objectmodel import r_dict, compute_hash, specialize
@@ -30,7 +32,12 @@ BUILTIN_MODULES = [
     "#%futures",
     "#%network" ]
 
+# the bindings of pycket/primitives are pycket's own primitives
+PYCKET_PRIMITIVES = "pycket-lang/primitives.rkt"
+
 def is_builtin_module(mod):
+    if mod is not None and mod.endswith(PYCKET_PRIMITIVES):
+        return True
     return mod in BUILTIN_MODULES
 
 class Done(Exception):
@@ -83,20 +90,11 @@ class LetrecCont(Cont):
 
     def get_next_executed_ast(self):
         ast, rhsindex = self.counting_ast.unpack(Letrec)
-        if rhsindex == (len(ast.rhss) - 1):
-            return ast.body[0]
-        return ast.rhss[rhsindex + 1]
+        return ast.rhs_next_ast(rhsindex)
 
-    @jit.unroll_safe
     def plug_reduce(self, vals, env):
         ast, i = self.counting_ast.unpack(Letrec)
-        if ast.counts[i] != vals.num_values():
-            raise SchemeException("wrong number of values")
-        for j in range(vals.num_values()):
-            w_val = vals.get_value(j)
-            v = self.env.lookup(ast.args.elems[ast.total_counts[i] + j], ast.args)
-            assert isinstance(v, values.W_Cell)
-            v.set_val(w_val)
+        ast.set_cells(i, vals, self.env)
         if i >= (len(ast.rhss) - 1):
             return ast.make_begin_cont(self.env, self.prev)
         else:
@@ -125,9 +123,7 @@ class LetCont(Cont):
 
     def get_next_executed_ast(self):
         ast, rhsindex = self.counting_ast.unpack(Let)
-        if rhsindex == (len(ast.rhss) - 1):
-            return ast.body[0]
-        return ast.rhss[rhsindex + 1]
+        return ast.rhs_next_ast(rhsindex)
 
     @staticmethod
     @jit.unroll_safe
@@ -283,16 +279,9 @@ class CellCont(Cont):
     def get_ast(self):
         return self.ast
 
-    @jit.unroll_safe
     def plug_reduce(self, vals, env):
         ast = jit.promote(self.ast)
-        vals_w = []
-        for i, needs_cell in enumerate(ast.need_cell_flags):
-            w_val = vals.get_value(i)
-            if needs_cell:
-                w_val = values.W_Cell(w_val)
-            vals_w.append(w_val)
-        return return_multi_vals(values.Values.make(vals_w), self.env, self.prev)
+        return return_multi_vals(ast.make_cells(vals), self.env, self.prev)
 
 class SetBangCont(Cont):
     _immutable_fields_ = ["ast"]
@@ -418,14 +407,158 @@ class WCMValCont(Cont):
 
         return self.ast.body, self.env, cont
 
+# Direct-style evaluation, enabled with --direct-stack at translation time.
+#
+# Every non-tail subexpression normally allocates a continuation on the heap
+# (a LetCont, BeginCont, ...) that the trampoline in interpret_one plugs its
+# values into. When the interpreter (not the JIT) reaches a Let or a Begin
+# whose non-tail parts can't capture a continuation, these parts are instead
+# evaluated by recursive calls of interpret_direct on the RPython stack. Only
+# the tail of the Let or Begin goes back to the trampoline.
+#
+# Whether a subexpression can capture a continuation is decided by
+# direct_safe: it must consist of simple ASTs, ifs, lets, letrecs, begins,
+# cells, set!s and calls that don't go to a primitive that needs the
+# continuation. A call to a closure is made in direct style as well if the
+# body of its lambda is direct_safe, otherwise, or if there are more than
+# DIRECT_MAX_DEPTH calls in direct style on the stack, the call can only be
+# made with a continuation. Then a DirectReify is raised. While it
+# propagates, every direct-style frame adds the continuation the trampoline
+# would have made for it, and the Let or Begin where direct-style evaluation
+# started links them to its own continuation and makes the call. Errors of
+# simple primitives are raised the same way, to find the exception handler.
+# A call of a continuation (the k of a let/ec, say) discards the frames, so
+# they are not made for it, and it does not count as a failure.
+#
+# Code run in direct style is not traced by the JIT, and traced code always
+# uses the trampoline (there is no can_enter_jit in direct style). So this
+# only speeds up code the JIT has not compiled. A Let or Begin falls back to
+# the trampoline for good if evaluating it in direct style fails too often.
+
+DIRECT_MAX_DEPTH = 64
+
+# a Let or Begin is evaluated in direct style again after it failed, as long
+# as less than one in DIRECT_FAIL_RATIO of its runs failed
+DIRECT_FAIL_RATIO = 8
+DIRECT_MIN_FAILS  = 16
+
+# whether the part of an AST evaluated in direct style is direct_safe
+DIRECT_UNKNOWN = 0
+DIRECT_YES     = 1
+DIRECT_NO      = 2
+
+class DirectReify(Exception):
+    """ Unwinds direct-style evaluation to continue with the trampoline. """
+    def __init__(self, action):
+        self.action = action
+        # whether the continuation of the direct-style evaluation is dropped
+        self.escape = action.escapes()
+        # the frames of the direct-style evaluation, innermost first
+        self.frames = []
+
+    def resume(self, cont):
+        for i in range(len(self.frames) - 1, -1, -1):
+            cont = self.frames[i].make_cont(cont)
+        return self.action.resume(cont)
+
+class DirectAction(object):
+    """ What the trampoline does first once the continuation is built. """
+    def resume(self, cont):
+        raise NotImplementedError("abstract base class")
+
+    def escapes(self):
+        return False
+
+class DirectCall(DirectAction):
+    def __init__(self, app, w_callable, args_w, env):
+        self.app = app
+        self.w_callable = w_callable
+        self.args_w = args_w
+        self.env = env
+
+    def resume(self, cont):
+        w_callable = self.w_callable
+        if isinstance(w_callable, values.W_PromotableClosure):
+            w_callable = w_callable.closure
+        return w_callable.call_with_extra_info(self.args_w, self.env, cont,
+                                               self.app)
+
+    def escapes(self):
+        # a continuation never returns to the frames, an invalidated escape
+        # continuation looks for its call/ec below them
+        return isinstance(self.w_callable, values.W_Continuation)
+
+class DirectError(DirectAction):
+    def __init__(self, exn, env):
+        self.exn = exn
+        self.env = env
+
+    def resume(self, cont):
+        from pycket.prims.control import convert_runtime_exception
+        return convert_runtime_exception(self.exn, self.env, cont)
+
+class DirectFrame(object):
+    def make_cont(self, prev):
+        raise NotImplementedError("abstract base class")
+
+class LetFrame(DirectFrame):
+    def __init__(self, ast, rhsindex, vals_w, env):
+        self.ast = ast
+        self.rhsindex = rhsindex
+        self.vals_w = vals_w
+        self.env = env
+
+    def make_cont(self, prev):
+        return LetCont.make(self.vals_w, self.ast, self.rhsindex, self.env,
+                            prev)
+
+class LetrecFrame(DirectFrame):
+    def __init__(self, ast, rhsindex, env):
+        self.ast = ast
+        self.rhsindex = rhsindex
+        self.env = env
+
+    def make_cont(self, prev):
+        return LetrecCont(self.ast.counting_asts[self.rhsindex], self.env, prev)
+
+class BodyFrame(DirectFrame):
+    def __init__(self, ast, index, env):
+        self.ast = ast
+        self.index = index
+        self.env = env
+
+    def make_cont(self, prev):
+        return BeginCont(self.ast.counting_asts[self.index + 1], self.env, prev)
+
+class CellFrame(DirectFrame):
+    def __init__(self, ast, env):
+        self.ast = ast
+        self.env = env
+
+    def make_cont(self, prev):
+        return CellCont(self.ast, self.env, prev)
+
+class SetBangFrame(DirectFrame):
+    def __init__(self, ast, env):
+        self.ast = ast
+        self.env = env
+
+    def make_cont(self, prev):
+        return SetBangCont(self.ast, self.env, prev)
+
 class Module(AST):
-    _immutable_fields_ = ["name", "body[*]", "requires[*]", "parent", "submodules[*]", "interpreted?", "lang"]
+    _immutable_fields_ = ["name", "body[*]", "requires[*]", "parent", "submodules[*]", "interpreted?", "lang", "provides"]
     simple = True
 
-    def __init__(self, name, body, config, lang=None):
+    def __init__(self, name, body, config, lang=None, provides=None):
         self.parent = None
         self.lang = lang
         self.name = name
+        # the names the module exports at phase 0, mapped to the symbols they
+        # are defined as
+        if provides is None:
+            provides = {}
+        self.provides = provides
 
         self.body     = [b for b in body if not isinstance(b, Require)]
         self.requires = [b for b in body if isinstance(b, Require)]
@@ -442,6 +575,9 @@ class Module(AST):
         self.env = None
         self.interpreted = False
         self.config = config
+        # the values of the definitions when the module is restored from a
+        # snapshot, see snapshot.py
+        self.snapshot_defs = None
 
         defs = {}
         for b in body:
@@ -493,8 +629,13 @@ class Module(AST):
 
     def assign_convert_module(self):
         local_muts = self.mod_mutated_vars()
-        new_body = [b.assign_convert(local_muts, None) for b in self.rebuild_body()]
-        return Module(self.name, new_body, self.config, lang=self.lang)
+        body = self.rebuild_body()
+        if config.optimize_ast:
+            from pycket.optimizer import optimize_module
+            body = optimize_module(self.name, body)
+        new_body = [b.assign_convert(local_muts, None) for b in body]
+        return Module(self.name, new_body, self.config, lang=self.lang,
+                      provides=self.provides)
 
     def _tostring(self):
         return "(module %s %s)"%(self.name," ".join([s.tostring() for s in self.body]))
@@ -544,6 +685,7 @@ class Module(AST):
     def _interpret_mod(self, env):
         self.env = env
         module_env = env.toplevel_env().module_env
+        env.toplevel_env().callgraph.warm_start(self)
         old = module_env.current_module
         module_env.current_module = self
 
@@ -554,11 +696,20 @@ class Module(AST):
 
         for r in self.requires:
             interpret_one(r, self.env)
+        if self.snapshot_defs is not None:
+            self._restore_defs(self.snapshot_defs)
+            module_env.current_module = old
+            return
+        lazy = module_env.lazy_instantiation
         for f in self.body:
             # FIXME: this is wrong -- the continuation barrier here is around the RHS,
             # whereas in Racket it's around the whole `define-values`
             if isinstance(f, DefineValues):
                 e = f.rhs
+                if lazy and f.is_pure():
+                    sym = f.names[0]
+                    self.defs[sym] = LazyDefinition(self, sym, e, self.env)
+                    continue
                 vs = interpret_one(e, self.env).get_all_values()
                 if len(f.names) == len(vs):
                     for n in range(len(vs)):
@@ -570,6 +721,38 @@ class Module(AST):
                 continue
         module_env.current_module = old
 
+    def _restore_defs(self, snapshot_defs):
+        for f in self.body:
+            if not isinstance(f, DefineValues):
+                continue
+            for sym in f.names:
+                w_val = snapshot_defs[sym]
+                if w_val is None:
+                    # a lambda or constant, evaluated again on first use
+                    w_val = LazyDefinition(self, sym, f.rhs, self.env)
+                self.defs[sym] = w_val
+
+class LazyDefinition(values.W_Object):
+    """ The right-hand side of a module-level definition that has not been
+    evaluated yet, see ModuleEnv.lazy_instantiation. Only definitions whose
+    evaluation has no effects are delayed, so evaluating them on first use
+    gives the same results as evaluating them in order. """
+    _attrs_ = ["module", "sym", "rhs", "env"]
+
+    def __init__(self, module, sym, rhs, env):
+        self.module = module
+        self.sym = sym
+        self.rhs = rhs
+        self.env = env
+
+    def force(self):
+        w_val = self.rhs.interpret_simple(self.env)
+        self.module.defs[self.sym] = w_val
+        return w_val
+
+    def tostring(self):
+        return "#<lazy-definition:%s>" % self.sym.tostring()
+
 class Require(AST):
     _immutable_fields_ = ["fname", "modtable", "path[*]"]
     simple = True
@@ -639,6 +822,28 @@ class Cell(AST):
     def interpret(self, env, cont):
         return self.expr, env, CellCont(self, env, cont)
 
+    @jit.unroll_safe
+    def make_cells(self, vals):
+        vals_w = []
+        for i, needs_cell in enumerate(self.need_cell_flags):
+            w_val = vals.get_value(i)
+            if needs_cell:
+                w_val = values.W_Cell(w_val)
+            vals_w.append(w_val)
+        return values.Values.make(vals_w)
+
+    def direct_safe(self):
+        return self.expr.direct_safe()
+
+    def interpret_direct(self, env, depth, next_ast):
+        try:
+            vals = self.expr.interpret_direct(env, depth, None)
+        except DirectReify, e:
+            if not e.escape:
+                e.frames.append(CellFrame(self, env))
+            raise
+        return self.make_cells(vals)
+
     def assign_convert(self, vars, env_structure):
         return Cell(self.expr.assign_convert(vars, env_structure))
 
@@ -767,8 +972,141 @@ class WithContinuationMark(AST):
     def interpret(self, env, cont):
         return self.key, env, WCMKeyCont(self, env, cont)
 
+# whether the rator of an App can be a known function
+KNOWN_UNTRIED = 0
+KNOWN_YES     = 1
+KNOWN_NO      = 2
+
+def closure_lambda_index(closure, nargs):
+    """ The index of the lambda of closure that a call with nargs arguments
+    takes, -1 if there is none or if match_args has to decide. """
+    if isinstance(closure, values.W_Closure1AsEnv):
+        lam = closure.caselam.lams[0]
+        if lam.rest or len(lam.formals) != nargs:
+            return -1
+        return 0
+    if isinstance(closure, values.W_Closure):
+        lams = closure.caselam.lams
+        for i in range(len(lams)):
+            lam = lams[i]
+            if lam.rest:
+                # match_args decides which case a call takes
+                return -1
+            if len(lam.formals) == nargs:
+                return i
+    return -1
+
+def closure_lambda(closure, index):
+    if isinstance(closure, values.W_Closure1AsEnv):
+        return closure.caselam.lams[0]
+    assert isinstance(closure, values.W_Closure)
+    return closure.caselam.lams[index]
+
+def closure_frees(closure, index):
+    """ The environment of the free variables of the lambda at index. """
+    if isinstance(closure, values.W_Closure1AsEnv):
+        return closure
+    assert isinstance(closure, values.W_Closure)
+    return closure._get_list(index)
+
+class KnownCall(object):
+    """ The target of a call site whose rator is a module-level or toplevel
+    variable, found on the first call: the lambda of the closure that accepts
+    the number of arguments of the site, and the environment of its free
+    variables. Valid as long as the rator evaluates to the same closure and
+    no toplevel variable was added. """
+    _immutable_fields_ = ["w_callable", "lam", "frees", "version"]
+
+    def __init__(self, w_callable, lam, frees, version):
+        self.w_callable = w_callable
+        self.lam = lam
+        self.frees = frees
+        self.version = version
+
+    @staticmethod
+    def make(w_callable, nargs, version):
+        if isinstance(w_callable, values.W_PromotableClosure):
+            closure = w_callable.closure
+        else:
+            closure = w_callable
+        index = closure_lambda_index(closure, nargs)
+        if index < 0:
+            return None
+        return KnownCall(w_callable, closure_lambda(closure, index),
+                         closure_frees(closure, index), version)
+
+    def call(self, args_w, env, cont, calling_app):
+        # like W_Closure.call_with_extra_info, without finding the lambda
+        lam = self.lam
+        if not jit.we_are_jitted() and env.pycketconfig().callgraph:
+            env.toplevel_env().callgraph.register_call(lam, calling_app, cont, env)
+        prev = lam.env_structure.prev.find_env_in_chain_speculate(
+                self.frees, calling_app.env_structure, env)
+        return lam.make_begin_cont(ConsEnv.make(args_w, prev), cont)
+
+# the number of different case-lambdas an App remembers as targets before it
+# gives up and calls them like any other procedure
+CALL_CACHE_SIZE = 4
+
+def caselam_lambda_index(caselam, nargs):
+    """ The index of the lambda of caselam that a call with nargs arguments
+    takes, -1 if there is none. """
+    lams = caselam.lams
+    for i in range(len(lams)):
+        lam = lams[i]
+        nformals = len(lam.formals)
+        if nformals == nargs or (lam.rest and nformals < nargs):
+            return i
+    return -1
+
+class CallCacheEntry(object):
+    """ A target in the inline cache of a call site: calls of closures of
+    caselam with the number of arguments of the site take the lambda at
+    index. The entries of a site form a list through next. """
+    _immutable_fields_ = ["caselam", "index", "lam", "next"]
+
+    def __init__(self, caselam, index, next):
+        self.caselam = caselam
+        self.index = index
+        self.lam = caselam.lams[index]
+        self.next = next
+
+    def actuals(self, args_w):
+        lam = self.lam
+        if lam.rest:
+            actuals = lam.match_args(args_w)
+            assert actuals is not None
+            return actuals
+        return args_w
+
+    def call(self, closure, args_w, env, cont, calling_app):
+        # like W_Closure.call_with_extra_info, without finding the lambda
+        lam = self.lam
+        if not jit.we_are_jitted() and env.pycketconfig().callgraph:
+            env.toplevel_env().callgraph.register_call(lam, calling_app, cont, env)
+        prev = lam.env_structure.prev.find_env_in_chain_speculate(
+                closure_frees(closure, self.index), calling_app.env_structure, env)
+        return lam.make_begin_cont(
+                ConsEnv.make(self.actuals(args_w), prev), cont)
+
+class CallCacheStats(object):
+    """ How the inline caches of the call sites did, counted by the
+    interpreter only. """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        # calls at megamorphic sites
+        self.generic = 0
+        self.megamorphic_sites = 0
+
+call_cache_stats = CallCacheStats()
+
 class App(AST):
-    _immutable_fields_ = ["rator", "rands[*]", "env_structure"]
+    _immutable_fields_ = ["rator", "rands[*]", "env_structure", "known?",
+                          "call_cache?", "megamorphic?"]
 
     def __init__ (self, rator, rands, env_structure=None):
         assert rator.simple
@@ -777,6 +1115,13 @@ class App(AST):
         self.rator = rator
         self.rands = rands
         self.env_structure = env_structure
+        # the target of the call if the rator is a known function
+        self.known = None
+        self.known_state = KNOWN_UNTRIED
+        # the inline cache of the closures called here, see CallCacheEntry
+        self.call_cache = None
+        self.call_cache_size = 0
+        self.megamorphic = False
 
     @staticmethod
     def make(rator, rands, env_structure=None):
@@ -787,10 +1132,16 @@ class App(AST):
                 pass
             else:
                 if isinstance(w_prim, values.W_Prim):
+                    if w_prim.simple0 and len(rands) == 0:
+                        return SimplePrimApp0(rator, rands, env_structure, w_prim)
                     if w_prim.simple1 and len(rands) == 1:
                         return SimplePrimApp1(rator, rands, env_structure, w_prim)
                     if w_prim.simple2 and len(rands) == 2:
                         return SimplePrimApp2(rator, rands, env_structure, w_prim)
+                    if w_prim.simple3 and len(rands) == 3:
+                        return SimplePrimApp3(rator, rands, env_structure, w_prim)
+                    if w_prim.simplen:
+                        return SimplePrimAppN(rator, rands, env_structure, w_prim)
         return App(rator, rands, env_structure)
 
     @staticmethod
@@ -850,31 +1201,125 @@ class App(AST):
         args_w = [None] * len(self.rands)
         for i, rand in enumerate(self.rands):
             args_w[i] = rand.interpret_simple(env)
+        known = self.known
+        if (known is None or known.w_callable is not w_callable or
+                known.version is not env.toplevel_env().version):
+            known = self.find_known_call(w_callable, env)
+        if known is not None:
+            return known.call(args_w, env, cont, self)
         if isinstance(w_callable, values.W_PromotableClosure):
             # fast path
             jit.promote(w_callable)
             w_callable = w_callable.closure
+        entry = self.lookup_call_cache(w_callable)
+        if entry is not None:
+            return entry.call(w_callable, args_w, env, cont, self)
         return w_callable.call_with_extra_info(args_w, env, cont, self)
 
+    def direct_safe(self):
+        # primitives that are not simple need the continuation
+        rator = self.rator
+        return not (isinstance(rator, ModuleVar) and rator.is_primitive())
+
+    def interpret_direct(self, env, depth, next_ast):
+        w_callable = self.rator.interpret_simple(env)
+        args_w = [None] * len(self.rands)
+        for i, rand in enumerate(self.rands):
+            args_w[i] = rand.interpret_simple(env)
+        if depth < DIRECT_MAX_DEPTH:
+            closure = w_callable
+            if isinstance(closure, values.W_PromotableClosure):
+                closure = closure.closure
+            entry = self.lookup_call_cache(closure)
+            if entry is not None and entry.lam.direct_ok():
+                lam = entry.lam
+                if env.pycketconfig().callgraph:
+                    env.toplevel_env().callgraph.register_direct_call(
+                            lam, self, next_ast, env)
+                prev = lam.env_structure.prev.find_env_in_chain_speculate(
+                        closure_frees(closure, entry.index), self.env_structure, env)
+                return lam.interpret_body_direct(
+                        ConsEnv.make(entry.actuals(args_w), prev), depth + 1, next_ast)
+        raise DirectReify(DirectCall(self, w_callable, args_w, env))
+
+    @jit.unroll_safe
+    def lookup_call_cache(self, closure):
+        """ The entry of the inline cache for calling closure, added on a
+        miss. None if closure is no closure, if none of its cases accepts
+        the arguments or if the site is megamorphic. """
+        if isinstance(closure, values.W_Closure):
+            caselam = closure.caselam
+        elif isinstance(closure, values.W_Closure1AsEnv):
+            caselam = closure.caselam
+        else:
+            return None
+        if self.megamorphic:
+            if not jit.we_are_jitted():
+                call_cache_stats.generic += 1
+            return None
+        jit.promote(caselam)
+        entry = self.call_cache
+        while entry is not None:
+            if entry.caselam is caselam:
+                if not jit.we_are_jitted():
+                    call_cache_stats.hits += 1
+                return entry
+            entry = entry.next
+        return self.call_cache_miss(caselam)
+
+    @jit.dont_look_inside
+    def call_cache_miss(self, caselam):
+        call_cache_stats.misses += 1
+        index = caselam_lambda_index(caselam, len(self.rands))
+        if index < 0:
+            # the generic call reports the error
+            return None
+        if self.call_cache_size == CALL_CACHE_SIZE:
+            self.megamorphic = True
+            self.call_cache = None
+            call_cache_stats.megamorphic_sites += 1
+            return None
+        entry = CallCacheEntry(caselam, index, self.call_cache)
+        self.call_cache = entry
+        self.call_cache_size += 1
+        return entry
+
+    def find_known_call(self, w_callable, env):
+        """ Caches the target of the call if the rator is a variable that is
+        never set! and bound to a closure. """
+        if self.known_state == KNOWN_UNTRIED:
+            rator = self.rator
+            if isinstance(rator, ModuleVar):
+                known = not rator.is_primitive() and not rator.is_mutable(env)
+            else:
+                known = isinstance(rator, ToplevelVar)
+            self.known_state = KNOWN_YES if known else KNOWN_NO
+        if self.known_state == KNOWN_NO:
+            return None
+        known = KnownCall.make(w_callable, len(self.rands),
+                               env.toplevel_env().version)
+        if known is None:
+            self.known_state = KNOWN_NO
+        self.known = known
+        return known
+
     def _tostring(self):
         elements = [self.rator] + self.rands
         return "(%s)" % " ".join([r.tostring() for r in elements])
 
-class SimplePrimApp1(App):
-    _immutable_fields_ = ['w_prim', 'rand1']
+class SimplePrimApp(App):
+    """ Base class of the applications of simple primitives, which call the
+    primitive directly instead of going through W_Prim.call. Subclasses
+    implement run. """
+    _immutable_fields_ = ['w_prim']
     simple = True
 
     def __init__(self, rator, rands, env_structure, w_prim):
         App.__init__(self, rator, rands, env_structure)
-        assert len(rands) == 1
-        self.rand1, = rands
         self.w_prim = w_prim
 
     def run(self, env):
-        result = self.w_prim.simple1(self.rand1.interpret_simple(env))
-        if result is None:
-            result = values.w_void
-        return result
+        raise NotImplementedError("abstract base class")
 
     def interpret_simple(self, env):
         return check_one_val(self.run(env))
@@ -889,19 +1334,49 @@ class SimplePrimApp1(App):
             return convert_runtime_exception(exn, env, cont)
         return return_multi_vals_direct(result, env, cont)
 
+    def direct_safe(self):
+        return True
 
-class SimplePrimApp2(App):
-    _immutable_fields_ = ['w_prim', 'rand1', 'rand2']
-    simple = True
+    def interpret_direct(self, env, depth, next_ast):
+        try:
+            return self.run(env)
+        except SchemeException, exn:
+            raise DirectReify(DirectError(exn, env))
 
+class SimplePrimApp0(SimplePrimApp):
     def __init__(self, rator, rands, env_structure, w_prim):
-        App.__init__(self, rator, rands, env_structure)
+        SimplePrimApp.__init__(self, rator, rands, env_structure, w_prim)
+        assert len(rands) == 0
+
+    def run(self, env):
+        result = self.w_prim.simple0()
+        if result is None:
+            result = values.w_void
+        return result
+
+class SimplePrimApp1(SimplePrimApp):
+    _immutable_fields_ = ['rand1']
+
+    def __init__(self, rator, rands, env_structure, w_prim):
+        SimplePrimApp.__init__(self, rator, rands, env_structure, w_prim)
+        assert len(rands) == 1
+        self.rand1, = rands
+
+    def run(self, env):
+        result = self.w_prim.simple1(self.rand1.interpret_simple(env))
+        if result is None:
+            result = values.w_void
+        return result
+
+class SimplePrimApp2(SimplePrimApp):
+    _immutable_fields_ = ['rand1', 'rand2']
+
+    def __init__(self, rator, rands, env_structure, w_prim):
+        SimplePrimApp.__init__(self, rator, rands, env_structure, w_prim)
         assert len(rands) == 2
         self.rand1, self.rand2 = rands
-        self.w_prim = w_prim
 
     def run(self, env):
-        from pycket.prims.control import convert_runtime_exception
         arg1 = self.rand1.interpret_simple(env)
         arg2 = self.rand2.interpret_simple(env)
         result = self.w_prim.simple2(arg1, arg2)
@@ -909,18 +1384,37 @@ class SimplePrimApp2(App):
             result = values.w_void
         return result
 
-    def interpret_simple(self, env):
-        return check_one_val(self.run(env))
+class SimplePrimApp3(SimplePrimApp):
+    _immutable_fields_ = ['rand1', 'rand2', 'rand3']
 
-    def interpret(self, env, cont):
-        from pycket.prims.control import convert_runtime_exception
-        if not env.pycketconfig().callgraph:
-            self.set_should_enter() # to jit downrecursion
-        try:
-            result = self.run(env)
-        except SchemeException, exn:
-            return convert_runtime_exception(exn, env, cont)
-        return return_multi_vals_direct(result, env, cont)
+    def __init__(self, rator, rands, env_structure, w_prim):
+        SimplePrimApp.__init__(self, rator, rands, env_structure, w_prim)
+        assert len(rands) == 3
+        self.rand1, self.rand2, self.rand3 = rands
+
+    def run(self, env):
+        arg1 = self.rand1.interpret_simple(env)
+        arg2 = self.rand2.interpret_simple(env)
+        arg3 = self.rand3.interpret_simple(env)
+        result = self.w_prim.simple3(arg1, arg2, arg3)
+        if result is None:
+            result = values.w_void
+        return result
+
+class SimplePrimAppN(SimplePrimApp):
+    """ Applications of variadic simple primitives and of those without a
+    direct call for this number of arguments. The primitive gets the list of
+    arguments, there is no continuation or W_Prim.call in between. """
+
+    @jit.unroll_safe
+    def run(self, env):
+        args_w = [None] * len(self.rands)
+        for i, rand in enumerate(self.rands):
+            args_w[i] = rand.interpret_simple(env)
+        result = self.w_prim.simplen(args_w)
+        if result is None:
+            result = values.w_void
+        return result
 
 class SequencedBodyAST(AST):
     _immutable_fields_ = ["body[*]", "counting_asts[*]"]
@@ -933,6 +1427,9 @@ class SequencedBodyAST(AST):
         self.counting_asts = [
             CombinedAstAndIndex(self, i)
                 for i in range(counts_needed)]
+        self.direct_state = DIRECT_UNKNOWN
+        self.direct_runs = 0
+        self.direct_fails = 0
 
     @objectmodel.always_inline
     def make_begin_cont(self, env, prev, i=0):
@@ -944,6 +1441,51 @@ class SequencedBodyAST(AST):
             return self.body[i], env, BeginCont(
                     self.counting_asts[i + 1], env, prev)
 
+    def body_direct_safe(self):
+        for b in self.body:
+            if not b.direct_safe():
+                return False
+        return True
+
+    def direct_part_safe(self):
+        """ Whether the part of the AST that direct_ok is about is
+        direct_safe, for a lambda its body. """
+        return self.body_direct_safe()
+
+    def direct_ok(self):
+        state = self.direct_state
+        if state == DIRECT_UNKNOWN:
+            state = DIRECT_YES if self.direct_part_safe() else DIRECT_NO
+            self.direct_state = state
+        return state == DIRECT_YES
+
+    def use_direct(self, env):
+        if (jit.we_are_jitted() or not env.pycketconfig().direct_stack or
+                scheduler.active):
+            return False
+        return self.direct_ok()
+
+    def direct_failed(self):
+        self.direct_fails += 1
+        if (self.direct_fails >= DIRECT_MIN_FAILS and
+                self.direct_fails * DIRECT_FAIL_RATIO > self.direct_runs):
+            self.direct_state = DIRECT_NO
+
+    def interpret_prefix_direct(self, env, depth):
+        """ Evaluates all but the last element of the body. """
+        body = self.body
+        for i in range(len(body) - 1):
+            try:
+                body[i].interpret_direct(env, depth, body[i + 1])
+            except DirectReify, e:
+                if not e.escape:
+                    e.frames.append(BodyFrame(self, i, env))
+                raise
+
+    def interpret_body_direct(self, env, depth, next_ast):
+        self.interpret_prefix_direct(env, depth)
+        return self.body[-1].interpret_direct(env, depth, next_ast)
+
 class Begin0(AST):
     _immutable_fields_ = ["first", "body"]
 
@@ -999,8 +1541,33 @@ class Begin(SequencedBodyAST):
 
     @objectmodel.always_inline
     def interpret(self, env, cont):
+        if self.use_direct(env):
+            return self.interpret_entry_direct(env, cont)
         return self.make_begin_cont(env, cont)
 
+    @jit.dont_look_inside
+    def interpret_entry_direct(self, env, cont):
+        self.direct_runs += 1
+        try:
+            self.interpret_prefix_direct(env, 0)
+        except DirectReify, e:
+            if not e.escape:
+                self.direct_failed()
+            return e.resume(cont)
+        return self.body[-1], env, cont
+
+    def direct_part_safe(self):
+        for i in range(len(self.body) - 1):
+            if not self.body[i].direct_safe():
+                return False
+        return True
+
+    def direct_safe(self):
+        return self.body_direct_safe()
+
+    def interpret_direct(self, env, depth, next_ast):
+        return self.interpret_body_direct(env, depth, next_ast)
+
     def _tostring(self):
         return "(begin %s)" % (" ".join([e.tostring() for e in self.body]))
 
@@ -1029,13 +1596,22 @@ class BeginForSyntax(AST):
         return "(begin-for-syntax %s)" % " ".join([b.tostring() for b in self.body])
 
 class Var(AST):
-    _immutable_fields_ = ["sym", "env_structure"]
+    _immutable_fields_ = ["sym", "env_structure", "address"]
     simple = True
 
     def __init__ (self, sym, env_structure=None):
         assert isinstance(sym, values.W_Symbol)
         self.sym = sym
         self.env_structure = env_structure
+        self.address = None
+        if env_structure is not None:
+            self.address = LexicalAddress.make(sym, env_structure)
+
+    def _lookup_lexical(self, env):
+        address = self.address
+        if address is None:
+            return env.lookup(self.sym, self.env_structure)
+        return address.lookup(env)
 
     def interpret_simple(self, env):
         val = self._lookup(env)
@@ -1066,12 +1642,12 @@ class CellRef(Var):
         return "CellRef(%s)" % Var._tostring(self)
 
     def _set(self, w_val, env):
-        v = env.lookup(self.sym, self.env_structure)
+        v = self._lookup_lexical(env)
         assert isinstance(v, values.W_Cell)
         v.set_val(w_val)
 
     def _lookup(self, env):
-        v = env.lookup(self.sym, self.env_structure)
+        v = self._lookup_lexical(env)
         assert isinstance(v, values.W_Cell)
         return v.get_val()
 
@@ -1110,7 +1686,7 @@ class LexicalVar(Var):
     def _lookup(self, env):
         if not objectmodel.we_are_translated():
             self.env_structure.check_plausibility(env)
-        return env.lookup(self.sym, self.env_structure)
+        return self._lookup_lexical(env)
 
     def _set(self, w_val, env):
         assert 0
@@ -1141,7 +1717,10 @@ class ModuleVar(Var):
         if w_res is None:
             if self.modenv is None:
                 self.modenv = env.toplevel_env().module_env
-            self.w_value = w_res = self._elidable_lookup()
+            w_res = self._elidable_lookup()
+            if isinstance(w_res, LazyDefinition):
+                w_res = w_res.force()
+            self.w_value = w_res
 
         if type(w_res) is values.W_Cell:
             return w_res.get_val()
@@ -1245,6 +1824,19 @@ class SetBang(AST):
     def interpret(self, env, cont):
         return self.rhs, env, SetBangCont(self, env, cont)
 
+    def direct_safe(self):
+        return self.rhs.direct_safe()
+
+    def interpret_direct(self, env, depth, next_ast):
+        try:
+            vals = self.rhs.interpret_direct(env, depth, None)
+        except DirectReify, e:
+            if not e.escape:
+                e.frames.append(SetBangFrame(self, env))
+            raise
+        self.var._set(check_one_val(vals), env)
+        return values.w_void
+
     def assign_convert(self, vars, env_structure):
         return SetBang(self.var.assign_convert(vars, env_structure),
                        self.rhs.assign_convert(vars, env_structure))
@@ -1294,6 +1886,16 @@ class If(AST):
         else:
             return self.thn, env, cont
 
+    def direct_safe(self):
+        return self.thn.direct_safe() and self.els.direct_safe()
+
+    def interpret_direct(self, env, depth, next_ast):
+        w_val = self.tst.interpret_simple(env)
+        if w_val is values.w_false:
+            return self.els.interpret_direct(env, depth, next_ast)
+        else:
+            return self.thn.interpret_direct(env, depth, next_ast)
+
     def assign_convert(self, vars, env_structure):
         sub_env_structure = env_structure
         return If(self.tst.assign_convert(vars, env_structure),
@@ -1437,7 +2039,7 @@ class CaseLambda(AST):
 class Lambda(SequencedBodyAST):
     _immutable_fields_ = ["formals[*]", "rest", "args",
                           "frees", "enclosing_env_structure", 'env_structure',
-                          "srcfile", "srcpos"]
+                          "free_addresses[*]", "srcfile", "srcpos"]
     simple = True
     def __init__ (self, formals, rest, args, frees, body, srcpos, srcfile, enclosing_env_structure=None, env_structure=None):
         SequencedBodyAST.__init__(self, body)
@@ -1449,6 +2051,13 @@ class Lambda(SequencedBodyAST):
         self.frees = frees
         self.enclosing_env_structure = enclosing_env_structure
         self.env_structure = env_structure
+        # where the free variables are in the environment of the closure
+        # creation, None if unknown
+        self.free_addresses = [None] * len(frees.elems)
+        if enclosing_env_structure is not None:
+            for i, v in enumerate(frees.elems):
+                self.free_addresses[i] = LexicalAddress.make(
+                        v, enclosing_env_structure)
         for b in self.body:
             b.set_surrounding_lambda(self)
 
@@ -1549,9 +2158,15 @@ class Lambda(SequencedBodyAST):
             if v is recursive_sym:
                 vals[j] = closure
             else:
-                vals[j] = env.lookup(v, self.enclosing_env_structure)
+                vals[j] = self._lookup_free(j, env)
         return vals
 
+    def _lookup_free(self, j, env):
+        address = self.free_addresses[j]
+        if address is None:
+            return env.lookup(self.frees.elems[j], self.enclosing_env_structure)
+        return address.lookup(env)
+
     @jit.unroll_safe
     def collect_frees_without_recursive(self, recursive_sym, env):
         num_vals = len(self.frees.elems)
@@ -1559,9 +2174,9 @@ class Lambda(SequencedBodyAST):
             num_vals -= 1
         vals = [None] * num_vals
         i = 0
-        for v in self.frees.elems:
+        for j, v in enumerate(self.frees.elems):
             if v is not recursive_sym:
-                vals[i] = env.lookup(v, self.enclosing_env_structure)
+                vals[i] = self._lookup_free(j, env)
                 i += 1
         return vals
 
@@ -1636,15 +2251,53 @@ class Letrec(SequencedBodyAST):
         self.args = args
 
     @jit.unroll_safe
-    def interpret(self, env, cont):
+    def _make_env(self, env):
         n_elems = len(self.args.elems)
         env_new = ConsEnv.make_n(n_elems, env)
         if n_elems:
             assert isinstance(env_new, ConsEnv)
             for i in range(n_elems):
                 env_new._set_list(i, values.W_Cell(None))
+        return env_new
+
+    def interpret(self, env, cont):
+        env_new = self._make_env(env)
         return self.rhss[0], env_new, LetrecCont(self.counting_asts[0], env_new, cont)
 
+    @jit.unroll_safe
+    def set_cells(self, i, vals, env):
+        if self.counts[i] != vals.num_values():
+            raise SchemeException("wrong number of values")
+        for j in range(vals.num_values()):
+            w_val = vals.get_value(j)
+            v = env.lookup(self.args.elems[self.total_counts[i] + j], self.args)
+            assert isinstance(v, values.W_Cell)
+            v.set_val(w_val)
+
+    def rhs_next_ast(self, i):
+        if i == len(self.rhss) - 1:
+            return self.body[0]
+        return self.rhss[i + 1]
+
+    def direct_safe(self):
+        for rhs in self.rhss:
+            if not rhs.direct_safe():
+                return False
+        return self.body_direct_safe()
+
+    def interpret_direct(self, env, depth, next_ast):
+        env_new = self._make_env(env)
+        for i in range(len(self.rhss)):
+            try:
+                vals = self.rhss[i].interpret_direct(env_new, depth,
+                                                     self.rhs_next_ast(i))
+            except DirectReify, e:
+                if not e.escape:
+                    e.frames.append(LetrecFrame(self, i, env_new))
+                raise
+            self.set_cells(i, vals, env_new)
+        return self.interpret_body_direct(env_new, depth, next_ast)
+
     def direct_children(self):
         return self.rhss + self.body
 
@@ -1789,9 +2442,62 @@ class Let(SequencedBodyAST):
     @objectmodel.always_inline
     def interpret(self, env, cont):
         env = self._prune_env(env, 0)
+        if self.use_direct(env):
+            return self.interpret_entry_direct(env, cont)
         return self.rhss[0], env, LetCont.make(
                 None, self, 0, env, cont)
 
+    @jit.dont_look_inside
+    def interpret_entry_direct(self, env, cont):
+        self.direct_runs += 1
+        try:
+            body_env = self._rhss_direct(env, 0)
+        except DirectReify, e:
+            if not e.escape:
+                self.direct_failed()
+            return e.resume(cont)
+        return self.make_begin_cont(body_env, cont)
+
+    def rhs_next_ast(self, i):
+        if i == len(self.rhss) - 1:
+            return self.body[0]
+        return self.rhss[i + 1]
+
+    def direct_part_safe(self):
+        for rhs in self.rhss:
+            if not rhs.direct_safe():
+                return False
+        return True
+
+    def direct_safe(self):
+        return self.direct_part_safe() and self.body_direct_safe()
+
+    def interpret_direct(self, env, depth, next_ast):
+        body_env = self._rhss_direct(self._prune_env(env, 0), depth)
+        return self.interpret_body_direct(body_env, depth, next_ast)
+
+    def _rhss_direct(self, env, depth):
+        """ Evaluates the right-hand sides in direct style, the environments
+        are pruned like by LetCont. Returns the environment of the body. """
+        vals_w = [None] * len(self.args.elems)
+        offset = 0
+        for i in range(len(self.rhss)):
+            try:
+                vals = self.rhss[i].interpret_direct(env, depth,
+                                                     self.rhs_next_ast(i))
+            except DirectReify, e:
+                if not e.escape:
+                    e.frames.append(LetFrame(self, i, vals_w[:offset], env))
+                raise
+            count = self.counts[i]
+            if vals.num_values() != count:
+                raise SchemeException("wrong number of values")
+            for j in range(count):
+                vals_w[offset + j] = vals.get_value(j)
+            offset += count
+            env = self._prune_env(env, i + 1)
+        return ConsEnv.make(vals_w, env)
+
     def direct_children(self):
         return self.rhss + self.body
 
@@ -1958,6 +2664,15 @@ class DefineValues(AST):
             defs[n] = None
         return defs
 
+    def is_pure(self):
+        """ Whether evaluating the definition has no effects and cannot fail,
+        so that it can be delayed until the variable is used. """
+        if len(self.names) != 1:
+            return False
+        rhs = self.rhs
+        return (isinstance(rhs, CaseLambda) or isinstance(rhs, Quote) or
+                isinstance(rhs, QuoteSyntax))
+
     def interpret(self, env, cont):
         return self.rhs.interpret(env, cont)
 
@@ -2018,6 +2733,10 @@ def inner_interpret_two_state(ast, env, cont):
         else:
             ast, env, cont = ast.interpret(env, cont)
         if ast.should_enter:
+            if scheduler.active:
+                scheduler.tick(ast, env, cont)
+            if profiler.state.profile is not None:
+                profiler.state.profile.tick(ast, cont)
             driver_two_state.can_enter_jit(ast=ast, came_from=came_from, env=env, cont=cont)
 
 def get_printable_location_one_state(green_ast ):
@@ -2036,6 +2755,10 @@ def inner_interpret_one_state(ast, env, cont):
         driver_one_state.jit_merge_point(ast=ast, env=env, cont=cont)
         ast, env, cont = ast.interpret(env, cont)
         if ast.should_enter:
+            if scheduler.active:
+                scheduler.tick(ast, env, cont)
+            if profiler.state.profile is not None:
+                profiler.state.profile.tick(ast, cont)
             driver_one_state.can_enter_jit(ast=ast, env=env, cont=cont)
 
 def interpret_one(ast, env=None):
@@ -2047,14 +2770,30 @@ def interpret_one(ast, env=None):
         inner_interpret = inner_interpret_one_state
     cont = NilCont()
     cont.update_cm(values.parameterization_key, values_parameter.top_level_config)
+    # other green threads can run in the loop; only the thread running ast
+    # ends in the NilCont
+    state_ast = ast
+    scheduler.depth += 1
     try:
-        inner_interpret(ast, env, cont)
+        while True:
+            try:
+                if state_ast is None:
+                    state_ast, env, cont = scheduler.next_state()
+                inner_interpret(state_ast, env, cont)
+            except ThreadSwitch:
+                state_ast = None
+            except SchemeException, e:
+                if not scheduler.thread_failed(e, env):
+                    raise
+                state_ast = None
     except Done, e:
         return e.values
     except SchemeException, e:
         if e.context_ast is None:
             e.context_ast = ast
         raise
+    finally:
+        scheduler.depth -= 1
 
 def interpret_toplevel(a, env):
     if isinstance(a, Begin):
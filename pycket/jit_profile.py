@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Warm-start profiles, written with --save-jit-profile and read with
+# --load-jit-profile.
+#
+# With the callgraph, a lambda only becomes a loop header once
+# CallGraph.register_call has seen it recurse, and until then its code is
+# interpreted without ever entering the JIT. A profile records which ASTs
+# were marked by the end of a run, so that the next run of the same program
+# can mark them as soon as their module is instantiated.
+#
+# A lambda is identified by its source file and position. The marked ASTs of
+# a lambda are given by their indices in a preorder walk of its body that
+# does not descend into nested lambdas; the first AST of the body is the
+# entry of the lambda itself, the others are the continuations marked for
+# down-recursion. One line per lambda:
+#
+#   <srcpos> <index>,<index>,... <srcfile>
+#
+# The indices only fit the ASTs the profile was made from. A profile for an
+# older version of a program marks some wrong ASTs, which makes the JIT trace
+# a bit more than necessary but never changes the result.
+
+from rpython.rlib             import streamio
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.rstring     import ParseStringError
+
+def lambda_key(lam):
+    if not lam.srcfile or lam.srcpos < 0:
+        return None
+    return "%d %s" % (lam.srcpos, lam.srcfile)
+
+def lambda_asts(lam):
+    """ The ASTs that belong to lam, in preorder. """
+    from pycket.interpreter import Lambda
+    result = []
+    todo = lam.body[:]
+    todo.reverse()
+    while todo:
+        ast = todo.pop()
+        result.append(ast)
+        if isinstance(ast, Lambda):
+            continue
+        children = ast.direct_children()
+        for i in range(len(children) - 1, -1, -1):
+            todo.append(children[i])
+    return result
+
+def module_lambdas(module):
+    """ The lambdas in the body of module, but not in its submodules. """
+    from pycket.interpreter import Lambda, Module
+    result = []
+    todo = module.body[:]
+    while todo:
+        ast = todo.pop()
+        if isinstance(ast, Module):
+            continue
+        if isinstance(ast, Lambda):
+            result.append(ast)
+        todo.extend(ast.direct_children())
+    return result
+
+class JitProfile(object):
+    def __init__(self):
+        # lambda key -> indices of the marked ASTs
+        self.entries = {}
+
+    def record(self, lam):
+        key = lambda_key(lam)
+        if key is None:
+            return
+        indices = []
+        asts = lambda_asts(lam)
+        for i in range(len(asts)):
+            if asts[i].should_enter:
+                indices.append(i)
+        if indices:
+            self.entries[key] = indices
+
+    def apply(self, module):
+        """ Marks the ASTs of the lambdas of module. Returns the number of
+        lambdas found in the profile. """
+        if not self.entries:
+            return 0
+        count = 0
+        for lam in module_lambdas(module):
+            key = lambda_key(lam)
+            if key is None:
+                continue
+            indices = self.entries.get(key, None)
+            if indices is None:
+                continue
+            asts = lambda_asts(lam)
+            for i in indices:
+                if i < len(asts):
+                    asts[i].set_should_enter()
+            count += 1
+        return count
+
+    def write(self, path):
+        stream = streamio.open_file_as_stream(path, "w")
+        try:
+            for key, indices in self.entries.iteritems():
+                space = key.find(" ")
+                assert space >= 0
+                stream.write("%s %s %s\n" % (
+                    key[:space], ",".join([str(i) for i in indices]),
+                    key[space + 1:]))
+        finally:
+            stream.close()
+
+    def read(self, path):
+        """ Adds the entries of the profile at path. Returns False if the
+        file is not a profile. """
+        stream = streamio.open_file_as_stream(path, "r")
+        try:
+            data = stream.readall()
+        finally:
+            stream.close()
+        for line in data.split("\n"):
+            if not line:
+                continue
+            parts = line.split(" ", 2)
+            if len(parts) != 3:
+                return False
+            indices = []
+            try:
+                string_to_int(parts[0])
+                for index in parts[1].split(","):
+                    indices.append(string_to_int(index))
+            except ParseStringError:
+                return False
+            self.entries["%s %s" % (parts[0], parts[2])] = indices
+        return True
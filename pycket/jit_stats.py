@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Statistics about what the JIT does, collected through RPython's JIT hooks.
+#
+# The hooks are installed by the jitpolicy in entry_point.py. They count the
+# loops and bridges compiled and the traces aborted, per reason and per green
+# key (as printed by get_printable_location_two_state, i.e. the source
+# location of the loop header). The time spent tracing and in the backend is
+# taken from the JIT's own counters. The numbers are available to Racket code
+# through the pycket-jit-stats primitives and are printed on exit with
+# --jit-stats.
+
+from rpython.rlib.jit import JitHookInterface, Counters
+from rpython.rlib import jit_hooks
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rfloat import formatd
+
+class JitStatsEntry(object):
+    def __init__(self, greenkey):
+        self.greenkey = greenkey
+        self.loops = 0
+        self.bridges = 0
+        self.aborts = 0
+        self.too_long = 0
+
+class JitStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.loops = 0
+        self.bridges = 0
+        self.too_long = 0
+        self.aborts = {}
+        self.entries = {}
+
+    def entry(self, greenkey):
+        entry = self.entries.get(greenkey, None)
+        if entry is None:
+            entry = JitStatsEntry(greenkey)
+            self.entries[greenkey] = entry
+        return entry
+
+    def record_loop(self, greenkey):
+        self.loops += 1
+        self.entry(greenkey).loops += 1
+
+    def record_bridge(self, greenkey):
+        self.bridges += 1
+        self.entry(greenkey).bridges += 1
+
+    def record_abort(self, reason, greenkey):
+        self.aborts[reason] = self.aborts.get(reason, 0) + 1
+        self.entry(greenkey).aborts += 1
+
+    def record_too_long(self, greenkey):
+        self.too_long += 1
+        self.entry(greenkey).too_long += 1
+
+    def total_aborts(self):
+        total = 0
+        for count in self.aborts.itervalues():
+            total += count
+        return total
+
+    def tracing_time(self):
+        if not we_are_translated():
+            return 0.0
+        return jit_hooks.stats_get_times_value(None, Counters.TRACING)
+
+    def backend_time(self):
+        if not we_are_translated():
+            return 0.0
+        return jit_hooks.stats_get_times_value(None, Counters.BACKEND)
+
+    def format(self):
+        lines = ["jit: %d loops, %d bridges, %d aborts, %d traces too long" % (
+                     self.loops, self.bridges, self.total_aborts(), self.too_long),
+                 "jit: %ss tracing, %ss in the backend" % (
+                     formatd(self.tracing_time(), 'f', 3),
+                     formatd(self.backend_time(), 'f', 3))]
+        for reason, count in self.aborts.iteritems():
+            lines.append("jit: aborted %d times: %s" % (count, reason))
+        for entry in self.entries.itervalues():
+            lines.append("jit: %s: %d loops, %d bridges, %d aborts, %d too long" % (
+                entry.greenkey, entry.loops, entry.bridges, entry.aborts,
+                entry.too_long))
+        return "\n".join(lines)
+
+stats = JitStats()
+
+def _abort_reason(reason):
+    if 0 <= reason < len(Counters.counter_names):
+        return Counters.counter_names[reason]
+    return "unknown"
+
+class PycketJitHooks(JitHookInterface):
+    def on_abort(self, reason, jitdriver, greenkey, greenkey_repr, logops, operations):
+        stats.record_abort(_abort_reason(reason), greenkey_repr)
+
+    def on_trace_too_long(self, jitdriver, greenkey, greenkey_repr):
+        stats.record_too_long(greenkey_repr)
+
+    def after_compile(self, debug_info):
+        stats.record_loop(debug_info.get_greenkey_repr())
+
+    def after_compile_bridge(self, debug_info):
+        stats.record_bridge(debug_info.get_greenkey_repr())
+
+hooks = PycketJitHooks()
+
+def enable_timing():
+    """ Make the JIT measure the time spent tracing and in the backend. """
+    if we_are_translated():
+        jit_hooks.stats_set_debug(None, True)
@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A simplification pass over the AST of a module, run by
+# Module.assign_convert_module before assignment conversion (so lexical
+# variables are still plain names and no environment structure has been
+# computed yet). Enable with --optimize-ast at translation time.
+#
+#  - applications of pure primitives (see FOLDABLE) to constants are folded,
+#    by calling their simple entry point; eq? and eqv? only on atoms whose
+#    identity is fixed (see IDENTITY_FOLDABLE)
+#  - constants bound by a let and never set! are substituted into its body
+#  - let bindings of unused variables whose right-hand side has no effect are
+#    dropped, a let without bindings becomes its body
+#  - ifs on constants are replaced by the branch taken
+#
+# Only the node types below are rewritten, all others are left as they are,
+# including what is below them. Submodules are optimized when they are
+# converted themselves.
+
+from pycket             import values
+from pycket.arity       import Arity
+from pycket.env         import SymList
+from pycket.error       import SchemeException
+from pycket.interpreter import (App, Begin, Begin0, CaseLambda, DefineValues,
+                                If, Lambda, Let, Letrec, LexicalVar, Module,
+                                ModuleVar, Quote, SetBang,
+                                WithContinuationMark, check_one_val,
+                                make_lambda)
+
+FOLDABLE = {}
+for name in ["+", "-", "*", "/", "<", ">", "<=", ">=", "=", "add1", "sub1",
+             "abs", "max", "min", "quotient", "remainder", "modulo",
+             "zero?", "positive?", "negative?", "even?", "odd?",
+             "exact?", "inexact?", "integer?", "real?", "number?",
+             "fixnum?", "flonum?", "exact->inexact", "inexact->exact",
+             "fx+", "fx-", "fx*", "fx<", "fx>", "fx<=", "fx>=", "fx=",
+             "fl+", "fl-", "fl*", "fl/", "fl<", "fl>", "fl<=", "fl>=", "fl=",
+             "arithmetic-shift", "bitwise-and", "bitwise-ior", "bitwise-xor",
+             "not", "null?", "pair?", "symbol?", "string?",
+             "boolean?", "char?", "char->integer"]:
+    FOLDABLE[name] = None
+
+# whether these hold for a number or another allocated value can differ
+# between compile time and runtime, they are folded on identity atoms only
+IDENTITY_FOLDABLE = {"eq?": None, "eqv?": None}
+
+def is_atom(w_val):
+    return (isinstance(w_val, values.W_Number) or
+            isinstance(w_val, values.W_Bool) or
+            isinstance(w_val, values.W_Character) or
+            isinstance(w_val, values.W_Symbol) or
+            w_val is values.w_null or w_val is values.w_void)
+
+def is_identity_atom(w_val):
+    return (isinstance(w_val, values.W_Fixnum) or
+            isinstance(w_val, values.W_Bool) or
+            isinstance(w_val, values.W_Character) or
+            isinstance(w_val, values.W_Symbol))
+
+def is_pure(ast):
+    """ Whether evaluating ast has no effects and cannot fail. """
+    return (isinstance(ast, Quote) or isinstance(ast, CaseLambda) or
+            type(ast) is LexicalVar)
+
+def count_nodes(ast):
+    if isinstance(ast, Module):
+        return 1
+    count = 1
+    for child in ast.direct_children():
+        count += count_nodes(child)
+    return count
+
+class OptimizerStats(object):
+    """ The number of nodes of each module before and after optimizing. """
+    def __init__(self):
+        self.modules = []
+
+    def record(self, name, before, after):
+        self.modules.append((name, before, after))
+
+    def format(self):
+        lines = ["AST nodes before and after optimizing:"]
+        for name, before, after in self.modules:
+            lines.append("  %s: %d -> %d" % (name, before, after))
+        return "\n".join(lines)
+
+stats = OptimizerStats()
+
+def optimize_module(name, body):
+    before = 0
+    for b in body:
+        before += count_nodes(b)
+    new_body = [optimize(b, {}) for b in body]
+    after = 0
+    for b in new_body:
+        after += count_nodes(b)
+    stats.record(name, before, after)
+    return new_body
+
+def without(consts, syms):
+    """ consts without the variables bound again by syms. """
+    result = consts
+    for sym in syms:
+        if sym in result:
+            if result is consts:
+                result = consts.copy()
+            del result[sym]
+    return result
+
+def call_prim(w_prim, args_w):
+    """ Calls the simple entry point of w_prim, returns None if it has
+    none. """
+    if not w_prim.simplen:
+        return None
+    result = w_prim.simplen(args_w)
+    if result is None:
+        return values.w_void
+    return check_one_val(result)
+
+def fold_app(rator, rands):
+    if not isinstance(rator, ModuleVar) or not rator.is_primitive():
+        return None
+    for rand in rands:
+        if not isinstance(rand, Quote) or not is_atom(rand.w_val):
+            return None
+    try:
+        w_prim = rator._lookup_primitive()
+    except SchemeException:
+        return None
+    if not isinstance(w_prim, values.W_Prim):
+        return None
+    name = w_prim.name.utf8value
+    if name in IDENTITY_FOLDABLE:
+        for rand in rands:
+            if not is_identity_atom(rand.w_val):
+                return None
+    elif name not in FOLDABLE:
+        return None
+    if w_prim.result_arity is not Arity.ONE:
+        return None
+    try:
+        w_result = call_prim(w_prim, [rand.w_val for rand in rands])
+    except SchemeException:
+        return None
+    if w_result is None or not is_atom(w_result):
+        return None
+    return Quote(w_result)
+
+def optimize_body(body, consts):
+    return [optimize(b, consts) for b in body]
+
+def optimize(ast, consts):
+    if type(ast) is LexicalVar:
+        w_val = consts.get(ast.sym, None)
+        if w_val is not None:
+            # every use gets its own node, nodes carry per-site state
+            return Quote(w_val)
+        return ast
+    if isinstance(ast, App):
+        rator = optimize(ast.rator, consts)
+        rands = optimize_body(ast.rands, consts)
+        folded = fold_app(rator, rands)
+        if folded is not None:
+            return folded
+        return App.make(rator, rands)
+    if isinstance(ast, If):
+        tst = optimize(ast.tst, consts)
+        if isinstance(tst, Quote):
+            if tst.w_val is values.w_false:
+                return optimize(ast.els, consts)
+            return optimize(ast.thn, consts)
+        return If(tst, optimize(ast.thn, consts), optimize(ast.els, consts))
+    if isinstance(ast, Let):
+        return optimize_let(ast, consts)
+    if isinstance(ast, Letrec):
+        inner = without(consts, ast.args.elems)
+        return Letrec(SymList(ast.args.elems), ast.counts,
+                      optimize_body(ast.rhss, inner),
+                      optimize_body(ast.body, inner))
+    if isinstance(ast, CaseLambda):
+        inner = consts
+        if ast.recursive_sym is not None:
+            inner = without(consts, [ast.recursive_sym])
+        lams = [optimize_lambda(lam, inner) for lam in ast.lams]
+        return CaseLambda(lams, ast.recursive_sym, ast._arity)
+    if isinstance(ast, Lambda):
+        return optimize_lambda(ast, consts)
+    if isinstance(ast, Begin):
+        return Begin.make(optimize_body(ast.body, consts))
+    if isinstance(ast, Begin0):
+        return Begin0(optimize(ast.first, consts), optimize(ast.body, consts))
+    if isinstance(ast, SetBang):
+        return SetBang(ast.var, optimize(ast.rhs, consts))
+    if isinstance(ast, WithContinuationMark):
+        return WithContinuationMark(optimize(ast.key, consts),
+                                    optimize(ast.value, consts),
+                                    optimize(ast.body, consts))
+    if isinstance(ast, DefineValues):
+        return DefineValues(ast.names, optimize(ast.rhs, consts),
+                            ast.display_names)
+    return ast
+
+def optimize_lambda(lam, consts):
+    inner = without(consts, lam.args.elems)
+    return make_lambda(lam.formals, lam.rest, optimize_body(lam.body, inner),
+                       lam.srcpos, lam.srcfile)
+
+def optimize_let(let, consts):
+    # the right-hand sides don't see the variables of the let
+    rhss = optimize_body(let.rhss, consts)
+    mutated = {}
+    for b in let.body:
+        for var in b.mutated_vars():
+            if isinstance(var, LexicalVar):
+                mutated[var.sym] = None
+    inner = without(consts, let.args.elems)
+    offset = 0
+    for i in range(len(rhss)):
+        sym = let.args.elems[offset]
+        if (let.counts[i] == 1 and isinstance(rhss[i], Quote) and
+                sym not in mutated):
+            if inner is consts:
+                inner = consts.copy()
+            inner[sym] = rhss[i].w_val
+        offset += let.counts[i]
+    body = optimize_body(let.body, inner)
+
+    used = {}
+    for b in body:
+        used.update(b.free_vars())
+    new_syms = []
+    new_counts = []
+    new_rhss = []
+    offset = 0
+    for i in range(len(rhss)):
+        count = let.counts[i]
+        syms = let.args.elems[offset:offset + count]
+        offset += count
+        if count == 1 and syms[0] not in used and is_pure(rhss[i]):
+            continue
+        new_syms.extend(syms)
+        new_counts.append(count)
+        new_rhss.append(rhss[i])
+    if not new_rhss:
+        return Begin.make(body)
+    return Let(SymList(new_syms), new_counts, new_rhss, body)
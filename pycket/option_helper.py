@@ -7,7 +7,11 @@ from .expand import (expand_file_to_json, expand_code_to_json,
                      ensure_json_ast_eval, ensure_json_ast_run,
                      PermException, SchemeException)
 
+from pycket.expansion_cache import DEFAULT_SIZE
+
 from rpython.rlib import jit
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.rstring import ParseStringError
 
 
 def script_exprs(arg, content):
@@ -40,6 +44,42 @@ def print_help(argv):
   -u <file>, --require-script <file> : Same as -t <file> -N <file> --
  Configuration options:
   --stdlib: Use Pycket's version of stdlib (only applicable for -e)
+  --expander-workers <n> : Expand modules using up to <n> resident Racket
+                           processes, 0 (the default) starts one process
+                           per module
+  --future-workers <n> : Run up to <n> futures at a time in worker
+                         processes, 0 runs all futures on touch
+  --make-snapshot <file> : After running, save the loaded modules to <file>
+  --restore <file> : Start from the modules saved with --make-snapshot
+  --lazy-modules : Evaluate module-level function and constant definitions
+                   only when they are first used
+  --serve <socket> : After loading, call the module's functions on request
+                     on the Unix domain socket <socket>, see pycket/server.py
+ Compilation options:
+  --cache-dir <dir> : Keep expanded modules in the shared cache <dir> instead
+                      of next to the sources, defaults to $PYCKET_CACHE_DIR
+  --cache-size <MB> : Evict from the cache when it grows beyond <MB>
+                      megabytes, defaults to $PYCKET_CACHE_SIZE or %d
+  --cache-stats : Print the hits and misses of the cache on exit
+  --compile-only <file> : Expand <file> and everything it requires, build the
+                          caches and exit without running it
+  --precompile <dir> : Like --compile-only for every .rkt file in <dir>
+ Profiling options:
+  --save-callgraph : Write the callgraph to callgraph.dot on exit
+  --profile <file> : Sample the stack of Racket functions at loop headers
+                     and count their calls, write a flat profile to <file>
+                     and collapsed stacks for flamegraph tools to
+                     <file>.folded on exit. Calls from JIT-compiled code are
+                     not counted
+  --jit-stats : Print the loops and bridges compiled and the traces aborted
+                by the JIT on exit, also per loop header
+  --ast-stats : Print the number of AST nodes of every module before and
+                after optimizing on exit, for executables translated with
+                --optimize-ast
+  --save-jit-profile <file> : Write the loop headers found by the callgraph
+                              to <file> on exit
+  --load-jit-profile <file> : Mark the loop headers saved with
+                              --save-jit-profile from the start
  Meta options:
   --jit <jitargs> : Set RPython JIT options may be 'default', 'off',
                     or 'param=value,param=value' list
@@ -47,7 +87,7 @@ def print_help(argv):
   -h, --help : Show this information and exits, ignoring other options
 Default options:
  If only an argument is specified, it is loaded and evaluated
-""" % (argv[0])
+""" % (argv[0], DEFAULT_SIZE)
 
 _run = True
 _eval = False
@@ -118,6 +158,75 @@ def parse_args(argv):
                 break
         elif argv[i] == '--save-callgraph':
             config['save-callgraph'] = True
+        elif argv[i] == "--jit-stats":
+            config['jit-stats'] = True
+        elif argv[i] == "--ast-stats":
+            config['ast-stats'] = True
+        elif argv[i] == "--compile-only":
+            config['compile-only'] = True
+        elif argv[i] == "--precompile":
+            if to <= i + 1:
+                print "missing argument after --precompile"
+                retval = 5
+                break
+            i += 1
+            config['compile-only'] = True
+            names['precompile'] = argv[i]
+            retval = 0
+        elif argv[i] == "--cache-dir":
+            if to <= i + 1:
+                print "missing argument after --cache-dir"
+                retval = 5
+                break
+            i += 1
+            names['cache-dir'] = argv[i]
+        elif argv[i] == "--cache-size":
+            if to <= i + 1:
+                print "missing argument after --cache-size"
+                retval = 5
+                break
+            i += 1
+            if _parse_count(argv[i]) <= 0:
+                print "bad argument to --cache-size: %s" % argv[i]
+                retval = 5
+                break
+            names['cache-size'] = argv[i]
+        elif argv[i] in ["--make-snapshot", "--restore", "--serve",
+                         "--save-jit-profile", "--load-jit-profile",
+                         "--profile"]:
+            arg = argv[i][2:]
+            if to <= i + 1:
+                print "missing argument after --%s" % arg
+                retval = 5
+                break
+            i += 1
+            names[arg] = argv[i]
+        elif argv[i] == "--lazy-modules":
+            config['lazy-modules'] = True
+        elif argv[i] == "--cache-stats":
+            config['cache-stats'] = True
+        elif argv[i] == "--expander-workers":
+            if to <= i + 1:
+                print "missing argument after --expander-workers"
+                retval = 5
+                break
+            i += 1
+            if _parse_count(argv[i]) < 0:
+                print "bad argument to --expander-workers: %s" % argv[i]
+                retval = 5
+                break
+            names['expander-workers'] = argv[i]
+        elif argv[i] == "--future-workers":
+            if to <= i + 1:
+                print "missing argument after --future-workers"
+                retval = 5
+                break
+            i += 1
+            if _parse_count(argv[i]) < 0:
+                print "bad argument to --future-workers: %s" % argv[i]
+                retval = 5
+                break
+            names['future-workers'] = argv[i]
         else:
             if 'file' in names:
                 break
@@ -137,6 +246,57 @@ def parse_args(argv):
 
     return config, names, args, retval
 
+def _parse_count(arg):
+    try:
+        return string_to_int(arg)
+    except ParseStringError:
+        return -1
+
+def expander_workers(names):
+    """ The size of the expander pool, 0 (the default) expands every module
+    with a Racket process of its own. """
+    if 'expander-workers' not in names:
+        return 0
+    return _parse_count(names['expander-workers'])
+
+def future_workers(names):
+    from pycket.future import DEFAULT_WORKERS
+    if 'future-workers' not in names:
+        return DEFAULT_WORKERS
+    return _parse_count(names['future-workers'])
+
+def expansion_cache_dir(names):
+    """ The shared expansion cache directory, or "" to keep the json files
+    next to the sources. """
+    if 'cache-dir' in names:
+        return names['cache-dir']
+    directory = os.environ.get('PYCKET_CACHE_DIR')
+    if directory is None:
+        return ""
+    return directory
+
+def expansion_cache_size(names):
+    """ The maximal size of the expansion cache in bytes. """
+    if 'cache-size' in names:
+        megabytes = _parse_count(names['cache-size'])
+    else:
+        size = os.environ.get('PYCKET_CACHE_SIZE')
+        megabytes = _parse_count(size) if size is not None else DEFAULT_SIZE
+        if megabytes <= 0:
+            megabytes = DEFAULT_SIZE
+    return megabytes * 1024 * 1024
+
+def compile_roots(names):
+    """ The modules to precompile for --compile-only and --precompile. """
+    from pycket.expand import find_racket_files
+    if 'precompile' in names:
+        roots = find_racket_files(names['precompile'], [])
+    else:
+        roots = []
+    if 'file' in names:
+        roots.append(names['file'])
+    return [os.path.abspath(root) for root in roots]
+
 def _temporary_file():
     from rpython.rlib.objectmodel import we_are_translated
     if we_are_translated():
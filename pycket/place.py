@@ -0,0 +1,267 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Places, run as forked pycket processes.
+#
+# dynamic-place forks the interpreter. The child loads the place module into
+# the module environment it inherited, calls the start function with its end
+# of the place channel and exits when the function returns. Unlike in Racket,
+# the place does not start from fresh module instances: modules the parent had
+# already instantiated, including the place module itself, are not run again,
+# so the start function sees their state as it was when the place was
+# created.
+#
+# The two ends of a place channel are a pair of pipes. A message is the length
+# of its serialization (see pycket.serialize) as four bytes followed by the
+# serialization itself. Neither side ever blocks the process on a pipe:
+# syncing on a place channel reads what is available from its pipe, and the
+# write ends are non-blocking, a put that does not fit into the pipe waits for
+# it to become writable (POLLOUT) as a sync. The other green threads keep
+# running meanwhile.
+
+import errno
+import os
+
+from pycket              import values
+from pycket.cont         import BaseCont
+from pycket.error        import SchemeException
+from pycket.scheduler    import scheduler
+from pycket.serialize    import Reader, SerializationError, serialize_value
+from rpython.rlib        import rpoll, rposix
+
+# bytes read from a pipe at once
+READ_SIZE = 65536
+
+SIGKILL = 9
+
+def encode_length(n):
+    return (chr((n >> 24) & 0xff) + chr((n >> 16) & 0xff) +
+            chr((n >> 8) & 0xff) + chr(n & 0xff))
+
+def decode_length(s, pos):
+    n = 0
+    for i in range(4):
+        n = (n << 8) | ord(s[pos + i])
+    return n
+
+def fd_readable(fd):
+    try:
+        return len(rpoll.poll({fd: rpoll.POLLIN}, 0)) > 0
+    except rpoll.PollError:
+        return True
+
+def fd_writable(fd):
+    try:
+        return len(rpoll.poll({fd: rpoll.POLLOUT}, 0)) > 0
+    except rpoll.PollError:
+        return True
+
+def set_nonblocking(fd):
+    flags = rposix.get_status_flags(fd)
+    rposix.set_status_flags(fd, flags | rposix.O_NONBLOCK)
+
+def message_allowed(w_val):
+    try:
+        serialize_value(w_val)
+    except SerializationError:
+        return False
+    return True
+
+class W_PlaceChannel(values.W_Evt):
+    errorname = "place-channel"
+    _attrs_ = ['in_fd', 'out_fd', 'buffer', 'eof', 'outgoing']
+
+    def __init__(self, in_fd, out_fd):
+        self.in_fd = in_fd
+        self.out_fd = out_fd
+        self.buffer = ""
+        self.eof = False
+        # messages put but not yet written to the pipe
+        self.outgoing = ""
+
+    def put(self, w_val):
+        """ Queues w_val for the other end. Returns whether all queued
+        messages have been written, see flush. """
+        try:
+            data = serialize_value(w_val)
+        except SerializationError, e:
+            raise SchemeException("place-channel-put: %s" % e.msg)
+        self.outgoing += encode_length(len(data)) + data
+        return self.flush()
+
+    def flush(self):
+        """ Writes as much of the queued messages as the pipe takes without
+        blocking. Returns whether all of them have been written. """
+        while self.outgoing:
+            if not fd_writable(self.out_fd):
+                return False
+            try:
+                written = os.write(self.out_fd, self.outgoing)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return False
+                raise SchemeException("place-channel-put: the place is gone")
+            self.outgoing = self.outgoing[written:]
+        return True
+
+    def next_message(self):
+        buffer = self.buffer
+        if len(buffer) < 4:
+            return None
+        stop = 4 + decode_length(buffer, 0)
+        if len(buffer) < stop:
+            return None
+        assert stop >= 0
+        self.buffer = buffer[stop:]
+        return Reader(buffer[4:stop]).read_value()
+
+    def try_sync(self):
+        while True:
+            w_msg = self.next_message()
+            if w_msg is not None or self.eof or not fd_readable(self.in_fd):
+                return w_msg
+            try:
+                data = os.read(self.in_fd, READ_SIZE)
+            except OSError:
+                data = ""
+            if not data:
+                # the other end is closed, no message can arrive anymore
+                self.eof = True
+            self.buffer += data
+
+    def needs_polling(self):
+        return not self.eof
+
+    def tostring(self):
+        return "#<place-channel>"
+
+class W_Place(W_PlaceChannel):
+    """ The parent's side of a place, also its place channel. status is the
+    exit code of the process once it has ended. """
+    errorname = "place"
+    _attrs_ = ['pid', 'status']
+
+    def __init__(self, pid, in_fd, out_fd):
+        W_PlaceChannel.__init__(self, in_fd, out_fd)
+        self.pid = pid
+        self.status = -1
+
+    def poll_status(self):
+        if self.status < 0:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid == self.pid:
+                if os.WIFEXITED(status):
+                    self.status = os.WEXITSTATUS(status)
+                else:
+                    self.status = 1
+        return self.status
+
+    def kill(self):
+        if self.poll_status() < 0:
+            os.kill(self.pid, SIGKILL)
+            pid, status = os.waitpid(self.pid, 0)
+            self.status = 1
+
+    def tostring(self):
+        return "#<place>"
+
+class W_PlaceFlushEvt(values.W_Evt):
+    """ Ready once the messages put on the channel have all been written. """
+    errorname = "place-flush-evt"
+    _immutable_fields_ = ["channel"]
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def try_sync(self):
+        if self.channel.flush():
+            return self
+        return None
+
+    def needs_polling(self):
+        return True
+
+    def tostring(self):
+        return "#<place-flush-evt>"
+
+class W_PlaceDeadEvt(values.W_Evt):
+    errorname = "place-dead-evt"
+    _immutable_fields_ = ["place"]
+
+    def __init__(self, place):
+        self.place = place
+
+    def try_sync(self):
+        if self.place.poll_status() >= 0:
+            return self
+        return None
+
+    def needs_polling(self):
+        return True
+
+    def tostring(self):
+        return "#<place-dead-evt>"
+
+class PlaceExitCont(BaseCont):
+    """ Ends the place process when its start function returns. """
+    def _clone(self):
+        return PlaceExitCont()
+
+    def plug_reduce(self, vals, env):
+        from pycket.prims.input_output import shutdown
+        shutdown(env)
+        os._exit(0)
+
+def load_place_module(fname, env):
+    from pycket.expand import ModTable, expand_file_cached
+    top = env.toplevel_env()
+    module = top.module_env._find_module(fname)
+    if module is not None:
+        module.interpret_mod(top)
+        return module
+    modtable = ModTable()
+    # share the modules that are already loaded
+    for name, module in top.module_env.modules.iteritems():
+        modtable.add_module(name, module)
+    modtable.enter_module(fname)
+    module = expand_file_cached(fname, modtable)
+    modtable.exit_module(fname, module)
+    top.module_env.add_module(fname, module)
+    module.interpret_mod(top)
+    return module
+
+def fork_place(env):
+    """ Forks a place. Returns the W_Place in the parent and the child's end
+    of the place channel in the child. """
+    from pycket.prims.input_output import shutdown
+    # output that is still buffered would be written by both processes
+    shutdown(env)
+    to_child_r, to_child_w = os.pipe()
+    to_parent_r, to_parent_w = os.pipe()
+    pid = os.fork()
+    if pid != 0:
+        os.close(to_child_r)
+        os.close(to_parent_w)
+        set_nonblocking(to_child_w)
+        return W_Place(pid, to_parent_r, to_child_w)
+    os.close(to_child_w)
+    os.close(to_parent_r)
+    set_nonblocking(to_parent_w)
+    scheduler.enter_child(True)
+    return W_PlaceChannel(to_child_r, to_parent_w)
+
+def run_place(fname, w_name, channel, env, cont):
+    """ Calls the start function of the place module with the channel,
+    replacing the continuation of dynamic-place. """
+    from pycket.interpreter import LazyDefinition
+    module = load_place_module(fname, env)
+    w_start = module.lookup(w_name)
+    if isinstance(w_start, LazyDefinition):
+        w_start = w_start.force()
+    if not w_start.iscallable():
+        raise SchemeException("dynamic-place: %s is not a procedure" %
+                              w_name.tostring())
+    exit_cont = PlaceExitCont()
+    exit_cont.update_cm(values.parameterization_key,
+                        cont.get_mark_first(values.parameterization_key))
+    return w_start.call([channel], env, exit_cont)
@@ -66,10 +66,11 @@ def callcc(proc, prompt_tag, env, cont, extra_call_info):
     return proc.call_with_extra_info([values.W_Continuation(cont)], env, cont, extra_call_info)
 
 @continuation
-def call_with_escape_continuation_cont(env, cont, _vals):
-    # Does not do anything currently. Solely to ensure call/ec does not invoke
-    # its procedure in tail position
+def call_with_escape_continuation_cont(escape, env, cont, _vals):
+    # Invalidates the escape continuation once the procedure returns, this also
+    # ensures call/ec does not invoke its procedure in tail position
     from pycket.interpreter import return_multi_vals
+    escape.active = False
     return return_multi_vals(_vals, env, cont)
 
 @expose(["call/ec", "call-with-escape-continuation"],
@@ -77,8 +78,9 @@ def call_with_escape_continuation_cont(env, cont, _vals):
         simple=False, extra_info=True)
 def call_with_escape_continuation(proc, prompt_tag, env, cont, extra_call_info):
     assert prompt_tag is None, "NYI"
-    cont = call_with_escape_continuation_cont(env, cont)
-    return proc.call_with_extra_info([values.W_Continuation(cont)], env, cont, extra_call_info)
+    escape = values.W_EscapeContinuation(cont)
+    cont = call_with_escape_continuation_cont(escape, env, cont)
+    return proc.call_with_extra_info([escape], env, cont, extra_call_info)
 
 @expose("make-continuation-prompt-tag", [default(values.W_Symbol, None)])
 def make_continuation_prompt_tag(sym):
@@ -97,6 +99,7 @@ def abort_current_continuation(args, env, cont):
         raise SchemeException("abort-current-continuation: expected prompt-tag for argument 0")
     prompt = find_continuation_prompt(tag, cont)
     if prompt is not None:
+        values.escape_epoch.bump()
         handler = prompt.handler
         cont    = prompt.get_previous_continuation()
         assert cont is not None
@@ -163,6 +166,7 @@ def raise_exception(v, barrier, env, cont):
         raise SchemeException("provided handler is not callable")
 
     assert cont is not None
+    values.escape_epoch.bump()
     return handler.call([v], env, cont)
 
 expose("raise", [values.W_Object, default(values.W_Object, values.w_true)], simple=False)(raise_exception)
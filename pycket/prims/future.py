@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Futures, see pycket.future.
+
+from pycket              import values
+from pycket.cont         import continuation
+from pycket.future       import (W_Future, FutureEvt, make_future, pool,
+                                 DONE, QUEUED, RUNNING)
+from pycket.prims.expose import expose, procedure
+from pycket.scheduler    import scheduler
+
+@expose("future", [procedure], simple=False)
+def future(thunk, env, cont):
+    from pycket.interpreter import return_value
+    paramz = cont.get_mark_first(values.parameterization_key)
+    return return_value(make_future(thunk, env, paramz, False), env, cont)
+
+@expose("would-be-future", [procedure], simple=False)
+def would_be_future(thunk, env, cont):
+    from pycket.interpreter import return_value
+    paramz = cont.get_mark_first(values.parameterization_key)
+    return return_value(make_future(thunk, env, paramz, True), env, cont)
+
+@expose("future?", [values.W_Object])
+def future_p(w_obj):
+    return values.W_Bool.make(isinstance(w_obj, W_Future))
+
+@expose("futures-enabled?", [])
+def futures_enabled():
+    return values.W_Bool.make(pool.size > 0)
+
+@expose("current-future", [])
+def current_future():
+    return values.w_false
+
+@continuation
+def future_inline_cont(f, env, cont, vals):
+    from pycket.interpreter import return_multi_vals
+    f.set_result(vals)
+    return return_multi_vals(vals, env, cont)
+
+@continuation
+def future_ended_cont(f, env, cont, _vals):
+    return touch_future(f, env, cont)
+
+def touch_future(f, env, cont):
+    from pycket.interpreter import return_multi_vals
+    if f.state == DONE:
+        return return_multi_vals(f.result, env, cont)
+    if f.state == RUNNING:
+        return scheduler.sync([FutureEvt(f)], -1.0, None, env,
+                              future_ended_cont(f, env, cont))
+    if f.state == QUEUED:
+        pool.unqueue(f)
+    return f.thunk.call([], f.env, future_inline_cont(f, env, cont))
+
+@expose("touch", [W_Future], simple=False)
+def touch(f, env, cont):
+    return touch_future(f, env, cont)
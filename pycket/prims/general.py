@@ -13,6 +13,7 @@ from pycket import vector as values_vector
 from pycket.error import SchemeException
 from pycket.foreign import W_CPointer, W_CType
 from pycket.hash.base import W_HashTable
+from pycket.hash.weak import W_WeakHashTable
 from pycket.prims.expose import (unsafe, default, expose, expose_val,
                                  procedure, define_nyi, subclass_unsafe)
 
@@ -26,16 +27,20 @@ from pycket.prims import continuation_marks
 from pycket.prims import box
 from pycket.prims import equal as eq_prims
 from pycket.prims import foreign
+from pycket.prims import future
 from pycket.prims import hash
 from pycket.prims import impersonator
 from pycket.prims import input_output
+from pycket.prims import jit_stats
 from pycket.prims import logging
 from pycket.prims import numeric
 from pycket.prims import parameter
+from pycket.prims import place
 from pycket.prims import random
 from pycket.prims import regexp
 from pycket.prims import string
 from pycket.prims import struct_structinfo
+from pycket.prims import thread
 from pycket.prims import undefined
 from pycket.prims import vector
 
@@ -84,6 +89,9 @@ for args in [
         ("thread-cell-values?", values.W_ThreadCellValues),
         ("semaphore?", values.W_Semaphore),
         ("semaphore-peek-evt?", values.W_SemaphorePeekEvt),
+        ("thread?", values.W_Thread),
+        ("channel?", values.W_Channel),
+        ("channel-put-evt?", values.W_ChannelPutEvt),
         ("path?", values.W_Path),
         ("bytes?", values.W_Bytes),
         ("pseudo-random-generator?", values.W_PseudoRandomGenerator),
@@ -110,7 +118,7 @@ for args in [
         ("hash-eq?", W_HashTable),
         ("hash-eqv?", W_HashTable),
         ("hash-equal?", W_HashTable),
-        ("hash-weak?", W_HashTable),
+        ("hash-weak?", W_WeakHashTable),
         ("cpointer?", W_CPointer),
         ("ctype?", W_CType),
         ("continuation-prompt-tag?", values.W_ContinuationPromptTag),
@@ -362,13 +370,7 @@ for args in [ ("subprocess?",),
               ("log-receiver?",),
               # FIXME: these need to be defined with structs
               ("date-dst?",),
-              ("thread?",),
-              ("thread-running?",),
-              ("thread-dead?",),
               ("will-executor?",),
-              ("evt?",),
-              ("semaphore-try-wait?",),
-              ("channel?",),
               ("readtable?",),
               ("link-exists?",),
               ("rename-transformer?",),
@@ -418,44 +420,6 @@ def version(env, cont):
     result = values_string.W_String.fromascii("unknown version" if version is None else version)
     return return_value(result, env, cont)
 
-@continuation
-def sem_post_cont(sem, env, cont, vals):
-    sem.post()
-    from pycket.interpreter import return_multi_vals
-    return return_multi_vals(vals, env, cont)
-
-@expose("call-with-semaphore", simple=False)
-def call_with_sem(args, env, cont):
-    if len(args) < 2:
-        raise SchemeException("error call-with-semaphore")
-    sem = args[0]
-    f = args[1]
-    if len(args) == 2:
-        new_args = []
-        fail = None
-    else:
-        new_args = args[3:]
-        if args[2] is values.w_false:
-            fail = None
-        else:
-            fail = args[2]
-    assert isinstance(sem, values.W_Semaphore)
-    assert f.iscallable()
-    sem.wait()
-    return f.call(new_args, env, sem_post_cont(sem, env, cont))
-
-@expose("current-thread", [])
-def current_thread():
-    return values.W_Thread()
-
-@expose("semaphore-post", [values.W_Semaphore])
-def sem_post(s):
-    s.post()
-
-@expose("semaphore-wait", [values.W_Semaphore])
-def sem_wait(s):
-    s.wait()
-
 @expose("procedure-rename", [procedure, values.W_Object])
 def procedure_rename(p, n):
     return p
@@ -1195,10 +1159,6 @@ def current_preserved_thread_cell_values(v):
         cell.value = val
     return values.w_void
 
-@expose("place-enabled?")
-def do_is_place_enabled(args):
-    return values.w_false
-
 @expose("gensym", [default(values.W_Symbol, values.W_Symbol.make("g"))])
 def gensym(init):
     from pycket.interpreter import Gensym
@@ -1389,7 +1349,6 @@ make_stub_predicates(
     "compiled-expression?",
     "custodian-box?",
     "custodian?",
-    "future?",
     "internal-definition-context?",
     "namespace?",
     "security-guard?",
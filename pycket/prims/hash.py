@@ -6,9 +6,12 @@ from pycket.hash.base    import W_HashTable, W_ImmutableHashTable, w_missing
 from pycket.hash.simple  import (
     W_EqvMutableHashTable, W_EqMutableHashTable,
     W_EqvImmutableHashTable, W_EqImmutableHashTable,
-    make_simple_mutable_table, make_simple_mutable_table_assocs,
+    make_simple_mutable_table_assocs,
     make_simple_immutable_table, make_simple_immutable_table_assocs)
-from pycket.hash.equal   import W_EqualHashTable
+from pycket.hash.equal   import (W_EqualHashTable, W_EqualImmutableHashTable,
+    make_equal_immutable_table)
+from pycket.hash.weak    import (W_WeakEqHashTable, W_WeakEqvHashTable,
+    W_WeakEqualHashTable, make_weak_table)
 from pycket.cont         import continuation, loop_label
 from pycket.error        import SchemeException
 from pycket.prims.expose import default, expose, procedure, define_nyi
@@ -16,16 +19,17 @@ from rpython.rlib        import jit
 
 @expose("hash-iterate-first", [W_HashTable])
 def hash_iterate_first(ht):
-    if ht.length() == 0:
+    index = ht.next_position(-1)
+    if index < 0:
         return values.w_false
-    return values.W_Fixnum.ZERO
+    return values.W_Fixnum(index)
 
 @expose("hash-iterate-next", [W_HashTable, values.W_Fixnum])
 def hash_iterate_next(ht, pos):
-    index = pos.value
-    if index >= ht.length() - 1:
+    index = ht.next_position(pos.value)
+    if index < 0:
         return values.w_false
-    return values.W_Fixnum(index + 1)
+    return values.W_Fixnum(index)
 
 def hash_iter_ref(ht, pos, key=False):
     n = pos.value
@@ -110,21 +114,26 @@ def from_assocs(assocs, fname):
         vals.append(val.cdr())
     return keys[:], vals[:]
 
-@expose("make-weak-hasheq", [])
-def make_weak_hasheq():
-    # FIXME: not actually weak
-    return make_simple_mutable_table(W_EqvMutableHashTable, None, None)
+@expose("make-weak-hasheq", [default(values.W_List, values.w_null)])
+def make_weak_hasheq(assocs):
+    return make_weak_table(W_WeakEqHashTable(), *from_assocs(assocs, "make-weak-hasheq"))
 
-@expose(["make-weak-hash", "make-late-weak-hasheq"], [default(values.W_List, None)])
+@expose("make-weak-hasheqv", [default(values.W_List, values.w_null)])
+def make_weak_hasheqv(assocs):
+    return make_weak_table(W_WeakEqvHashTable(), *from_assocs(assocs, "make-weak-hasheqv"))
+
+@expose("make-weak-hash", [default(values.W_List, values.w_null)])
 def make_weak_hash(assocs):
-    if assocs is None:
-        return W_EqualHashTable([], [], immutable=False)
-    return W_EqualHashTable(*from_assocs(assocs, "make-weak-hash"), immutable=False)
+    return make_weak_table(W_WeakEqualHashTable(), *from_assocs(assocs, "make-weak-hash"))
+
+@expose("make-late-weak-hasheq", [default(values.W_List, values.w_null)])
+def make_late_weak_hasheq(assocs):
+    return make_weak_table(W_WeakEqHashTable(), *from_assocs(assocs, "make-late-weak-hasheq"))
 
 @expose("make-immutable-hash", [default(values.W_List, values.w_null)])
 def make_immutable_hash(assocs):
     keys, vals = from_assocs(assocs, "make-immutable-hash")
-    return W_EqualHashTable(keys, vals, immutable=True)
+    return make_equal_immutable_table(keys, vals)
 
 @expose("make-immutable-hasheq", [default(values.W_List, values.w_null)])
 def make_immutable_hasheq(assocs):
@@ -140,7 +149,7 @@ def hash(args):
         raise SchemeException("hash: key does not have a corresponding value")
     keys = [args[i] for i in range(0, len(args), 2)]
     vals = [args[i] for i in range(1, len(args), 2)]
-    return W_EqualHashTable(keys, vals, immutable=True)
+    return make_equal_immutable_table(keys, vals)
 
 @expose("hasheq")
 def hasheq(args):
@@ -187,12 +196,23 @@ def return_table_cont(table, env, cont, _vals):
     from pycket.interpreter import return_value
     return return_value(table, env, cont)
 
+def equal_immutable_table(table):
+    """ Immutable W_EqualHashTables come from literals, they are converted
+    on their first functional update. """
+    items = table.hash_items()
+    return make_equal_immutable_table([k for k, _ in items], [v for _, v in items])
+
 @expose("hash-set", [W_HashTable, values.W_Object, values.W_Object], simple=False)
 def hash_set(table, key, val, env, cont):
     from pycket.interpreter import return_value
     if not table.immutable():
         raise SchemeException("hash-set: not given an immutable table")
 
+    if isinstance(table, W_EqualHashTable):
+        table = equal_immutable_table(table)
+    if isinstance(table, W_EqualImmutableHashTable):
+        return table.hash_assoc(key, val, env, cont)
+
     # Fast path
     if isinstance(table, W_ImmutableHashTable):
         new_table = table.assoc(key, val)
@@ -225,6 +245,8 @@ def hash_remove_bang(ht, k, env, cont):
 def hash_remove(ht, k, env, cont):
     if not ht.immutable():
         raise SchemeException("hash-remove: expected immutable hash table")
+    if isinstance(ht, W_EqualHashTable):
+        ht = equal_immutable_table(ht)
     return ht.hash_remove(k, env, cont)
 
 define_nyi("hash-clear!", [W_HashTable])
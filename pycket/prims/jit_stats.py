@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Access to the JIT statistics of pycket.jit_stats and to those of the inline
+# caches of the call sites from Racket code.
+
+from pycket.prims.expose import expose
+from pycket              import values, values_string
+from pycket.jit_stats    import stats
+
+def _field(name, w_value):
+    return values.W_Cons.make(values.W_Symbol.make(name), w_value)
+
+@expose("pycket-jit-stats", [])
+def pycket_jit_stats():
+    aborts_w = [_field(reason, values.W_Fixnum(count))
+                    for reason, count in stats.aborts.iteritems()]
+    return values.to_list([
+        _field("loops", values.W_Fixnum(stats.loops)),
+        _field("bridges", values.W_Fixnum(stats.bridges)),
+        _field("aborts", values.to_list(aborts_w)),
+        _field("trace-too-long", values.W_Fixnum(stats.too_long)),
+        _field("tracing-time", values.W_Flonum(stats.tracing_time())),
+        _field("backend-time", values.W_Flonum(stats.backend_time())),
+    ])
+
+@expose("pycket-jit-stats-entries", [])
+def pycket_jit_stats_entries():
+    entries_w = []
+    for entry in stats.entries.itervalues():
+        entries_w.append(values.to_list([
+            values_string.W_String.fromstr_utf8(entry.greenkey),
+            values.W_Fixnum(entry.loops),
+            values.W_Fixnum(entry.bridges),
+            values.W_Fixnum(entry.aborts),
+            values.W_Fixnum(entry.too_long),
+        ]))
+    return values.to_list(entries_w)
+
+@expose("pycket-jit-stats-reset!", [])
+def pycket_jit_stats_reset():
+    stats.reset()
+    return values.w_void
+
+@expose("pycket-call-cache-stats", [])
+def pycket_call_cache_stats():
+    from pycket.interpreter import call_cache_stats
+    return values.to_list([
+        _field("hits", values.W_Fixnum(call_cache_stats.hits)),
+        _field("misses", values.W_Fixnum(call_cache_stats.misses)),
+        _field("generic", values.W_Fixnum(call_cache_stats.generic)),
+        _field("megamorphic-sites",
+               values.W_Fixnum(call_cache_stats.megamorphic_sites)),
+    ])
+
+@expose("pycket-call-cache-stats-reset!", [])
+def pycket_call_cache_stats_reset():
+    from pycket.interpreter import call_cache_stats
+    call_cache_stats.reset()
+    return values.w_void
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Places, see pycket.place.
+
+import os
+
+from pycket              import values, values_string
+from pycket.cont         import continuation
+from pycket.error        import SchemeException
+from pycket.place        import (W_Place, W_PlaceChannel, W_PlaceDeadEvt,
+                                 W_PlaceFlushEvt, fork_place, run_place,
+                                 message_allowed)
+from pycket.prims.expose import expose
+from pycket.scheduler    import scheduler
+
+@expose("dynamic-place", [values.W_Object, values.W_Symbol], simple=False)
+def dynamic_place(w_path, w_name, env, cont):
+    from pycket.interpreter import return_value
+    if isinstance(w_path, values.W_Path):
+        fname = w_path.path
+    elif isinstance(w_path, values_string.W_String):
+        fname = w_path.as_str_utf8()
+    else:
+        raise SchemeException("dynamic-place: expected a path")
+    fname = os.path.abspath(fname)
+    channel = fork_place(env)
+    if isinstance(channel, W_Place):
+        return return_value(channel, env, cont)
+    return run_place(fname, w_name, channel, env, cont)
+
+@expose("place?", [values.W_Object])
+def place_p(w_obj):
+    return values.W_Bool.make(isinstance(w_obj, W_Place))
+
+@expose("place-channel?", [values.W_Object])
+def place_channel_p(w_obj):
+    return values.W_Bool.make(isinstance(w_obj, W_PlaceChannel))
+
+@expose("place-enabled?", [])
+def place_enabled():
+    return values.w_true
+
+@expose("place-message-allowed?", [values.W_Object])
+def place_message_allowed(w_obj):
+    return values.W_Bool.make(message_allowed(w_obj))
+
+@continuation
+def place_put_cont(env, cont, _vals):
+    from pycket.interpreter import return_value
+    return return_value(values.w_void, env, cont)
+
+@expose("place-channel-put", [W_PlaceChannel, values.W_Object], simple=False)
+def place_channel_put(channel, w_val, env, cont):
+    from pycket.interpreter import return_value
+    if channel.put(w_val):
+        return return_value(values.w_void, env, cont)
+    # the pipe is full, wait for the other end to read
+    return scheduler.sync([W_PlaceFlushEvt(channel)], -1.0, None, env,
+                          place_put_cont(env, cont))
+
+@expose("place-channel-get", [W_PlaceChannel], simple=False)
+def place_channel_get(channel, env, cont):
+    return scheduler.sync([channel], -1.0, None, env, cont)
+
+@expose("place-dead-evt", [W_Place])
+def place_dead_evt(place):
+    return W_PlaceDeadEvt(place)
+
+@continuation
+def place_status_cont(place, env, cont, _vals):
+    from pycket.interpreter import return_value
+    return return_value(values.W_Fixnum(place.status), env, cont)
+
+@expose("place-wait", [W_Place], simple=False)
+def place_wait(place, env, cont):
+    return scheduler.sync([W_PlaceDeadEvt(place)], -1.0, None, env,
+                          place_status_cont(place, env, cont))
+
+@expose("place-kill", [W_Place])
+def place_kill(place):
+    place.kill()
+    return values.w_void
@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Threads, semaphores, channels and sync, on top of the green threads of
+# pycket.scheduler.
+
+import time
+
+from pycket              import values
+from pycket.arity        import Arity
+from pycket.cont         import continuation
+from pycket.error        import SchemeException
+from pycket.prims.expose import default, expose, procedure
+from pycket.scheduler    import scheduler, is_evt
+
+@continuation
+def void_cont(env, cont, _vals):
+    from pycket.interpreter import return_value
+    return return_value(values.w_void, env, cont)
+
+def seconds(name, w_secs):
+    if isinstance(w_secs, values.W_Fixnum):
+        secs = float(w_secs.value)
+    elif isinstance(w_secs, values.W_Flonum):
+        secs = w_secs.value
+    else:
+        raise SchemeException("%s: expected a real number" % name)
+    if secs < 0.0:
+        raise SchemeException("%s: expected a nonnegative number" % name)
+    return secs
+
+def check_evts(name, evts):
+    for w_evt in evts:
+        if not is_evt(w_evt):
+            raise SchemeException("%s: expected an evt, got %s" % (
+                name, w_evt.tostring()))
+
+@expose("thread", [procedure], simple=False)
+def thread(thunk, env, cont):
+    from pycket.interpreter import return_value
+    paramz = cont.get_mark_first(values.parameterization_key)
+    return return_value(scheduler.spawn(thunk, env, paramz), env, cont)
+
+@expose("current-thread", [])
+def current_thread():
+    return scheduler.current
+
+@expose("thread-running?", [values.W_Thread])
+def thread_running(thread):
+    return values.W_Bool.make(not thread.done)
+
+@expose("thread-dead?", [values.W_Thread])
+def thread_dead(thread):
+    return values.W_Bool.make(thread.done)
+
+@expose("thread-wait", [values.W_Thread], simple=False)
+def thread_wait(thread, env, cont):
+    return scheduler.sync([thread], -1.0, None, env, void_cont(env, cont))
+
+@expose("kill-thread", [values.W_Thread])
+def kill_thread(thread):
+    scheduler.kill(thread)
+    return values.w_void
+
+@expose("sleep", [default(values.W_Number, values.W_Fixnum.ZERO)], simple=False)
+def sleep(w_secs, env, cont):
+    secs = seconds("sleep", w_secs)
+    if secs == 0.0:
+        return scheduler.yield_current(values.w_void, env, cont)
+    return scheduler.sync([], time.time() + secs, values.w_void, env, cont)
+
+@expose("semaphore-post", [values.W_Semaphore])
+def sem_post(s):
+    s.post()
+
+@expose("semaphore-wait", [values.W_Semaphore], simple=False)
+def sem_wait(s, env, cont):
+    return scheduler.sync([s], -1.0, None, env, void_cont(env, cont))
+
+@expose("semaphore-try-wait?", [values.W_Semaphore])
+def sem_try_wait(s):
+    return values.W_Bool.make(s.try_wait())
+
+@continuation
+def sem_post_cont(sem, env, cont, vals):
+    sem.post()
+    from pycket.interpreter import return_multi_vals
+    return return_multi_vals(vals, env, cont)
+
+@continuation
+def sem_acquired_cont(sem, f, args, env, cont, _vals):
+    return f.call(args, env, sem_post_cont(sem, env, cont))
+
+@expose("call-with-semaphore", simple=False, arity=Arity.geq(2))
+def call_with_sem(args, env, cont):
+    sem = args[0]
+    f = args[1]
+    if not isinstance(sem, values.W_Semaphore):
+        raise SchemeException("call-with-semaphore: expected a semaphore")
+    if not f.iscallable():
+        raise SchemeException("call-with-semaphore: expected a procedure")
+    if len(args) == 2:
+        new_args = []
+        fail = None
+    else:
+        new_args = args[3:]
+        if args[2] is values.w_false:
+            fail = None
+        else:
+            fail = args[2]
+    if fail is not None:
+        if not sem.try_wait():
+            return fail.call([], env, cont)
+        return f.call(new_args, env, sem_post_cont(sem, env, cont))
+    return scheduler.sync([sem], -1.0, None, env,
+                          sem_acquired_cont(sem, f, new_args, env, cont))
+
+@expose("make-channel", [])
+def make_channel():
+    return values.W_Channel()
+
+@expose("channel-get", [values.W_Channel], simple=False)
+def channel_get(ch, env, cont):
+    return scheduler.sync([ch], -1.0, None, env, cont)
+
+@expose("channel-try-get", [values.W_Channel], simple=False)
+def channel_try_get(ch, env, cont):
+    return scheduler.sync([ch], 0.0, values.w_false, env, cont)
+
+@expose("channel-put", [values.W_Channel, values.W_Object], simple=False)
+def channel_put(ch, w_val, env, cont):
+    return scheduler.sync([values.W_ChannelPutEvt(ch, w_val)], -1.0, None,
+                          env, void_cont(env, cont))
+
+@expose("channel-put-evt", [values.W_Channel, values.W_Object])
+def channel_put_evt(ch, w_val):
+    return values.W_ChannelPutEvt(ch, w_val)
+
+@expose("evt?", [values.W_Object])
+def evt_p(w_obj):
+    return values.W_Bool.make(is_evt(w_obj))
+
+@expose("sync", simple=False, arity=Arity.geq(1))
+def sync(args, env, cont):
+    check_evts("sync", args)
+    return scheduler.sync(args, -1.0, None, env, cont)
+
+@expose("sync/timeout", simple=False, arity=Arity.geq(2))
+def sync_timeout(args, env, cont):
+    w_timeout = args[0]
+    evts = args[1:]
+    check_evts("sync/timeout", evts)
+    if w_timeout is values.w_false:
+        deadline = -1.0
+    else:
+        deadline = time.time() + seconds("sync/timeout", w_timeout)
+    return scheduler.sync(evts, deadline, values.w_false, env, cont)
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A profiler for Racket functions, enabled with --profile <file>.
+#
+# Samples are taken at the loop headers of the interpreter, where the
+# scheduler ticks as well: whenever the sampling interval has passed since
+# the last sample, the stack of lambdas is reconstructed from the
+# continuation and recorded. The check is part of JIT-compiled loops too, so
+# hot loops are sampled whether they are compiled or not. Independently,
+# CallGraph.register_call counts the calls of every lambda; calls made from
+# JIT-compiled code do not go through it and are not counted.
+#
+# On shutdown the profile is written to <file> as a flat profile, sorted by
+# the number of samples in which a lambda was on top of the stack, and to
+# <file>.folded as collapsed stacks (one "outer;...;inner count" line per
+# distinct stack) for flamegraph tools.
+
+import time
+
+from rpython.rlib import jit
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rfloat import formatd
+
+# seconds between two samples
+SAMPLE_INTERVAL = 0.001
+
+# deeper stacks are cut off at the outer end
+MAX_DEPTH = 256
+
+def lambda_name(lam):
+    if lam.srcfile and lam.srcpos >= 0:
+        name = "%s:%d" % (lam.srcfile, lam.srcpos)
+    elif lam.srcfile:
+        name = lam.srcfile
+    else:
+        name = "<unknown>"
+    # ';' separates the frames of a collapsed stack
+    return name.replace(";", "_")
+
+class ProfileEntry(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.self_samples = 0
+        self.total_samples = 0
+
+BaseSorter = make_timsort_class()
+
+class EntrySorter(BaseSorter):
+    def lt(self, a, b):
+        if a.self_samples != b.self_samples:
+            return a.self_samples > b.self_samples
+        return a.calls > b.calls
+
+class ProfilerState(object):
+    """ The profile being recorded, if any, checked at every loop header. """
+    _immutable_fields_ = ['profile?']
+
+    def __init__(self):
+        self.profile = None
+
+state = ProfilerState()
+
+class Profile(object):
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.next_sample = 0.0
+        self.samples = 0
+        self.entries = {}
+        self.stacks = {}
+
+    def entry(self, lam):
+        entry = self.entries.get(lam, None)
+        if entry is None:
+            entry = ProfileEntry(lambda_name(lam))
+            self.entries[lam] = entry
+        return entry
+
+    def record_call(self, lam):
+        self.entry(lam).calls += 1
+
+    @jit.dont_look_inside
+    def tick(self, ast, cont):
+        """ Called at the loop header ast, samples if it is time to. """
+        now = time.time()
+        if now >= self.next_sample:
+            self.next_sample = now + self.interval
+            self.sample(ast.surrounding_lambda, cont)
+
+    def sample(self, lam, cont):
+        """ Records the stack of lambdas, lam is running (None at the module
+        level) and cont is its continuation. """
+        stack = []
+        if lam is not None:
+            stack.append(lam)
+        while cont is not None and len(stack) < MAX_DEPTH:
+            ast = cont.get_next_executed_ast()
+            if ast is not None:
+                outer = ast.surrounding_lambda
+                if outer is not None and (not stack or outer is not stack[-1]):
+                    stack.append(outer)
+            cont = cont.get_previous_continuation()
+        self.samples += 1
+        if not stack:
+            return
+        self.entry(stack[0]).self_samples += 1
+        seen = {}
+        for l in stack:
+            if l not in seen:
+                seen[l] = None
+                self.entry(l).total_samples += 1
+        names = [self.entry(stack[i]).name
+                     for i in range(len(stack) - 1, -1, -1)]
+        key = ";".join(names)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def sorted_entries(self):
+        entries = self.entries.values()
+        EntrySorter(entries).sort()
+        return entries
+
+    def _percent(self, n):
+        if self.samples == 0:
+            return "0.0"
+        return formatd(100.0 * n / self.samples, 'f', 1)
+
+    def write_flat(self, output):
+        output.write("%d samples, one every %sms\n" % (
+            self.samples, formatd(self.interval * 1000, 'f', 1)))
+        output.write("   self%   total%      calls  lambda\n")
+        for entry in self.sorted_entries():
+            output.write("%7s%% %7s%% %10d  %s\n" % (
+                self._percent(entry.self_samples),
+                self._percent(entry.total_samples),
+                entry.calls, entry.name))
+
+    def write_collapsed(self, output):
+        for key, count in self.stacks.iteritems():
+            output.write("%s %d\n" % (key, count))
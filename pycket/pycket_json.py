@@ -172,6 +172,9 @@ class FakeSpace(object):
     w_int = JsonInt
     w_float = JsonFloat
 
+    def __init__(self):
+        self.keys = {}
+
     def newtuple(self, items):
         return None
 
@@ -193,7 +196,16 @@ class FakeSpace(object):
     def setitem(self, d, key, value):
         assert isinstance(d, JsonObject)
         assert isinstance(key, JsonString)
-        d.value[key.value_string()] = value
+        d.value[self.intern_key(key.value_string())] = value
+
+    def intern_key(self, key):
+        # The expander output uses a small, fixed set of object keys. Sharing
+        # one copy of each keeps the per-object dicts from holding on to
+        # thousands of copies of "lexical" and friends.
+        result = self.keys.get(key, None)
+        if result is None:
+            self.keys[key] = result = key
+        return result
 
     def wrapunicode(self, x):
         return JsonString(unicode_encode_utf_8(x, len(x), "strict"))
@@ -261,6 +273,75 @@ class OwnJSONDecoder(JSONDecoder):
                 self._raise("Invalid control character at char %d", self.pos-1)
 
 
+class JsonPullParser(OwnJSONDecoder):
+    """ Incremental reading of a json document. Objects and arrays can be
+    entered and their entries read one at a time, so that a consumer can
+    convert and drop each element before the next one is decoded. Values that
+    are not entered are decoded into the usual JsonBase tree by read_value. """
+
+    def __init__(self, s):
+        OwnJSONDecoder.__init__(self, s)
+        # whether the next entry is the first one of the current container
+        self.first = False
+
+    def _expect(self, ch, what):
+        i = self.skip_whitespace(self.pos)
+        if self.ll_chars[i] != ch:
+            self._raise("Expected %s at char %d", what, i)
+        self.pos = i + 1
+
+    def start_object(self):
+        self._expect('{', "'{'")
+        self.first = True
+
+    def start_array(self):
+        self._expect('[', "'['")
+        self.first = True
+
+    def _next_entry(self, close):
+        i = self.skip_whitespace(self.pos)
+        ch = self.ll_chars[i]
+        if ch == close:
+            self.pos = i + 1
+            self.first = False
+            return -1
+        if not self.first:
+            if ch != ',':
+                self._raise("Expected ',' or '%s' at char %d", close, i)
+            i = self.skip_whitespace(i + 1)
+        self.first = False
+        return i
+
+    def next_key(self):
+        """ Returns the next key of the current object, or None at its end.
+        Afterwards the parser is positioned at the value of that key. """
+        i = self._next_entry('}')
+        if i < 0:
+            return None
+        if self.ll_chars[i] != '"':
+            self._raise("Key name must be string at char %d", i)
+        w_key = self.decode_string(i + 1)
+        assert isinstance(w_key, JsonString)
+        self._expect(':', "':'")
+        return fakespace.intern_key(w_key.value_string())
+
+    def next_element(self):
+        """ Returns whether the current array has another element, which
+        can then be read. """
+        i = self._next_entry(']')
+        if i < 0:
+            return False
+        self.pos = i
+        return True
+
+    def read_value(self):
+        return self.decode_any(self.skip_whitespace(self.pos))
+
+    def finish(self):
+        i = self.skip_whitespace(self.pos)
+        if i < len(self.s):
+            raise ValueError("Extra data: char %d - %d" % (i, len(self.s) - 1))
+        self.close()
 
 def loads(s):
     decoder = OwnJSONDecoder(s)
@@ -0,0 +1,390 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Green threads.
+#
+# All threads run in the CEK loop of the outermost interpret_one. A thread that
+# stops running saves the state it continues from in its W_Thread and raises
+# ThreadSwitch, which makes interpret_one continue with the state of the next
+# runnable thread instead. A running thread is preempted at loop headers of
+# the interpreter once it has used up its fuel; the check is only done after
+# the first thread was created.
+#
+# A thread that syncs on evts which are not ready is blocked with a Waiter.
+# Blocked threads are polled whenever the scheduler switches threads, except
+# that the two sides of a channel meet directly: a waiter blocked on a channel
+# is registered with it, and the thread arriving on the other side completes
+# it. When no thread can run the scheduler sleeps until the next deadline,
+# and if nothing can ever become ready the program is deadlocked: the main
+# thread stops waiting and continues by raising exn:fail.
+#
+# Nested interpret_one calls (e.g. for instantiating a required module) can't
+# give control to other threads, a thread that blocks there waits in place.
+
+import os
+import time
+
+from pycket       import values
+from pycket.cont  import BaseCont
+from pycket.error import SchemeException
+from rpython.rlib import jit, rpoll
+
+# loop headers a thread runs before it is preempted
+FUEL = 10000
+
+# seconds to sleep between polls when only ports or other evts that need
+# polling can become ready
+IDLE_WAIT = 0.001
+
+class ThreadSwitch(Exception):
+    """ The current thread stopped running. """
+
+class Waiter(object):
+    """ A thread waiting for one of evts, or until deadline (a time.time()
+    value) if it is not negative. result is set when the wait is over. """
+    def __init__(self, thread, evts, deadline, timeout_result):
+        self.thread = thread
+        self.evts = evts
+        self.deadline = deadline
+        self.timeout_result = timeout_result
+        self.result = None
+        self.cancelled = False
+
+    def pending(self):
+        return (self.result is None and not self.cancelled and
+                not self.thread.done)
+
+    def needs_polling(self):
+        for w_evt in self.evts:
+            if isinstance(w_evt, values.W_InputPort):
+                return True
+            if isinstance(w_evt, values.W_Evt) and w_evt.needs_polling():
+                return True
+        return False
+
+class ThreadDoneCont(BaseCont):
+    """ The bottom of the continuation of a thread. """
+    _immutable_fields_ = ['thread']
+
+    def __init__(self, thread):
+        BaseCont.__init__(self)
+        self.thread = thread
+
+    def _clone(self):
+        return ThreadDoneCont(self.thread)
+
+    def plug_reduce(self, vals, env):
+        scheduler.finish(self.thread)
+
+def is_evt(w_obj):
+    return (isinstance(w_obj, values.W_Evt) or
+            isinstance(w_obj, values.W_Semaphore) or
+            isinstance(w_obj, values.W_Channel) or
+            isinstance(w_obj, values.W_Thread) or
+            isinstance(w_obj, values.W_Port))
+
+def port_ready(port):
+    if port.closed or not isinstance(port, values.W_FileInputPort):
+        return True
+    fd = port.file.try_to_find_file_descriptor()
+    if fd < 0:
+        return True
+    try:
+        return len(rpoll.poll({fd: rpoll.POLLIN}, 0)) > 0
+    except rpoll.PollError:
+        return True
+
+class Scheduler(object):
+    _immutable_fields_ = ['active?']
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        self.main = values.W_Thread()
+        self.current = self.main
+        self.runnable = []
+        self.blocked = []
+        self.fuel = FUEL
+        # nesting of interpret_one, threads are switched at depth 1 only
+        self.depth = 0
+        # in a forked place or future process
+        self.child = False
+        self.report_child_errors = False
+
+    def spawn(self, thunk, env, paramz):
+        thread = values.W_Thread(thunk)
+        cont = ThreadDoneCont(thread)
+        cont.update_cm(values.parameterization_key, paramz)
+        thread.env = env
+        thread.cont = cont
+        self.runnable.append(thread)
+        self.active = True
+        return thread
+
+    def enter_child(self, report_errors, thread=None):
+        """ Forgets the other threads in a forked place or future process.
+        The process continues with the current thread, or with thread if it
+        is given (the caller raises ThreadSwitch), and exits on uncaught
+        errors. """
+        self.runnable = []
+        self.blocked = []
+        if thread is None:
+            self.main = self.current
+        else:
+            self.main = thread
+            self.runnable.append(thread)
+        self.child = True
+        self.report_child_errors = report_errors
+
+    def can_switch(self):
+        return self.depth == 1
+
+    def tick(self, ast, env, cont):
+        self.fuel -= 1
+        if self.fuel <= 0:
+            self.preempt(ast, env, cont)
+
+    @jit.dont_look_inside
+    def preempt(self, ast, env, cont):
+        self.fuel = FUEL
+        self.poll_blocked()
+        if not self.runnable or not self.can_switch():
+            return
+        thread = self.current
+        thread.ast = ast
+        thread.env = env
+        thread.cont = cont
+        self.runnable.append(thread)
+        raise ThreadSwitch
+
+    def yield_current(self, w_result, env, cont):
+        """ Lets the other runnable threads run before the current thread
+        continues with w_result. """
+        from pycket.interpreter import return_value
+        if not self.runnable or not self.can_switch():
+            return return_value(w_result, env, cont)
+        thread = self.current
+        thread.result = w_result
+        thread.env = env
+        thread.cont = cont
+        self.runnable.append(thread)
+        raise ThreadSwitch
+
+    def finish(self, thread):
+        thread.done = True
+        thread.env = None
+        thread.cont = None
+        raise ThreadSwitch
+
+    def kill(self, thread):
+        if thread.done:
+            return
+        if thread is self.main:
+            raise SchemeException("kill-thread: cannot kill the main thread")
+        if thread is self.current and not self.can_switch():
+            raise SchemeException(
+                "kill-thread: cannot kill the current thread in a nested evaluation")
+        if thread in self.runnable:
+            self.runnable.remove(thread)
+        if thread in self.blocked:
+            self.blocked.remove(thread)
+        thread.done = True
+        thread.thunk = None
+        thread.ast = None
+        thread.env = None
+        thread.cont = None
+        thread.waiter = None
+        thread.result = None
+        if thread is self.current:
+            raise ThreadSwitch
+
+    def thread_failed(self, e, env):
+        """ Ends the current thread because of the uncaught exception e.
+        Returns False if the exception must be propagated instead. """
+        if self.can_switch() and self.current is not self.main:
+            os.write(2, "thread error: %s\n" % e.format_error())
+            self.current.done = True
+            return True
+        if self.child:
+            # the main thread of a place or future process
+            from pycket.prims.input_output import shutdown
+            shutdown(env)
+            if self.report_child_errors:
+                os.write(2, "%s\n" % e.format_error())
+            os._exit(1)
+        return False
+
+    def try_evt(self, waiter, w_evt):
+        """ Syncs on w_evt if it is ready, returning its result or None. """
+        if isinstance(w_evt, values.W_Semaphore):
+            if w_evt.try_wait():
+                return w_evt
+        elif isinstance(w_evt, values.W_SemaphorePeekEvt):
+            if w_evt.sema.n > 0:
+                return w_evt
+        elif isinstance(w_evt, values.W_Thread):
+            if w_evt.done:
+                return w_evt
+        elif isinstance(w_evt, values.W_Channel):
+            putters = w_evt.putters
+            i = 0
+            while i < len(putters):
+                other, w_put = putters[i]
+                if other is waiter:
+                    i += 1
+                    continue
+                del putters[i]
+                if other.pending():
+                    other.result = w_put
+                    return w_put.w_val
+        elif isinstance(w_evt, values.W_ChannelPutEvt):
+            getters = w_evt.channel.getters
+            i = 0
+            while i < len(getters):
+                other = getters[i]
+                if other is waiter:
+                    i += 1
+                    continue
+                del getters[i]
+                if other.pending():
+                    other.result = w_evt.w_val
+                    return w_evt
+        elif isinstance(w_evt, values.W_InputPort):
+            if port_ready(w_evt):
+                return w_evt
+        elif isinstance(w_evt, values.W_OutputPort):
+            return w_evt
+        elif isinstance(w_evt, values.W_Evt):
+            return w_evt.try_sync()
+        return None
+
+    def poll(self, waiter):
+        for w_evt in waiter.evts:
+            w_result = self.try_evt(waiter, w_evt)
+            if w_result is not None:
+                waiter.result = w_result
+                return w_result
+        if waiter.deadline >= 0.0 and time.time() >= waiter.deadline:
+            waiter.result = waiter.timeout_result
+        return waiter.result
+
+    def poll_blocked(self):
+        for thread in self.blocked:
+            waiter = thread.waiter
+            if waiter.result is None:
+                self.poll(waiter)
+        blocked = []
+        for thread in self.blocked:
+            waiter = thread.waiter
+            if waiter.result is None:
+                blocked.append(thread)
+            else:
+                thread.waiter = None
+                thread.result = waiter.result
+                self.runnable.append(thread)
+        self.blocked = blocked
+
+    def sync(self, evts, deadline, timeout_result, env, cont):
+        """ Waits for the first of evts that is ready and returns its result
+        to cont, or timeout_result once deadline has passed. """
+        from pycket.interpreter import return_value
+        waiter = Waiter(self.current, evts, deadline, timeout_result)
+        w_result = self.poll(waiter)
+        if w_result is None:
+            if not self.can_switch():
+                w_result = self.wait_in_place(waiter)
+            else:
+                self.block(waiter, env, cont)
+        return return_value(w_result, env, cont)
+
+    def block(self, waiter, env, cont):
+        for w_evt in waiter.evts:
+            if isinstance(w_evt, values.W_Channel):
+                w_evt.getters.append(waiter)
+            elif isinstance(w_evt, values.W_ChannelPutEvt):
+                w_evt.channel.putters.append((waiter, w_evt))
+        thread = self.current
+        thread.waiter = waiter
+        thread.env = env
+        thread.cont = cont
+        self.blocked.append(thread)
+        raise ThreadSwitch
+
+    def wait_in_place(self, waiter):
+        while True:
+            w_result = self.poll(waiter)
+            if w_result is not None:
+                return w_result
+            if waiter.deadline < 0.0 and not waiter.needs_polling():
+                raise SchemeException(
+                    "sync: blocked forever, other threads can't run in a nested evaluation")
+            self.sleep_until(waiter.deadline, waiter.needs_polling())
+
+    def sleep_until(self, deadline, poll):
+        delay = deadline - time.time()
+        if poll and (deadline < 0.0 or delay > IDLE_WAIT):
+            delay = IDLE_WAIT
+        if delay > 0.0:
+            time.sleep(delay)
+
+    def next_state(self):
+        """ Makes the next runnable thread the current one and returns the
+        state it continues from. """
+        while True:
+            self.poll_blocked()
+            if self.runnable:
+                thread = self.runnable.pop(0)
+                self.current = thread
+                self.fuel = FUEL
+                values.escape_epoch.bump()
+                return self.resume(thread)
+            self.idle()
+
+    def resume(self, thread):
+        from pycket.interpreter import return_value
+        env = thread.env
+        cont = thread.cont
+        if thread.thunk is not None:
+            thunk = thread.thunk
+            thread.thunk = None
+            return thunk.call([], env, cont)
+        if thread.ast is not None:
+            ast = thread.ast
+            thread.ast = None
+            return ast, env, cont
+        if thread.error is not None:
+            from pycket.prims.control import convert_runtime_exception
+            msg = thread.error
+            thread.error = None
+            return convert_runtime_exception(SchemeException(msg), env, cont)
+        w_result = thread.result
+        thread.result = None
+        return return_value(w_result, env, cont)
+
+    def idle(self):
+        deadline = -1.0
+        poll = False
+        for thread in self.blocked:
+            waiter = thread.waiter
+            if waiter.deadline >= 0.0 and (deadline < 0.0 or waiter.deadline < deadline):
+                deadline = waiter.deadline
+            if waiter.needs_polling():
+                poll = True
+        if deadline < 0.0 and not poll:
+            self.deadlock()
+        self.sleep_until(deadline, poll)
+
+    def deadlock(self):
+        # the main thread is blocked as well, its sync raises the error
+        main = self.main
+        if main in self.blocked:
+            self.blocked.remove(main)
+        if main.waiter is not None:
+            main.waiter.cancelled = True
+            main.waiter = None
+        main.error = "sync: deadlock, all threads are blocked"
+        self.runnable.append(main)
+
+scheduler = Scheduler()
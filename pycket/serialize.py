@@ -0,0 +1,408 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A small binary encoding for Racket values.
+#
+# The format is a flat byte stream: unsigned integers are LEB128 varints,
+# signed integers are zig-zag encoded varints and strings are length prefixed.
+# Symbols are written once per stream and afterwards referenced by index, which
+# also preserves the identity of uninterned symbols within one stream.
+
+from rpython.rlib.rarithmetic import r_uint, r_ulonglong, intmask
+from rpython.rlib.rbigint import rbigint
+from rpython.rlib.rstring import StringBuilder
+from rpython.rlib.rstruct.ieee import float_pack, float_unpack
+
+from pycket import values, values_string, values_regex, values_struct, vector
+from pycket.error import SchemeException
+from pycket.hash.equal import W_EqualHashTable, W_EqualImmutableHashTable
+
+
+class SerializationError(SchemeException):
+    pass
+
+# Symbol kinds
+SYM_INTERNED   = 0
+SYM_UNREADABLE = 1
+SYM_UNINTERNED = 2
+
+# Value tags
+TAG_FALSE        = 0
+TAG_TRUE         = 1
+TAG_VOID         = 2
+TAG_NULL         = 3
+TAG_FIXNUM       = 4
+TAG_FLONUM       = 5
+TAG_BIGNUM       = 6
+TAG_RATIONAL     = 7
+TAG_COMPLEX      = 8
+TAG_CHAR         = 9
+TAG_STRING       = 10
+TAG_MSTRING      = 11
+TAG_SYMBOL       = 12
+TAG_KEYWORD      = 13
+TAG_BYTES        = 14
+TAG_MBYTES       = 15
+TAG_PATH         = 16
+TAG_REGEXP       = 17
+TAG_PREGEXP      = 18
+TAG_BYTE_REGEXP  = 19
+TAG_BYTE_PREGEXP = 20
+TAG_VECTOR       = 21
+TAG_MVECTOR      = 22
+TAG_BOX          = 23
+TAG_CONS         = 24
+TAG_HASH         = 25
+TAG_PREFAB       = 26
+
+class Writer(object):
+    def __init__(self):
+        self.builder = StringBuilder()
+        self.symbols = {}
+
+    def getvalue(self):
+        return self.builder.build()
+
+    def write_byte(self, b):
+        assert 0 <= b < 256
+        self.builder.append(chr(b))
+
+    def write_raw(self, s):
+        self.builder.append(s)
+
+    def write_bool(self, b):
+        self.write_byte(1 if b else 0)
+
+    def write_uint(self, n):
+        assert n >= 0
+        u = r_uint(n)
+        while u >= r_uint(0x80):
+            self.builder.append(chr(intmask(u & r_uint(0x7f)) | 0x80))
+            u = u >> 7
+        self.builder.append(chr(intmask(u)))
+
+    def write_int(self, n):
+        if n >= 0:
+            u = r_uint(n) << 1
+        else:
+            u = (r_uint(-(n + 1)) << 1) | r_uint(1)
+        while u >= r_uint(0x80):
+            self.builder.append(chr(intmask(u & r_uint(0x7f)) | 0x80))
+            u = u >> 7
+        self.builder.append(chr(intmask(u)))
+
+    def write_str(self, s):
+        self.write_uint(len(s))
+        self.builder.append(s)
+
+    def write_str_or_none(self, s):
+        if s is None:
+            self.write_byte(0)
+        else:
+            self.write_byte(1)
+            self.write_str(s)
+
+    def write_str_list(self, l):
+        self.write_uint(len(l))
+        for s in l:
+            self.write_str(s)
+
+    def write_float(self, f):
+        bits = float_pack(f, 8)
+        for i in range(8):
+            self.builder.append(chr(intmask((bits >> (8 * i)) & 0xff)))
+
+    def write_symbol(self, w_sym):
+        index = self.symbols.get(w_sym, -1)
+        if index >= 0:
+            self.write_uint(index)
+            return
+        index = len(self.symbols)
+        self.symbols[w_sym] = index
+        self.write_uint(index)
+        if w_sym.is_interned():
+            kind = SYM_UNREADABLE if w_sym.unreadable else SYM_INTERNED
+        else:
+            kind = SYM_UNINTERNED
+        self.write_byte(kind)
+        self.write_str(w_sym.utf8value)
+
+    def write_symbol_or_none(self, w_sym):
+        if w_sym is None:
+            self.write_byte(0)
+        else:
+            self.write_byte(1)
+            self.write_symbol(w_sym)
+
+    def write_symbols(self, syms):
+        self.write_uint(len(syms))
+        for w_sym in syms:
+            self.write_symbol(w_sym)
+
+    def write_value(self, w_val):
+        if w_val is values.w_false:
+            self.write_byte(TAG_FALSE)
+        elif w_val is values.w_true:
+            self.write_byte(TAG_TRUE)
+        elif w_val is values.w_void:
+            self.write_byte(TAG_VOID)
+        elif w_val is values.w_null:
+            self.write_byte(TAG_NULL)
+        elif isinstance(w_val, values.W_Fixnum):
+            self.write_byte(TAG_FIXNUM)
+            self.write_int(w_val.value)
+        elif isinstance(w_val, values.W_Flonum):
+            self.write_byte(TAG_FLONUM)
+            self.write_float(w_val.value)
+        elif isinstance(w_val, values.W_Bignum):
+            self.write_byte(TAG_BIGNUM)
+            self.write_str(w_val.value.str())
+        elif isinstance(w_val, values.W_Rational):
+            self.write_byte(TAG_RATIONAL)
+            self.write_str(w_val._numerator.str())
+            self.write_str(w_val._denominator.str())
+        elif isinstance(w_val, values.W_Complex):
+            self.write_byte(TAG_COMPLEX)
+            self.write_value(w_val.real)
+            self.write_value(w_val.imag)
+        elif isinstance(w_val, values.W_Character):
+            self.write_byte(TAG_CHAR)
+            self.write_uint(ord(w_val.value))
+        elif isinstance(w_val, values_string.W_String):
+            tag = TAG_STRING if w_val.immutable() else TAG_MSTRING
+            self.write_byte(tag)
+            self.write_str(w_val.as_str_utf8())
+        elif isinstance(w_val, values.W_Symbol):
+            self.write_byte(TAG_SYMBOL)
+            self.write_symbol(w_val)
+        elif isinstance(w_val, values.W_Keyword):
+            self.write_byte(TAG_KEYWORD)
+            self.write_str(w_val.value)
+        elif isinstance(w_val, values.W_Bytes):
+            tag = TAG_BYTES if w_val.immutable() else TAG_MBYTES
+            self.write_byte(tag)
+            self.write_str("".join(w_val.value))
+        elif isinstance(w_val, values.W_Path):
+            self.write_byte(TAG_PATH)
+            self.write_str(w_val.path)
+        elif isinstance(w_val, values_regex.W_AnyRegexp):
+            if isinstance(w_val, values_regex.W_PRegexp):
+                tag = TAG_PREGEXP
+            elif isinstance(w_val, values_regex.W_ByteRegexp):
+                tag = TAG_BYTE_REGEXP
+            elif isinstance(w_val, values_regex.W_BytePRegexp):
+                tag = TAG_BYTE_PREGEXP
+            else:
+                tag = TAG_REGEXP
+            self.write_byte(tag)
+            self.write_str(w_val.source)
+        elif isinstance(w_val, vector.W_Vector):
+            tag = TAG_VECTOR if w_val.immutable() else TAG_MVECTOR
+            self.write_byte(tag)
+            self.write_uint(w_val.length())
+            for i in range(w_val.length()):
+                self.write_value(w_val.ref(i))
+        elif isinstance(w_val, values.W_IBox):
+            self.write_byte(TAG_BOX)
+            self.write_value(w_val.value)
+        elif isinstance(w_val, values.W_Cons):
+            # write the spine iteratively, long quoted lists are common
+            elems = []
+            while isinstance(w_val, values.W_Cons):
+                elems.append(w_val.car())
+                w_val = w_val.cdr()
+            self.write_byte(TAG_CONS)
+            self.write_uint(len(elems))
+            for w_elem in elems:
+                self.write_value(w_elem)
+            self.write_value(w_val)
+        elif ((isinstance(w_val, W_EqualHashTable) and w_val.immutable()) or
+              isinstance(w_val, W_EqualImmutableHashTable)):
+            items = w_val.hash_items()
+            self.write_byte(TAG_HASH)
+            self.write_uint(len(items))
+            for w_k, w_v in items:
+                self.write_value(w_k)
+                self.write_value(w_v)
+        elif (isinstance(w_val, values_struct.W_Struct) and
+              w_val.struct_type().isprefab):
+            w_type = w_val.struct_type()
+            self.write_byte(TAG_PREFAB)
+            self.write_value(
+                values_struct.W_PrefabKey.from_struct_type(w_type).short_key())
+            self.write_uint(w_type.total_field_cnt)
+            for i in range(w_type.total_field_cnt):
+                self.write_value(w_val._ref(i))
+        else:
+            raise SerializationError("cannot serialize %s" % w_val.tostring())
+
+
+class Reader(object):
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+        self.symbols = []
+
+    def at_end(self):
+        return self.pos >= len(self.data)
+
+    def read_byte(self):
+        pos = self.pos
+        if pos >= len(self.data):
+            raise SerializationError("unexpected end of serialized data")
+        self.pos = pos + 1
+        return ord(self.data[pos])
+
+    def read_bool(self):
+        return self.read_byte() != 0
+
+    def _read_varint(self):
+        result = r_uint(0)
+        shift = 0
+        while True:
+            b = self.read_byte()
+            result = result | (r_uint(b & 0x7f) << shift)
+            if b < 0x80:
+                return result
+            shift += 7
+            if shift >= 64:
+                raise SerializationError("malformed integer in serialized data")
+
+    def read_uint(self):
+        return intmask(self._read_varint())
+
+    def read_int(self):
+        u = self._read_varint()
+        if u & r_uint(1):
+            return -intmask(u >> 1) - 1
+        return intmask(u >> 1)
+
+    def read_str(self):
+        length = self.read_uint()
+        start = self.pos
+        stop = start + length
+        if length < 0 or stop > len(self.data):
+            raise SerializationError("unexpected end of serialized data")
+        assert start >= 0 and stop >= 0
+        self.pos = stop
+        return self.data[start:stop]
+
+    def read_str_or_none(self):
+        if self.read_byte() == 0:
+            return None
+        return self.read_str()
+
+    def read_str_list(self):
+        return [self.read_str() for i in range(self.read_uint())]
+
+    def read_float(self):
+        bits = r_ulonglong(0)
+        for i in range(8):
+            bits = bits | (r_ulonglong(self.read_byte()) << (8 * i))
+        return float_unpack(bits, 8)
+
+    def read_symbol(self):
+        index = self.read_uint()
+        if index < len(self.symbols):
+            return self.symbols[index]
+        if index != len(self.symbols):
+            raise SerializationError("bad symbol reference in serialized data")
+        kind = self.read_byte()
+        utf8 = self.read_str()
+        if kind == SYM_INTERNED:
+            w_sym = values.W_Symbol.make(utf8)
+        elif kind == SYM_UNREADABLE:
+            w_sym = values.W_Symbol.make_unreadable(utf8)
+        elif kind == SYM_UNINTERNED:
+            w_sym = values.W_Symbol(utf8.decode("utf-8"))
+        else:
+            raise SerializationError("bad symbol kind in serialized data")
+        self.symbols.append(w_sym)
+        return w_sym
+
+    def read_symbol_or_none(self):
+        if self.read_byte() == 0:
+            return None
+        return self.read_symbol()
+
+    def read_symbols(self):
+        return [self.read_symbol() for i in range(self.read_uint())]
+
+    def read_value(self):
+        tag = self.read_byte()
+        if tag == TAG_FALSE:
+            return values.w_false
+        if tag == TAG_TRUE:
+            return values.w_true
+        if tag == TAG_VOID:
+            return values.w_void
+        if tag == TAG_NULL:
+            return values.w_null
+        if tag == TAG_FIXNUM:
+            return values.W_Fixnum.make(self.read_int())
+        if tag == TAG_FLONUM:
+            return values.W_Flonum.make(self.read_float())
+        if tag == TAG_BIGNUM:
+            return values.W_Bignum(rbigint.fromdecimalstr(self.read_str()))
+        if tag == TAG_RATIONAL:
+            num = rbigint.fromdecimalstr(self.read_str())
+            den = rbigint.fromdecimalstr(self.read_str())
+            return values.W_Rational.frombigint(num, den)
+        if tag == TAG_COMPLEX:
+            real = self.read_value()
+            imag = self.read_value()
+            assert isinstance(real, values.W_Number)
+            assert isinstance(imag, values.W_Number)
+            return values.W_Complex.make(real, imag)
+        if tag == TAG_CHAR:
+            return values.W_Character.make(unichr(self.read_uint()))
+        if tag == TAG_STRING:
+            return values_string.W_String.make(self.read_str())
+        if tag == TAG_MSTRING:
+            return values_string.W_String.fromstr_utf8(self.read_str())
+        if tag == TAG_SYMBOL:
+            return self.read_symbol()
+        if tag == TAG_KEYWORD:
+            return values.W_Keyword.make(self.read_str())
+        if tag == TAG_BYTES:
+            return values.W_Bytes.from_string(self.read_str(), immutable=True)
+        if tag == TAG_MBYTES:
+            return values.W_Bytes.from_string(self.read_str(), immutable=False)
+        if tag == TAG_PATH:
+            return values.W_Path(self.read_str())
+        if tag == TAG_REGEXP:
+            return values_regex.W_Regexp(self.read_str())
+        if tag == TAG_PREGEXP:
+            return values_regex.W_PRegexp(self.read_str())
+        if tag == TAG_BYTE_REGEXP:
+            return values_regex.W_ByteRegexp(self.read_str())
+        if tag == TAG_BYTE_PREGEXP:
+            return values_regex.W_BytePRegexp(self.read_str())
+        if tag == TAG_VECTOR or tag == TAG_MVECTOR:
+            elems = [self.read_value() for i in range(self.read_uint())]
+            return vector.W_Vector.fromelements(elems, immutable=(tag == TAG_VECTOR))
+        if tag == TAG_BOX:
+            return values.W_IBox(self.read_value())
+        if tag == TAG_CONS:
+            elems = [self.read_value() for i in range(self.read_uint())]
+            return values.to_improper(elems, self.read_value())
+        if tag == TAG_HASH:
+            keys = []
+            vals = []
+            for i in range(self.read_uint()):
+                keys.append(self.read_value())
+                vals.append(self.read_value())
+            return W_EqualHashTable(keys, vals, immutable=True)
+        if tag == TAG_PREFAB:
+            w_key = self.read_value()
+            fields = [self.read_value() for i in range(self.read_uint())]
+            return values_struct.W_Struct.make_prefab(w_key, fields)
+        raise SerializationError("unknown value tag %d in serialized data" % tag)
+
+def serialize_value(w_val):
+    writer = Writer()
+    writer.write_value(w_val)
+    return writer.getvalue()
+
+def deserialize_value(data):
+    return Reader(data).read_value()
@@ -0,0 +1,155 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Resident server mode, `pycket --serve <socket> <module>`.
+#
+# The module is loaded once and the process then answers requests on a Unix
+# domain socket, keeping the toplevel environment and the JIT-compiled code
+# of the earlier requests. A request calls a function defined by the module.
+# Messages are framed like those of the expander processes (see
+# pycket.expander_pool), the length in decimal, a newline and the data:
+#
+#   request: the name of the function and its arguments, one per line. The
+#            arguments are passed as strings. Only functions the module
+#            provides can be called.
+#   reply:   three frames, the printed result values (or the error message,
+#            then the length is prefixed with "!"), and what the call wrote
+#            to the current output and error ports.
+#
+# A connection can send any number of requests. The server handles one
+# connection at a time.
+
+import os
+
+from rpython.rlib             import rsocket
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.rstring     import ParseStringError
+
+from pycket                   import values, values_parameter, values_string
+from pycket.error             import SchemeException
+
+RECV_SIZE = 65536
+
+class ProtocolError(Exception):
+    pass
+
+def frame(data, is_error=False):
+    return "%s%d\n%s" % ("!" if is_error else "", len(data), data)
+
+class Connection(object):
+    """ Splits what arrives on a socket into request frames. """
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ""
+
+    def next_request(self):
+        """ Returns the data of the next request, or None once the client
+        has closed the connection. """
+        while True:
+            newline = self.buffer.find("\n")
+            if newline >= 0:
+                try:
+                    size = string_to_int(self.buffer[:newline])
+                except ParseStringError:
+                    raise ProtocolError
+                if size < 0:
+                    raise ProtocolError
+                stop = newline + 1 + size
+                assert stop >= 0
+                if len(self.buffer) >= stop:
+                    data = self.buffer[newline + 1:stop]
+                    self.buffer = self.buffer[stop:]
+                    return data
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                if self.buffer:
+                    raise ProtocolError
+                return None
+            self.buffer += data
+
+def lookup_function(module, name):
+    from pycket.interpreter import LazyDefinition
+    w_sym = module.provides.get(name, None)
+    if w_sym is None:
+        raise SchemeException("%s is not provided by the module" % name)
+    w_fn = module.lookup(w_sym)
+    if isinstance(w_fn, LazyDefinition):
+        w_fn = w_fn.force()
+    if not w_fn.iscallable():
+        raise SchemeException("%s is not a procedure" % name)
+    return w_fn
+
+def call_function(module, name, args, env):
+    """ Calls the function, returns the printed results. """
+    from pycket.interpreter import App, Quote, interpret_one
+    w_fn = lookup_function(module, name)
+    rands = [Quote(values_string.W_String.fromstr_utf8(arg)) for arg in args]
+    vals = interpret_one(App.make(Quote(w_fn), rands), env)
+    results = []
+    for i in range(vals.num_values()):
+        w_val = vals.get_value(i)
+        if w_val is not values.w_void:
+            results.append(w_val.tostring())
+    return "\n".join(results)
+
+def handle_request(data, module, env):
+    """ Runs one request and returns the reply. """
+    from pycket.prims.input_output import current_out_param, current_error_param
+    lines = data.split("\n")
+    out_cell = values_parameter.top_level_config.get(current_out_param)
+    err_cell = values_parameter.top_level_config.get(current_error_param)
+    old_out = out_cell.get()
+    old_err = err_cell.get()
+    out = values.W_StringOutputPort()
+    err = values.W_StringOutputPort()
+    out_cell.set(out)
+    err_cell.set(err)
+    try:
+        try:
+            result = call_function(module, lines[0], lines[1:], env)
+            is_error = False
+        except SchemeException, e:
+            result = e.format_error()
+            is_error = True
+        except Exception:
+            # the request fails, not the server
+            result = "%s: internal error" % lines[0]
+            is_error = True
+    finally:
+        out_cell.set(old_out)
+        err_cell.set(old_err)
+    return (frame(result, is_error) + frame(out.contents()) +
+            frame(err.contents()))
+
+def serve_connection(sock, module, env):
+    connection = Connection(sock)
+    while True:
+        data = connection.next_request()
+        if data is None:
+            return
+        sock.sendall(handle_request(data, module, env))
+
+def serve(path, module, env):
+    """ Answers requests on the socket at path until the process is killed.
+    Returns the exit code if the socket can't be opened. """
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    sock = rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM)
+    try:
+        sock.bind(rsocket.UNIXAddress(path))
+        sock.listen(5)
+    except rsocket.SocketError, e:
+        print "could not listen on %s: %s" % (path, e.get_msg())
+        return 1
+    while True:
+        fd, addr = sock.accept()
+        client = rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM, fd=fd)
+        try:
+            serve_connection(client, module, env)
+        except ProtocolError:
+            pass
+        except rsocket.SocketError:
+            pass
+        client.close()
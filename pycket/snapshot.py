@@ -0,0 +1,301 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Snapshots of the modules loaded into a toplevel environment.
+#
+# `pycket --make-snapshot prelude.img prelude.rkt` runs prelude.rkt and then
+# writes every module that was instantiated along the way to prelude.img:
+# the assign-converted AST (in the encoding of the AST cache, see astcache.py)
+# and, where possible, the values of its module-level variables. A later
+# `pycket --restore prelude.img prog.rkt` reads the modules back instead of
+# loading them from their json files, and instantiating a restored module
+# only runs its requires and binds its variables to the saved values.
+#
+# Only modules whose state can be reproduced exactly are restored this way.
+# Every definition must either evaluate a lambda or a constant, which is
+# simply evaluated again on first use, or only apply primitives without
+# effects (see EFFECT_FREE) and have an immutable value made of data the
+# value encoding supports (see serialize.py). Modules with mutated
+# variables, struct types, parameters, hash tables, closures over other state
+# or definitions and expressions with effects in their body are instantiated
+# from their AST as usual when they are required. Primitives are looked up by name and
+# symbols are interned again when the snapshot is read, so neither needs to
+# be stored.
+
+import os
+
+from rpython.rlib import streamio
+
+from pycket import values, values_string, values_regex, vector
+from pycket.astcache import ASTWriter, ASTReader, _config_flags
+from pycket import astcache
+from pycket.hash.equal import W_EqualHashTable, W_EqualImmutableHashTable
+from pycket.interpreter import (Module, DefineValues, BeginForSyntax, App,
+                                Begin, If, Let, LexicalVar, ModuleVar, Quote,
+                                QuoteSyntax, CaseLambda)
+from pycket.error import SchemeException
+from pycket.optimizer import FOLDABLE
+from pycket.serialize import Writer, SerializationError
+
+MAGIC = "PYCKETIMG"
+# bump whenever the layout below changes
+FORMAT_VERSION = 1
+
+DEF_VALUE   = 0
+DEF_REEVAL  = 1
+
+# primitives whose applications have no effects, besides those the optimizer
+# folds
+EFFECT_FREE = FOLDABLE.copy()
+for name in ["cons", "list", "list*", "append", "reverse", "length",
+             "vector-immutable", "box-immutable", "string-append",
+             "string->immutable-string", "string->symbol", "symbol->string",
+             "number->string", "string->number", "hash", "hasheq", "hasheqv",
+             "values", "void"]:
+    EFFECT_FREE[name] = None
+
+def _is_plain_value(w_val):
+    """ Whether w_val is immutable data that serialize.py can encode. """
+    while isinstance(w_val, values.W_Cons):
+        if not _is_plain_value(w_val.car()):
+            return False
+        w_val = w_val.cdr()
+    if (w_val is values.w_false or w_val is values.w_true or
+            w_val is values.w_void or w_val is values.w_null):
+        return True
+    if (isinstance(w_val, values.W_Number) or
+            isinstance(w_val, values.W_Character) or
+            isinstance(w_val, values.W_Symbol) or
+            isinstance(w_val, values.W_Keyword) or
+            isinstance(w_val, values.W_Path) or
+            isinstance(w_val, values_regex.W_AnyRegexp)):
+        return True
+    if isinstance(w_val, values_string.W_String):
+        return w_val.immutable()
+    if isinstance(w_val, values.W_Bytes):
+        return w_val.immutable()
+    if isinstance(w_val, values.W_IBox):
+        return _is_plain_value(w_val.value)
+    if isinstance(w_val, vector.W_Vector):
+        if not w_val.immutable():
+            return False
+        for i in range(w_val.length()):
+            if not _is_plain_value(w_val.ref(i)):
+                return False
+        return True
+    if isinstance(w_val, W_EqualHashTable) or isinstance(w_val, W_EqualImmutableHashTable):
+        if not w_val.immutable():
+            return False
+        for w_k, w_v in w_val.hash_items():
+            if not _is_plain_value(w_k) or not _is_plain_value(w_v):
+                return False
+        return True
+    return False
+
+def _effect_free(ast):
+    """ Whether evaluating ast has no effects, so that its value can be
+    restored instead. """
+    if (isinstance(ast, Quote) or isinstance(ast, QuoteSyntax) or
+            isinstance(ast, CaseLambda) or type(ast) is LexicalVar or
+            isinstance(ast, ModuleVar)):
+        return True
+    if isinstance(ast, App):
+        rator = ast.rator
+        if not isinstance(rator, ModuleVar) or not rator.is_primitive():
+            return False
+        try:
+            w_prim = rator._lookup_primitive()
+        except SchemeException:
+            return False
+        if (not isinstance(w_prim, values.W_Prim) or
+                w_prim.name.utf8value not in EFFECT_FREE):
+            return False
+        for rand in ast.rands:
+            if not _effect_free(rand):
+                return False
+        return True
+    if isinstance(ast, Let) or isinstance(ast, Begin) or isinstance(ast, If):
+        for child in ast.direct_children():
+            if not _effect_free(child):
+                return False
+        return True
+    return False
+
+def _restorable(module):
+    """ Whether the state of the instantiated module can be saved. """
+    if not module.interpreted:
+        return False
+    for f in module.body:
+        if isinstance(f, DefineValues):
+            if f.is_pure():
+                continue
+            if not _effect_free(f.rhs):
+                return False
+            for name in f.names:
+                w_val = module.defs.get(name, None)
+                if w_val is None or not _is_plain_value(w_val):
+                    return False
+        elif not (isinstance(f, Module) or isinstance(f, BeginForSyntax)):
+            return False
+    return True
+
+def _all_modules(module, acc):
+    acc.append(module)
+    for sub in module.submodules:
+        assert isinstance(sub, Module)
+        _all_modules(sub, acc)
+    return acc
+
+def _dependencies(module, acc):
+    if module.lang is not None:
+        acc.append(module.lang.fname)
+    for r in module.requires:
+        if r.modtable is not None:
+            acc.append(r.fname)
+    for sub in module.submodules:
+        assert isinstance(sub, Module)
+        _dependencies(sub, acc)
+    return acc
+
+def _module_order(modules):
+    """ The names of the modules in the table, each after the modules it
+    requires. """
+    order = []
+    state = {}
+    for fname in modules:
+        _visit(fname, modules, state, order)
+    return order
+
+def _visit(fname, modules, state, order):
+    if fname in state or fname not in modules:
+        return
+    state[fname] = None
+    for dep in _dependencies(modules[fname], []):
+        _visit(dep, modules, state, order)
+    order.append(fname)
+
+def _mtime(fname):
+    try:
+        return os.stat(fname).st_mtime
+    except OSError:
+        return -1.0
+
+def _write_module_state(writer, module):
+    if not _restorable(module):
+        writer.write_bool(False)
+        return
+    writer.write_bool(True)
+    defs = []
+    for f in module.body:
+        if isinstance(f, DefineValues):
+            for name in f.names:
+                defs.append((name, f.is_pure()))
+    writer.write_uint(len(defs))
+    for name, pure in defs:
+        writer.write_symbol(name)
+        if pure:
+            writer.write_byte(DEF_REEVAL)
+        else:
+            writer.write_byte(DEF_VALUE)
+            writer.write_value(module.defs[name])
+
+def _read_module_state(reader, module):
+    if not reader.read_bool():
+        return
+    defs = {}
+    for i in range(reader.read_uint()):
+        name = reader.read_symbol()
+        kind = reader.read_byte()
+        if kind == DEF_REEVAL:
+            defs[name] = None
+        elif kind == DEF_VALUE:
+            defs[name] = reader.read_value()
+        else:
+            raise SerializationError("unknown definition kind %d in snapshot" % kind)
+    module.snapshot_defs = defs
+
+def serialize_snapshot(module_env):
+    body = ASTWriter()
+    order = _module_order(module_env.modules)
+    saved = []
+    for fname in order:
+        module = module_env.modules[fname]
+        # check first, a module that fails half way would corrupt the stream
+        try:
+            astcache.serialize_module(module)
+        except SerializationError:
+            continue
+        saved.append(fname)
+    body.write_uint(len(saved))
+    for fname in saved:
+        body.write_str(fname)
+        body.write_float(_mtime(fname))
+    for fname in saved:
+        module = module_env.modules[fname]
+        body.write_ast(module)
+        for m in _all_modules(module, []):
+            _write_module_state(body, m)
+    header = Writer()
+    header.write_raw(MAGIC)
+    header.write_uint(FORMAT_VERSION)
+    header.write_uint(astcache.FORMAT_VERSION)
+    header.write_uint(_config_flags())
+    header.write_raw(body.getvalue())
+    return header.getvalue()
+
+def deserialize_snapshot(data, modtable):
+    """ Fill modtable with the modules in the snapshot. Returns False, leaving
+    modtable alone, if the snapshot was written by an incompatible version or
+    one of its modules has changed since. """
+    if not data.startswith(MAGIC):
+        return False
+    reader = ASTReader(data, modtable, len(MAGIC))
+    if reader.read_uint() != FORMAT_VERSION:
+        return False
+    if reader.read_uint() != astcache.FORMAT_VERSION:
+        return False
+    if reader.read_uint() != _config_flags():
+        return False
+    # check that no module changed before loading any of them
+    fnames = []
+    for i in range(reader.read_uint()):
+        fname = reader.read_str()
+        if _mtime(fname) > reader.read_float():
+            return False
+        fnames.append(fname)
+    for fname in fnames:
+        modtable.enter_module(fname)
+        module = reader.read_ast()
+        if not isinstance(module, Module):
+            raise SerializationError("malformed snapshot")
+        for m in _all_modules(module, []):
+            _read_module_state(reader, m)
+        modtable.exit_module(fname, module)
+    if not reader.at_end():
+        raise SerializationError("malformed snapshot")
+    return True
+
+def save_snapshot(fname, module_env):
+    data = serialize_snapshot(module_env)
+    tmp_file = "%s.%d.tmp" % (fname, os.getpid())
+    f = streamio.open_file_as_stream(tmp_file, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmp_file, fname)
+    return len(data)
+
+def load_snapshot(fname, modtable):
+    """ Returns False if the snapshot cannot be used, in which case the
+    modules are loaded from their json files as usual. """
+    try:
+        f = streamio.open_file_as_stream(fname)
+        data = f.readall()
+        f.close()
+    except OSError:
+        return False
+    try:
+        return deserialize_snapshot(data, modtable)
+    except SerializationError:
+        return False
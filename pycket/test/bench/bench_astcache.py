@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Startup benchmark: loading modules from their expanded JSON versus loading
+# them from the binary AST cache.
+#
+# usage: python -m pycket.test.bench.bench_astcache [-n RUNS] [file.rkt ...]
+#
+# Without file arguments all the .rkt programs in pycket/test are used.
+#
+import glob
+import os
+import sys
+import time
+
+from pycket import astcache
+from pycket.expand import (ensure_json_ast_run, load_json_ast_rpython,
+    load_json_ast_cached, _ast_cache_name, ModTable)
+
+# the directory of the benchmark programs
+TEST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def best_of(runs, f):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        f()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+def bench_file(rkt_file, runs):
+    "NON_RPYTHON"
+    json_file = ensure_json_ast_run(rkt_file)
+    cache_file = _ast_cache_name(json_file)
+    # Load once to populate the module table with all dependencies, so that
+    # the timings below only measure the module itself.
+    modtable = ModTable()
+    modtable.enter_module(rkt_file)
+    module = load_json_ast_cached(json_file, modtable)
+    modtable.exit_module(rkt_file, module)
+    if not os.path.exists(cache_file):
+        return None
+
+    def load_json():
+        load_json_ast_rpython(json_file, modtable)
+    def load_binary():
+        assert astcache.load_module(cache_file, json_file, modtable) is not None
+
+    return (os.path.getsize(json_file), os.path.getsize(cache_file),
+            best_of(runs, load_json), best_of(runs, load_binary))
+
+def main(argv):
+    "NON_RPYTHON"
+    runs = 5
+    if len(argv) > 2 and argv[1] == "-n":
+        runs = int(argv[2])
+        argv = argv[2:]
+    files = argv[1:]
+    if not files:
+        files = sorted(glob.glob(os.path.join(TEST_DIR, "*.rkt")))
+    sys.setrecursionlimit(10000)
+    print "%-28s %10s %10s %9s %9s %7s" % (
+        "file", "json (B)", "ast (B)", "json (s)", "ast (s)", "speedup")
+    total_json = total_binary = 0.0
+    for rkt_file in files:
+        try:
+            result = bench_file(rkt_file, runs)
+        except Exception, e:
+            print "%-28s skipped: %s" % (os.path.basename(rkt_file), e)
+            continue
+        if result is None:
+            print "%-28s skipped: module cannot be cached" % os.path.basename(rkt_file)
+            continue
+        json_size, cache_size, t_json, t_binary = result
+        total_json += t_json
+        total_binary += t_binary
+        print "%-28s %10d %10d %9.4f %9.4f %6.1fx" % (
+            os.path.basename(rkt_file), json_size, cache_size,
+            t_json, t_binary, t_json / max(t_binary, 1e-9))
+    print "%-28s %10s %10s %9.4f %9.4f %6.1fx" % (
+        "total", "", "", total_json, total_binary,
+        total_json / max(total_binary, 1e-9))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Module loading benchmark: building the whole json tree before converting it
+# to an AST versus the streaming decoder, which converts one body form at a
+# time. Every measurement runs in a forked child so that the peak RSS of the
+# child reflects only that load.
+#
+# usage: python -m pycket.test.bench.bench_json [file.rkt ...]
+#
+# Without file arguments all the .rkt programs in pycket/test are used.
+#
+import glob
+import os
+import sys
+import time
+
+from pycket import pycket_json
+from pycket.expand import (ensure_json_ast_run, readfile, _to_module,
+    to_module_streaming, ModTable)
+
+# the directory of the benchmark programs
+TEST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_tree(data, modtable):
+    return _to_module(pycket_json.loads(data), modtable)
+
+def load_streaming(data, modtable):
+    return to_module_streaming(data, modtable)
+
+def measure(loader, rkt_file, json_file):
+    "NON_RPYTHON"
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            sys.setrecursionlimit(10000)
+            data = readfile(json_file)
+            modtable = ModTable()
+            modtable.enter_module(rkt_file)
+            start = time.time()
+            loader(data, modtable)
+            os.write(write_fd, "%f" % (time.time() - start))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    output = os.read(read_fd, 100)
+    os.close(read_fd)
+    _, status, rusage = os.wait4(pid, 0)
+    if not output:
+        raise RuntimeError("loading failed")
+    # ru_maxrss is in kilobytes on Linux
+    return float(output), rusage.ru_maxrss
+
+def main(argv):
+    "NON_RPYTHON"
+    files = argv[1:]
+    if not files:
+        files = sorted(glob.glob(os.path.join(TEST_DIR, "*.rkt")))
+    print "%-28s %9s %9s %11s %11s" % (
+        "file", "tree (s)", "stream (s)", "tree (KB)", "stream (KB)")
+    for rkt_file in files:
+        name = os.path.basename(rkt_file)
+        try:
+            json_file = ensure_json_ast_run(rkt_file)
+            # dependencies are loaded the same way (through their caches) in
+            # both modes, so differences come from this module alone
+            t_tree, rss_tree = measure(load_tree, rkt_file, json_file)
+            t_stream, rss_stream = measure(load_streaming, rkt_file, json_file)
+        except Exception, e:
+            print "%-28s skipped: %s" % (name, e)
+            continue
+        print "%-28s %9.4f %9.4f %11d %11d" % (
+            name, t_tree, t_stream, rss_tree, rss_stream)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
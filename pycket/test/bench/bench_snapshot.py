@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Time to first expression: loading and instantiating a program from its
+# json files versus restoring its prelude from a snapshot first.
+#
+# usage: python -m pycket.test.bench.bench_snapshot [-n RUNS] [prelude.rkt]
+#
+# The prelude defaults to a module that requires racket/base. The program
+# that is timed requires the prelude and evaluates a single expression.
+#
+import os
+import sys
+import tempfile
+import time
+
+from pycket.env import ToplevelEnv
+from pycket.expand import ensure_json_ast_run, load_json_ast_cached, ModTable
+from pycket.interpreter import interpret_module
+from pycket.snapshot import save_snapshot, load_snapshot
+
+DEFAULT_PRELUDE = "#lang racket/base\n(provide (all-from-out racket/base))\n"
+
+def run_program(fname, snapshot=None):
+    "NON_RPYTHON"
+    modtable = ModTable()
+    if snapshot is not None:
+        assert load_snapshot(snapshot, modtable)
+    json_file = ensure_json_ast_run(fname)
+    modtable.enter_module(fname)
+    ast = load_json_ast_cached(json_file, modtable)
+    modtable.exit_module(fname, ast)
+    env = ToplevelEnv()
+    env.globalconfig.load(ast)
+    env.module_env.add_module(fname, ast)
+    interpret_module(ast, env)
+    return env
+
+def best_of(runs, f):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        f()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+def main(argv):
+    "NON_RPYTHON"
+    runs = 5
+    if len(argv) > 2 and argv[1] == "-n":
+        runs = int(argv[2])
+        argv = argv[2:]
+    sys.setrecursionlimit(10000)
+    tmpdir = tempfile.mkdtemp(prefix="pycket-snapshot-")
+    if len(argv) > 1:
+        prelude = os.path.abspath(argv[1])
+    else:
+        prelude = os.path.join(tmpdir, "prelude.rkt")
+        with open(prelude, "w") as f:
+            f.write(DEFAULT_PRELUDE)
+    prog = os.path.join(tmpdir, "prog.rkt")
+    with open(prog, "w") as f:
+        f.write('#lang racket/base\n(require (file "%s"))\n(define x (+ 1 2))\n' % prelude)
+    img = os.path.join(tmpdir, "prelude.img")
+
+    # warm the json and AST caches so that only loading is measured
+    env = run_program(prelude)
+    size = save_snapshot(img, env.module_env)
+    run_program(prog, img)
+
+    t_json = best_of(runs, lambda: run_program(prog))
+    t_snapshot = best_of(runs, lambda: run_program(prog, img))
+    print "snapshot: %d modules, %d bytes" % (len(env.module_env.modules), size)
+    print "%-12s %9s" % ("start", "time (s)")
+    print "%-12s %9.4f" % ("json", t_json)
+    print "%-12s %9.4f" % ("snapshot", t_snapshot)
+    print "speedup %.1fx" % (t_json / max(t_snapshot, 1e-9))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
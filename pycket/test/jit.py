@@ -162,6 +162,9 @@ class TestLLtype(LLJitMixin):
     def test_bubble_unsafe2(self):
         self.run_file("bubble-unsafe2.rkt")
 
+    def test_vector_iterate_unsafe(self):
+        self.run_file("vector_iterate_unsafe.rkt")
+
     def test_bubble_imp(self):
         self.run_file("bubble-imp.rkt")
     def test_bubble_imp_check(self):
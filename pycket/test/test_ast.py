@@ -5,7 +5,9 @@ from pycket.expand import _to_ast, to_ast, parse_module
 from pycket.interpreter import (LexicalVar, ModuleVar, Done, CaseLambda,
                                 variable_set, variables_equal,
                                 Lambda, Letrec, Let, Quote, App, If,
-                                SimplePrimApp1, SimplePrimApp2
+                                SimplePrimApp0, SimplePrimApp1, SimplePrimApp2,
+                                SimplePrimApp3, SimplePrimAppN,
+                                CALL_CACHE_SIZE, call_cache_stats
                                 )
 from pycket.test.testhelper import format_pycket_mod, run_mod
 
@@ -143,6 +145,44 @@ def test_asts_know_surrounding_lambda():
     inner_lam = inner_caselam.lams[0]
     assert inner_lam.body[0].surrounding_lambda is inner_lam
 
+def test_lexical_addresses():
+    caselam = expr_ast("(lambda (y) (let ([a (car y)]) (lambda (z) (+ y z a))))")
+    lam = caselam.lams[0]
+    y = lam.args.elems[0]
+    let = lam.body[0]
+    car = let.rhss[0]
+    assert car.rand1.address.hops == 0
+    assert car.rand1.address.index == 0
+    inner_lam = let.body[0].lams[0]
+    # the free variables of the closure are copied from the enclosing
+    # environments
+    addresses = [inner_lam.free_addresses[i]
+                     for i in range(len(inner_lam.frees.elems))]
+    for sym, address in zip(inner_lam.frees.elems, addresses):
+        if sym is y:
+            assert address.hops == 1
+        else:
+            assert address.hops == 0
+    # inside the closure, they are found in its free variables
+    add = inner_lam.body[0]
+    z_var, y_var = add.rands[1], add.rands[0]
+    assert z_var.address.hops == 0
+    assert z_var.address.frame is inner_lam.args
+    assert y_var.address.hops == 1
+    assert y_var.address.frame is inner_lam.frees
+
+def test_lexical_addresses_of_recursive_closures(doctest):
+    """
+    ! (define (make-loop n) (letrec ([loop (lambda (i) (if (= i n) i (loop (+ i 1))))]) loop))
+    ! (define (make-adder a b) (lambda (x) (+ a x b)))
+    > ((make-loop 5) 0)
+    5
+    > ((make-adder 1 10) 100)
+    111
+    > (let ([x 1]) (let ([y 2]) (let ([f (lambda () (set! x (+ x y)) x)]) (f) (f))))
+    5
+    """
+
 def test_cont_fusion():
     from pycket.env import SymList, ToplevelEnv
     from pycket.interpreter import (
@@ -216,7 +256,152 @@ def test_specialized_app_for_simple_prims():
     p = expr_ast("(cons 1 2)")
     assert isinstance(p, SimplePrimApp2)
 
+    p = expr_ast("(current-inexact-milliseconds)")
+    assert isinstance(p, SimplePrimApp0)
+
+    p = expr_ast("(unsafe-vector*-set! (vector 1) 0 2)")
+    assert isinstance(p, SimplePrimApp3)
+
+    # variadic primitives get the list of arguments
+    p = expr_ast("(+ x 1 2 3)")
+    assert isinstance(p, SimplePrimAppN)
+    p = expr_ast("(void)")
+    assert isinstance(p, SimplePrimAppN)
+    # simple primitives without a direct call for this number of arguments
+    p = expr_ast("(car 1 2)")
+    assert isinstance(p, SimplePrimAppN)
+
+    # primitives that need the continuation are called as before
+    p = expr_ast("(vector-set! (vector 1) 0 2)")
+    assert type(p) is App
+
 def test_simple_prim_calls_are_simple_expressions():
     p = expr_ast("(car (cons 1 2))")
     assert isinstance(p, SimplePrimApp1)
+    p = expr_ast("(* (+ x 1 2) 3)")
+    assert isinstance(p, SimplePrimAppN)
+    assert isinstance(p.rands[0], SimplePrimAppN)
 
+def test_simple_prim_apps_run(doctest):
+    """
+    > (+ 1 2 3 4)
+    10
+    > (* 2 (+ 1 2 3))
+    12
+    > (let ([v (vector 1 2)]) (unsafe-vector*-set! v 1 3) (vector-ref v 1))
+    3
+    > (void 1 2 3)
+    E (car 1 2)
+    E (+ 1 2 'a)
+    """
+
+
+def test_known_call():
+    m = run_mod(
+    """
+    #lang pycket
+    (define (f x) (+ x 1))
+    (define (g y) (f y))
+    (define r (g 1))
+    """)
+    f = m.defs[W_Symbol.make("f")].closure.caselam.lams[0]
+    app = m.defs[W_Symbol.make("g")].closure.caselam.lams[0].body[0]
+    assert isinstance(app, App)
+    assert app.known is not None
+    assert app.known.lam is f
+    assert m.defs[W_Symbol.make("r")].value == 2
+
+def test_known_call_case_lambda():
+    m = run_mod(
+    """
+    #lang pycket
+    (define h (case-lambda [(x) 1] [(x y) 2] [(x y . z) 3]))
+    (define (k) (+ (h 1) (h 1 2) (h 1 2 3)))
+    (define r (k))
+    """)
+    assert m.defs[W_Symbol.make("r")].value == 6
+
+def test_no_known_call_for_mutated_variables():
+    m = run_mod(
+    """
+    #lang pycket
+    (define (f x) 1)
+    (define (g y) (f y))
+    (define a (g 0))
+    (set! f (lambda (x) 2))
+    (define b (g 0))
+    """)
+    app = m.defs[W_Symbol.make("g")].closure.caselam.lams[0].body[0]
+    assert app.known is None
+    assert m.defs[W_Symbol.make("a")].value == 1
+    assert m.defs[W_Symbol.make("b")].value == 2
+
+def call_cache_lambdas(app):
+    result = []
+    entry = app.call_cache
+    while entry is not None:
+        result.append(entry.lam)
+        entry = entry.next
+    return result
+
+def test_polymorphic_call_cache():
+    m = run_mod(
+    """
+    #lang pycket
+    (define (apply-to f x) (f x))
+    (define (adder n) (lambda (x) (+ x n)))
+    (define h (case-lambda [(x) 1] [(x . y) 2]))
+    (define r (list (apply-to (adder 1) 1) (apply-to (adder 2) 1)
+                    (apply-to car '(3)) (apply-to h 0) (apply-to h 0)))
+    """)
+    app = m.defs[W_Symbol.make("apply-to")].closure.caselam.lams[0].body[0]
+    assert isinstance(app, App)
+    assert app.known is None
+    assert not app.megamorphic
+    # the closures made by adder share their case-lambda
+    lams = call_cache_lambdas(app)
+    assert len(lams) == 2
+    h = m.defs[W_Symbol.make("h")].closure.caselam
+    assert lams[0] is h.lams[0]
+    assert m.defs[W_Symbol.make("r")].tostring() == "(2 3 3 1 1)"
+
+def test_megamorphic_call_site():
+    lambdas = " ".join(["(lambda (x) (+ x %d))" % i
+                            for i in range(CALL_CACHE_SIZE + 2)])
+    m = run_mod(
+    """
+    #lang pycket
+    (define (map1 f l) (if (null? l) '() (cons (f (car l)) (map1 f (cdr l)))))
+    (define (sum l) (if (null? l) 0 (+ (car l) (sum (cdr l)))))
+    (define r (sum (map1 (lambda (f) (f 1)) (list %s))))
+    (define s (sum (map1 (lambda (x) (* x x)) '(1 2 3))))
+    """ % lambdas)
+    map1 = m.defs[W_Symbol.make("map1")].closure.caselam.lams[0]
+    apps = []
+    todo = map1.body[:]
+    while todo:
+        ast = todo.pop()
+        if isinstance(ast, App) and isinstance(ast.rator, LexicalVar):
+            apps.append(ast)
+        todo.extend(ast.direct_children())
+    assert len(apps) == 1
+    assert apps[0].megamorphic
+    assert apps[0].call_cache is None
+    n = CALL_CACHE_SIZE + 2
+    assert m.defs[W_Symbol.make("r")].value == n + n * (n - 1) / 2
+    assert m.defs[W_Symbol.make("s")].value == 14
+
+def test_call_cache_stats(doctest):
+    """
+    ! (require pycket/primitives)
+    ! (define (twice f x) (f (f x)))
+    ! (define (double x) (* x 2))
+    > (pycket-call-cache-stats-reset!)
+    > (twice double (twice double 1))
+    16
+    > (let ([s (pycket-call-cache-stats)]) (> (cdr (assq 'hits s)) 0))
+    #t
+    > (cdr (assq 'megamorphic-sites (pycket-call-cache-stats)))
+    0
+    """
+    assert call_cache_stats.hits > 0
@@ -7,6 +7,9 @@ from pycket.interpreter import *
 from pycket.values import *
 from pycket import values_string
 from pycket.prims import *
+from pycket.error import SchemeException
+from pycket.interpreter import interpret_module
+from pycket.values import W_Fixnum, W_Symbol
 
 from pycket.test.testhelper import (run, run_fix, run_flo, run_top, execute,
         run_values, check_equal, run_mod)
@@ -239,6 +242,46 @@ def test_callwithcurrentcontinuation():
     run_fix ("(+ 1 (call-with-current-continuation (lambda (k) (k 1))))", 2)
     run_fix ("(+ 1 (call-with-current-continuation (lambda (k) (+ 5 (k 1)))))", 2)
 
+def test_callwithescapecontinuation(doctest):
+    """
+    > (+ 1 (call/ec (lambda (k) 1)))
+    2
+    > (+ 1 (call-with-escape-continuation (lambda (k) (+ 5 (k 1)))))
+    2
+    > (let/ec k (for-each (lambda (x) (when (> x 2) (k x))) '(1 2 3 4)) 'none)
+    3
+    > (call-with-values (lambda () (let/ec k (k 1 2))) list)
+    '(1 2)
+    > (continuation? (let/ec k k))
+    #t
+    E (let ([k (call/ec (lambda (k) k))]) (k 1))
+    E (let ([k (let/ec k (k k))]) (k 1))
+    > (let ([saved #f] [count 0])
+        (let ([v (call/ec (lambda (e)
+                            (let ([x (call/cc (lambda (k) (set! saved k) 0))])
+                              (if (= x 0) 'normal (e x)))))])
+          (set! count (+ count 1))
+          (if (< count 2) (saved 5) (list v count))))
+    '(5 2)
+    > (let/ec k (with-handlers ([void (lambda (e) (k 'caught))]) (raise 'oops)))
+    'caught
+    """
+
+def test_escape_continuation_left_by_other_jumps(doctest):
+    """
+    ! (define saved #f)
+    ! (define (save-and-raise) (call/ec (lambda (k) (set! saved k) (raise 'oops))))
+    > (with-handlers ([symbol? (lambda (e) e)]) (save-and-raise))
+    'oops
+    E (saved 1)
+    ! (define inner #f)
+    > (let/ec outer (let/ec k (set! inner k) (outer 1)))
+    1
+    E (inner 2)
+    > (let/ec outer (let/ec k (with-handlers ([symbol? void]) (raise 'x)) (k 3)))
+    3
+    """
+
 
 def test_values():
     run_fix("(values 1)", 1)
@@ -645,6 +688,55 @@ def test_should_enter_downrecursion():
     assert f.body[0].should_enter
     assert f.body[0].els.body[0].should_enter
 
+def test_profile():
+    from StringIO      import StringIO
+    from pycket.expand import expand_string, parse_module
+    from pycket        import config
+    str = """
+        #lang pycket
+        (define (f x) (+ 1 (g (+ x 1))))
+        (define (g x) (if (< x 100) (g (+ x 1)) (h x)))
+        (define (h x) x)
+        (f 0)
+        (f 50)
+        """
+
+    ast = parse_module(expand_string(str))
+    env = ToplevelEnv(config.get_testing_config(**{"pycket.callgraph":True}))
+    env.callgraph.start_profile()
+    profile = env.callgraph.profile
+    profile.interval = 0.0 # sample at every loop header
+    try:
+        m = interpret_module(ast, env)
+    finally:
+        env.callgraph.stop_profile()
+    f = m.defs[W_Symbol.make("f")].closure.caselam.lams[0]
+    g = m.defs[W_Symbol.make("g")].closure.caselam.lams[0]
+    h = m.defs[W_Symbol.make("h")].closure.caselam.lams[0]
+
+    assert profile.entries[f].calls == 2
+    assert profile.entries[g].calls == 100 + 50
+    assert profile.entries[h].calls == 2
+    # only the body of g is a loop header
+    assert profile.samples > 0
+    assert profile.entries[g].self_samples == profile.samples
+    assert profile.entries[f].self_samples == 0
+    assert profile.entries[f].total_samples == profile.samples
+    assert profile.sorted_entries()[0] is profile.entries[g]
+    assert profile.entries[f].name.endswith(":%d" % f.srcpos)
+
+    flat = StringIO()
+    profile.write_flat(flat)
+    lines = flat.getvalue().splitlines()
+    assert lines[0].startswith("%d samples" % profile.samples)
+    assert lines[2].endswith(profile.entries[g].name)
+    collapsed = StringIO()
+    profile.write_collapsed(collapsed)
+    stacks = dict(line.rsplit(" ", 1) for line in collapsed.getvalue().splitlines())
+    assert sum(int(n) for n in stacks.values()) == profile.samples
+    for stack in stacks:
+        assert stack.split(";")[-1] in [e.name for e in profile.entries.values()]
+
 def test_reader_graph(doctest):
     """
     ! (require racket/shared)
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the benchmark harness
+#
+import os
+import pytest
+from pycket import bench
+
+def test_benchmarks_exist():
+    for fname, args in bench.BENCHMARKS.values():
+        assert os.path.exists(os.path.join(bench.TEST_DIR, fname))
+
+def test_parse_timings():
+    output = ("cpu time: 120 real time: 125 gc time: 3\n"
+              "42\n"
+              "cpu time: 100 real time: 101 gc time: 0\n")
+    assert bench.parse_timings(output) == [0.125, 0.101]
+    assert bench.parse_timings("42\n") == []
+
+def test_statistics():
+    assert bench.median([3.0, 1.0, 2.0]) == 2.0
+    assert bench.median([4.0, 1.0, 2.0, 3.0]) == 2.5
+    assert bench.median([]) is None
+    assert bench.stddev([1.0]) == 0.0
+    assert abs(bench.stddev([1.0, 3.0]) - 1.4142) < 1e-4
+
+def test_summarize():
+    result = bench.summarize([1.0, 2.0, 3.0], [5.0], [100, 300, 200],
+                             [[0.5, 0.2, 0.3], [0.4, 0.2, 0.2]], 1)
+    assert result["median"] == 2.0
+    assert result["warmup_times"] == [5.0]
+    assert result["max_rss_kb"] == 300
+    # the first timing of every run is dropped as warmup
+    assert result["steady_median"] == 0.2
+
+def test_compare():
+    baseline = {"nbody": {"default": {"median": 1.0}},
+                "ctak": {"default": {"median": 2.0}}}
+    results = {"nbody": {"default": {"median": 1.05},
+                         "no-callgraph": {"median": 3.0}},
+               "ctak": {"default": {"median": 2.5}}}
+    assert bench.compare(results, baseline, 0.1) == [("ctak", "default", 2.0, 2.5)]
+    assert bench.compare(results, baseline, 0.3) == []
+
+def test_variant_executable():
+    assert bench.variant_executable("pycket-c", "default") == "pycket-c"
+    assert bench.variant_executable("pycket-c", "no-callgraph") == "pycket-c-no-callgraph"
+    assert bench.variant_executable("pycket-c", "no-strategies") == "pycket-c-no-strategies"
+    assert bench.variant_executable("pycket-c", "fuse-conts") == "pycket-c-fuse-conts"
+    with pytest.raises(bench.BenchError):
+        bench.variant_executable("pycket-c", "no-such-option")
+
+def test_parse_args():
+    options = bench.parse_args(["pycket-bench", "-n", "3", "--variant",
+                                "no-callgraph", "nbody", "ctak"])
+    assert options["runs"] == 3
+    assert options["variants"] == ["default", "no-callgraph"]
+    assert options["benchmarks"] == ["nbody", "ctak"]
+    assert len(bench.parse_args(["pycket-bench"])["benchmarks"]) == len(bench.BENCHMARKS)
+    with pytest.raises(bench.BenchError):
+        bench.parse_args(["pycket-bench", "no-such-benchmark"])
@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for direct-style evaluation (--direct-stack)
+#
+
+from pycket                 import config
+from pycket.env             import ToplevelEnv
+from pycket.expand          import expand_string, parse_module
+from pycket.interpreter     import (DIRECT_MAX_DEPTH, DIRECT_NO, DIRECT_YES,
+                                    Let, interpret_module)
+from pycket.test.testhelper import format_pycket_mod
+from pycket.values          import W_Fixnum, W_Symbol
+
+def direct_env(callgraph=True):
+    return ToplevelEnv(config.get_testing_config(**{
+        "pycket.direct_stack": True, "pycket.callgraph": callgraph}))
+
+def run_direct(body, env=None):
+    ast = parse_module(expand_string(format_pycket_mod(body)))
+    if env is None:
+        env = direct_env()
+    return interpret_module(ast, env)
+
+def lookup(m, name):
+    return m.defs[W_Symbol.make(name)]
+
+def test_non_tail_recursion():
+    m = run_direct(
+    """
+    (define (tak x y z)
+      (if (not (< y x))
+          z
+          (let* ([a (tak (- x 1) y z)]
+                 [b (tak (- y 1) z x)]
+                 [c (tak (- z 1) x y)])
+            (tak a b c))))
+    (define (count n) (if (= n 0) 0 (+ 1 (count (- n 1)))))
+    (define r1 (tak 18 12 6))
+    (define r2 (count %d))
+    """ % (DIRECT_MAX_DEPTH * 10))
+    assert lookup(m, "r1").equal(W_Fixnum(7))
+    assert lookup(m, "r2").equal(W_Fixnum(DIRECT_MAX_DEPTH * 10))
+
+def test_lets_are_evaluated_in_direct_style():
+    m = run_direct(
+    """
+    (define (f x) (let ([y (car x)]) (cdr y)))
+    (define (g x) (let ([y (call/cc (lambda (k) x))]) y))
+    (define r1 (f (cons (cons 1 2) 3)))
+    (define r2 (g 1))
+    """)
+    f = lookup(m, "f").closure.caselam.lams[0]
+    let = f.body[0]
+    assert isinstance(let, Let)
+    assert let.direct_state == DIRECT_YES
+    assert let.direct_runs == 1
+    # call/cc needs the continuation
+    g = lookup(m, "g").closure.caselam.lams[0]
+    assert g.body[0].direct_state == DIRECT_NO
+    assert lookup(m, "r1").equal(W_Fixnum(2))
+    assert lookup(m, "r2").equal(W_Fixnum(1))
+
+def test_capture_below_direct_frames():
+    # the continuation captured by h includes the frames of f and g, which
+    # were evaluated in direct style
+    m = run_direct(
+    """
+    (define saved #f)
+    (define count 0)
+    (define (h) (call/cc (lambda (k) (set! saved k) 1)))
+    (define (g) (let ([a (h)]) (+ a 10)))
+    (define (f) (let ([b (g)]) (* b 2)))
+    (define results '())
+    (let ([r (f)])
+      (set! results (cons r results))
+      (set! count (+ count 1))
+      (when (< count 3)
+        (saved count)))
+    (define r results)
+    """)
+    w_r = lookup(m, "r")
+    assert w_r.tostring() == "(24 22 22)"
+
+def test_escape_through_direct_frames():
+    m = run_direct(
+    """
+    (define (find-neg l k)
+      (if (null? l)
+          #f
+          (let ([x (car l)])
+            (if (< x 0)
+                (k x)
+                (let ([rest (find-neg (cdr l) k)])
+                  rest)))))
+    (define r (call/cc (lambda (k) (find-neg '(1 2 3 -4 5) k))))
+    """)
+    assert lookup(m, "r").equal(W_Fixnum(-4))
+
+def test_escapes_are_not_failures():
+    m = run_direct(
+    """
+    (define (walk l k)
+      (if (null? l)
+          #f
+          (let ([x (car l)])
+            (if (< x 0)
+                (k x)
+                (let ([rest (walk (cdr l) k)])
+                  rest)))))
+    (define (find-neg l) (let/ec k (let ([r (walk l k)]) r)))
+    (define (repeat n)
+      (let ([r (find-neg '(1 2 -3 4))])
+        (if (= n 0) r (repeat (- n 1)))))
+    (define r (repeat 40))
+    """)
+    assert lookup(m, "r").equal(W_Fixnum(-3))
+    lets = []
+    todo = [lookup(m, "find-neg").closure.caselam]
+    while todo:
+        ast = todo.pop()
+        if isinstance(ast, Let):
+            lets.append(ast)
+        todo.extend(ast.direct_children())
+    assert lets
+    for let in lets:
+        assert let.direct_fails == 0
+        assert let.direct_state == DIRECT_YES
+
+def test_errors_of_simple_primitives_reach_handlers():
+    m = run_direct(
+    """
+    (define (bad x) (let ([y (car x)]) y))
+    (define (outer x) (let ([z (bad x)]) (+ z 1)))
+    (define r (with-handlers ([exn:fail? (lambda (e) 'caught)])
+                (let ([v (outer 5)]) v)))
+    """)
+    assert lookup(m, "r") is W_Symbol.make("caught")
+
+def test_mutated_variables():
+    m = run_direct(
+    """
+    (define (f n)
+      (let ([acc 0])
+        (letrec ([loop (lambda (i) (if (= i 0) acc (begin (set! acc (+ acc i)) (loop (- i 1)))))])
+          (let ([r (loop n)])
+            r))))
+    (define r (f 100))
+    """)
+    assert lookup(m, "r").equal(W_Fixnum(5050))
+
+def test_callgraph_sees_direct_calls():
+    m = run_direct(
+    """
+    (define (fib n) (if (< n 2) n (let ([a (fib (- n 1))] [b (fib (- n 2))]) (+ a b))))
+    (define r (fib 15))
+    """)
+    fib = lookup(m, "fib").closure.caselam.lams[0]
+    assert lookup(m, "r").equal(W_Fixnum(610))
+    assert fib.body[0].should_enter
@@ -141,6 +141,98 @@ class TestOptions(object):
         assert names['exprs'] == '(require (planet "%s"))' % empty_json
         assert args == []
 
+    def test_compile_only(self, empty_json):
+        argv = ['arg0', '--compile-only', empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert config['compile-only']
+        assert names['file'] == empty_json
+
+    def test_precompile(self, tmpdir):
+        argv = ['arg0', '--precompile', str(tmpdir)]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert config['compile-only']
+        assert names['precompile'] == str(tmpdir)
+        assert parse_args(['arg0', '--precompile'])[3] == 5
+
+    def test_expander_workers(self, empty_json):
+        config, names, args, retval = parse_args(['arg0', empty_json])
+        assert option_helper.expander_workers(names) == 0
+        argv = ['arg0', '--expander-workers', '2', empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert option_helper.expander_workers(names) == 2
+        argv = ['arg0', '--expander-workers', 'many', empty_json]
+        assert parse_args(argv)[3] == 5
+
+    def test_future_workers(self, empty_json):
+        from pycket.future import DEFAULT_WORKERS
+        config, names, args, retval = parse_args(['arg0', empty_json])
+        assert option_helper.future_workers(names) == DEFAULT_WORKERS
+        argv = ['arg0', '--future-workers', '0', empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert option_helper.future_workers(names) == 0
+        assert parse_args(['arg0', '--future-workers'])[3] == 5
+
+    def test_snapshot_options(self, empty_json):
+        argv = ['arg0', '--make-snapshot', 'a.img', '--restore', 'b.img', empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert names['make-snapshot'] == 'a.img'
+        assert names['restore'] == 'b.img'
+        assert parse_args(['arg0', '--restore'])[3] == 5
+
+    def test_serve_option(self, empty_json):
+        argv = ['arg0', '--serve', '/tmp/pycket.sock', empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert names['serve'] == '/tmp/pycket.sock'
+        assert parse_args(['arg0', '--serve'])[3] == 5
+
+    def test_profile(self, empty_json):
+        config, names, args, retval = parse_args(['arg0', '--profile', 'out.prof', empty_json])
+        assert retval == 0
+        assert names['profile'] == 'out.prof'
+        assert parse_args(['arg0', '--profile'])[3] == 5
+
+    def test_jit_stats(self, empty_json):
+        config, names, args, retval = parse_args(['arg0', '--jit-stats', empty_json])
+        assert retval == 0
+        assert config['jit-stats']
+
+    def test_lazy_modules(self, empty_json):
+        config, names, args, retval = parse_args(['arg0', '--lazy-modules', empty_json])
+        assert retval == 0
+        assert config['lazy-modules']
+        assert names['file'] == empty_json
+
+    def test_cache_options(self, empty_json, tmpdir):
+        argv = ['arg0', '--cache-dir', str(tmpdir), '--cache-size', '3',
+                '--cache-stats', empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert config['cache-stats']
+        assert option_helper.expansion_cache_dir(names) == str(tmpdir)
+        assert option_helper.expansion_cache_size(names) == 3 * 1024 * 1024
+        argv = ['arg0', '--cache-size', '0', empty_json]
+        assert parse_args(argv)[3] == 5
+
+    def test_cache_environment(self, empty_json, monkeypatch):
+        monkeypatch.setenv('PYCKET_CACHE_DIR', '/tmp/pycket-cache')
+        monkeypatch.setenv('PYCKET_CACHE_SIZE', '7')
+        config, names, args, retval = parse_args(['arg0', empty_json])
+        assert option_helper.expansion_cache_dir(names) == '/tmp/pycket-cache'
+        assert option_helper.expansion_cache_size(names) == 7 * 1024 * 1024
+        names['cache-dir'] = '/elsewhere'
+        assert option_helper.expansion_cache_dir(names) == '/elsewhere'
+        monkeypatch.delenv('PYCKET_CACHE_DIR')
+        monkeypatch.delenv('PYCKET_CACHE_SIZE')
+        assert option_helper.expansion_cache_dir({}) == ""
+        assert (option_helper.expansion_cache_size({}) ==
+                option_helper.DEFAULT_SIZE * 1024 * 1024)
+
 class TestCommandline(object):
     """These are quire similar to TestOptions but targeted at the higher level
     entry_point interface. At that point, we only have the program exit code.
@@ -176,3 +268,45 @@ class TestCommandline(object):
         assert entry_point(['arg0', '-f', racket_file]) == 0
         out, err = capfd.readouterr()
         assert out == "42"
+
+    def test_precompile(self, capfd, tmpdir):
+        a = tmpdir / "a.rkt"
+        b = tmpdir / "sub" / "b.rkt"
+        b.write('#lang pycket\n(provide y)\n(define y 1)\n', ensure=True)
+        a.write('#lang pycket\n(require "sub/b.rkt")\n(display y)\n')
+        assert entry_point(['arg0', '--precompile', str(tmpdir)]) == 0
+        out, err = capfd.readouterr()
+        assert "expanded 2 modules" in out
+        # the program itself is not run
+        assert out.startswith("expanded")
+        for f in ["a.rkt", "sub/b.rkt"]:
+            assert tmpdir.join(f + ".json").check()
+            assert tmpdir.join(f + ".ast").check()
+
+    def test_snapshot(self, capfd, tmpdir):
+        lib = tmpdir / "lib.rkt"
+        prog = tmpdir / "prog.rkt"
+        lib.write('#lang pycket\n(provide f)\n(define (f x) (* x 2))\n')
+        prog.write('#lang pycket\n(require "lib.rkt")\n(display (f 21))\n')
+        img = str(tmpdir / "lib.img")
+        assert entry_point(['arg0', '--make-snapshot', img, str(prog)]) == 0
+        assert tmpdir.join("lib.img").check()
+        assert entry_point(['arg0', '--restore', img, str(prog)]) == 0
+        out, err = capfd.readouterr()
+        assert out.endswith("4242")
+
+    def test_cache_stats(self, capfd, tmpdir, racket_file):
+        """#lang pycket
+        (display 42)
+        """
+        cache = str(tmpdir / "cache")
+        argv = ['arg0', '--cache-dir', cache, '--cache-stats', racket_file]
+        assert entry_point(argv) == 0
+        out, err = capfd.readouterr()
+        assert "1 misses, 0 evictions" in out
+        assert not tmpdir.join("prog.rkt.json").check()
+        # the second run finds the expansion in the cache
+        assert entry_point(argv) == 0
+        out, err = capfd.readouterr()
+        assert out.startswith("42")
+        assert "0 misses, 0 evictions" in out
@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the resident expander processes
+#
+import pytest
+from pycket import pycket_json
+from pycket.expand import expand_module_graph, module_dependencies, _json_name
+from pycket.expander_pool import ExpanderPool, ExpanderError
+
+def pytest_funcarg__pool(request):
+    p = ExpanderPool(2)
+    request.addfinalizer(p.shutdown)
+    return p
+
+def test_expand_file(pool, racket_file):
+    """#lang pycket
+    (define x 1)
+    """
+    json = pycket_json.loads(pool.expand(racket_file))
+    assert "body-forms" in json.value_object()
+    # the same worker is reused for the next file
+    json = pycket_json.loads(pool.expand(racket_file))
+    assert "body-forms" in json.value_object()
+    assert len(pool.workers) == 1
+
+def test_expand_error(pool, tmpdir):
+    bad = tmpdir / "bad.rkt"
+    bad.write("#lang pycket\n(define)\n")
+    with pytest.raises(ExpanderError):
+        pool.expand(str(bad))
+    # the worker survives a failed expansion
+    good = tmpdir / "good.rkt"
+    good.write("#lang pycket\n(define x 1)\n")
+    assert pool.expand(str(good))
+
+def test_expand_module_graph(pool, tmpdir):
+    a = tmpdir / "a.rkt"
+    b = tmpdir / "b.rkt"
+    c = tmpdir / "c.rkt"
+    a.write('#lang pycket\n(require "b.rkt" "c.rkt")\n(define x (+ y z))\n')
+    b.write('#lang pycket\n(require "c.rkt")\n(provide y)\n(define y z)\n')
+    c.write('#lang pycket\n(provide z)\n(define z 1)\n')
+    expanded = expand_module_graph([str(a)], pool)
+    names = sorted([name for name, seconds in expanded])
+    assert names == sorted([str(a), str(b), str(c)])
+    for f in [a, b, c]:
+        assert tmpdir.join(f.basename + ".json").check()
+    json = pycket_json.loads(open(_json_name(str(a))).read())
+    assert sorted(module_dependencies(json)) == sorted([str(b), str(c)])
+    # everything is up to date now
+    assert expand_module_graph([str(a)], pool, scan_all=True) == []
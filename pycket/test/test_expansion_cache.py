@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the shared expansion cache directory
+#
+import os
+from pycket import expansion_cache
+from pycket.expand import ensure_json_ast_run, load_json_ast_cached, ModTable
+from pycket.expansion_cache import ExpansionCache, start_cache
+
+def pytest_funcarg__cache(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    cache = start_cache(str(tmpdir / "cache"), 1024 * 1024)
+    request.addfinalizer(lambda: start_cache("", 0))
+    return cache
+
+def test_key(tmpdir):
+    cache = ExpansionCache(str(tmpdir / "cache"), 1024)
+    a = tmpdir / "a.rkt"
+    b = tmpdir / "b.rkt"
+    a.write("#lang pycket\n(define x 1)\n")
+    b.write("#lang pycket\n(define x 1)\n")
+    key = cache.key(str(a))
+    assert len(key) == 40
+    # the expansion contains absolute paths, so equal contents are not enough
+    assert cache.key(str(b)) != key
+    assert ExpansionCache(str(tmpdir), 1024).key(str(a)) == key
+    a.write("#lang pycket\n(define x 2)\n")
+    assert ExpansionCache(str(tmpdir), 1024).key(str(a)) != key
+    json_file = cache.json_name(str(a))
+    assert json_file == os.path.join(str(tmpdir / "cache"), key[:2], key + ".json")
+
+def test_key_follows_changes(tmpdir):
+    cache = ExpansionCache(str(tmpdir / "cache"), 1024)
+    a = tmpdir / "a.rkt"
+    a.write("#lang pycket\n(define x 1)\n")
+    key = cache.key(str(a))
+    assert cache.key(str(a)) == key
+    a.write("#lang pycket\n(define x 22)\n")
+    assert cache.key(str(a)) != key
+    # same size, another modification time
+    a.write("#lang pycket\n(define x 1)\n")
+    os.utime(str(a), (1, 1))
+    assert cache.key(str(a)) == key
+
+def test_lookup_and_store(tmpdir):
+    cache = ExpansionCache(str(tmpdir / "cache"), 1024)
+    src = tmpdir / "a.rkt"
+    src.write("#lang pycket\n")
+    json_file = cache.json_name(str(src))
+    assert not cache.lookup(json_file)
+    cache.store(json_file, "{}")
+    assert cache.lookup(json_file)
+    assert open(json_file).read() == "{}"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats() == "expansion cache: 1 hits, 1 misses, 0 evictions"
+    # no temporary files are left behind
+    assert os.listdir(os.path.dirname(json_file)) == [os.path.basename(json_file)]
+
+def test_eviction(tmpdir):
+    cache = ExpansionCache(str(tmpdir / "cache"), 1000)
+    names = []
+    for i in range(4):
+        src = tmpdir / ("m%d.rkt" % i)
+        src.write("#lang pycket\n(define x %d)\n" % i)
+        json_file = cache.json_name(str(src))
+        cache.store(json_file, "x" * 300)
+        os.utime(json_file, (1000 + i, 1000 + i))
+        names.append(json_file)
+    # the fourth entry pushed the cache over its limit
+    assert cache.evictions == 1
+    assert not os.path.exists(names[0])
+    assert cache.size <= 1000
+    # using an entry makes it the most recently used one
+    assert cache.lookup(names[1])
+    src = tmpdir / "m4.rkt"
+    src.write("#lang pycket\n(define x 4)\n")
+    cache.store(cache.json_name(str(src)), "x" * 300)
+    assert cache.evictions == 2
+    assert os.path.exists(names[1])
+    assert not os.path.exists(names[2])
+
+def test_eviction_removes_ast_cache(tmpdir):
+    cache = ExpansionCache(str(tmpdir / "cache"), 350)
+    src = tmpdir / "a.rkt"
+    src.write("#lang pycket\n")
+    json_file = cache.json_name(str(src))
+    cache.store(json_file, "x" * 200)
+    ast_file = json_file[:-len(".json")] + ".ast"
+    open(ast_file, "w").write("y" * 200)
+    os.utime(json_file, (1000, 1000))
+    os.utime(ast_file, (1000, 1000))
+    src = tmpdir / "b.rkt"
+    src.write("#lang pycket\n(define x 1)\n")
+    cache.store(cache.json_name(str(src)), "x" * 200)
+    assert cache.evictions == 1
+    assert not os.path.exists(json_file)
+    assert not os.path.exists(ast_file)
+
+def test_expand_into_cache(cache, racket_file, tmpdir):
+    """#lang pycket
+    (define x 1)
+    """
+    json_file = ensure_json_ast_run(racket_file)
+    assert json_file.startswith(cache.directory)
+    assert not tmpdir.join("prog.rkt.json").check()
+    assert cache.misses == 1
+    module = load_json_ast_cached(json_file, ModTable())
+    assert os.path.exists(json_file[:-len(".json")] + ".ast")
+    # touching the source does not invalidate the expansion
+    os.utime(racket_file, None)
+    assert ensure_json_ast_run(racket_file) == json_file
+    assert cache.hits == 1
+    cached = load_json_ast_cached(json_file, ModTable())
+    assert cached.tostring() == module.tostring()
+
+def test_ast_cache_counts_toward_size(cache, racket_file):
+    """#lang pycket
+    (define x 1)
+    """
+    json_file = ensure_json_ast_run(racket_file)
+    size = cache.size
+    load_json_ast_cached(json_file, ModTable())
+    ast_file = json_file[:-len(".json")] + ".ast"
+    assert cache.size == size + os.stat(ast_file).st_size
+    # the size is not off from what a scan finds
+    expected = cache.size
+    cache.scan()
+    assert cache.size == expected
+
+def test_read_only_source(cache, tmpdir):
+    src_dir = tmpdir / "src"
+    src = src_dir / "prog.rkt"
+    src.write("#lang pycket\n(define x 1)\n", ensure=True)
+    src.chmod(0444)
+    src_dir.chmod(0555)
+    try:
+        json_file = ensure_json_ast_run(str(src))
+    finally:
+        src_dir.chmod(0755)
+    assert json_file.startswith(cache.directory)
+    assert not src_dir.join("prog.rkt.json").check()
+    assert expansion_cache.get_cache() is cache
+
+def test_lookup_counts_once(tmpdir):
+    cache = ExpansionCache(str(tmpdir / "cache"), 1024)
+    src = tmpdir / "a.rkt"
+    src.write("#lang pycket\n")
+    json_file = cache.json_name(str(src))
+    cache.store(json_file, "{}")
+    os.utime(json_file, (1000, 1000))
+    assert cache.lookup(json_file)
+    assert os.stat(json_file).st_mtime > 1000
+    os.utime(json_file, (1000, 1000))
+    # a module found by expand_module_graph is looked up again when loaded
+    assert cache.lookup(json_file)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert os.stat(json_file).st_mtime == 1000
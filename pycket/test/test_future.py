@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for futures
+#
+
+from pycket                 import values
+from pycket.future          import Eligibility, pool, DEFAULT_WORKERS
+from pycket.scheduler       import scheduler
+from pycket.test.testhelper import run_mod
+from pycket.vector          import W_FlVector, W_Vector
+
+def setup_function(function):
+    scheduler.reset()
+    pool.size = DEFAULT_WORKERS
+    pool.started = 0
+    pool.failures = 0
+
+def test_eligibility():
+    w_vec = W_FlVector.fromelements([values.W_Flonum(1.0),
+                                     values.W_Flonum(2.0)])
+    eligibility = Eligibility(None)
+    assert eligibility.value_ok(w_vec, 0)
+    assert eligibility.vectors == [w_vec]
+    assert eligibility.value_ok(values.W_Fixnum(1), 0)
+    w_objs = W_Vector.fromelements([values.W_Symbol.make("a")])
+    assert not Eligibility(None).value_ok(w_objs, 0)
+    assert not Eligibility(None).value_ok(values.W_MBox(values.w_void), 0)
+
+def test_touch(doctest):
+    """
+    ! (require racket/future)
+    ! (define f (future (lambda () (+ 1 2))))
+    > (touch f)
+    3
+    > (touch f)
+    3
+    > (future? f)
+    #t
+    > (future? 1)
+    #f
+    > (call-with-values (lambda () (touch (would-be-future (lambda () (values 1 2))))) list)
+    '(1 2)
+    > (let ([b (box 0)]) (touch (future (lambda () (set-box! b 1)))) (unbox b))
+    1
+    E (touch (future (lambda () (car 1))))
+    """
+
+def test_future_vector_slices():
+    m = run_mod("""
+    #lang pycket
+    (require racket/flonum racket/future)
+    (define v (make-flvector 8 0.0))
+    (define (fill lo hi)
+      (future (lambda ()
+        (for ([i (in-range lo hi)]) (flvector-set! v i (exact->inexact i)))
+        (- hi lo))))
+    (define fs (list (fill 0 4) (fill 4 8)))
+    (define n (apply + (map touch fs)))
+    (define sum (for/fold ([s 0.0]) ([x (in-flvector v)]) (+ s x)))
+    """)
+    assert m.defs[values.W_Symbol.make("n")].value == 8
+    assert m.defs[values.W_Symbol.make("sum")].value == 28.0
+
+def test_module_level_state_is_not_lost():
+    m = run_mod("""
+    #lang pycket
+    (require racket/future)
+    (define b (box 0))
+    (define counter 0)
+    (define (bump!) (set! counter (+ counter 1)))
+    (define f (future (lambda () (set-box! b 1) 2)))
+    (define g (future (lambda () (bump!) 3)))
+    (define r (+ (touch f) (touch g)))
+    (define x (+ (unbox b) counter))
+    """)
+    assert m.defs[values.W_Symbol.make("r")].value == 5
+    assert m.defs[values.W_Symbol.make("x")].value == 2
+
+def test_output_of_workers_is_flushed(capfd):
+    run_mod("""
+    #lang pycket
+    (require racket/future)
+    (define f (future (lambda () (display "partial") 1)))
+    (touch f)
+    """)
+    out, err = capfd.readouterr()
+    assert out.count("partial") == 1
+    # the output came from the worker, the future did not run again inline
+    assert pool.started == 1
+    assert pool.failures == 0
+
+def test_no_workers():
+    pool.size = 0
+    m = run_mod("""
+    #lang pycket
+    (require racket/future)
+    (define v (make-vector 2 0))
+    (define f (future (lambda () (vector-set! v 0 1) 7)))
+    (define r (touch f))
+    (define x (vector-ref v 0))
+    """)
+    assert m.defs[values.W_Symbol.make("r")].value == 7
+    assert m.defs[values.W_Symbol.make("x")].value == 1
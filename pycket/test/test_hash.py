@@ -1,7 +1,9 @@
 import operator as op
 from pycket                          import values
 from pycket.hash.base                import ll_get_dict_item, get_dict_item
-from pycket.hash.equal               import ByteHashmapStrategy, StringHashmapStrategy
+from pycket.hash.equal               import (ByteHashmapStrategy, StringHashmapStrategy,
+    ObjectHashmapStrategy, equal_hash_key)
+from pycket.vector                   import W_Vector
 from pycket.hash.persistent_hash_map import make_persistent_hash_type, validate_persistent_hash
 from pycket.test.testhelper          import run_mod_expr, run_mod
 from rpython.rlib.rarithmetic        import r_uint
@@ -499,3 +501,218 @@ def test_persistent_hash__collisions_removal2():
         assert v >= 990
         assert v % 10 == k
         assert acc.val_at(k, None) is v
+
+def test_equal_hash_key():
+    from pycket.values_string import W_String
+    l1 = values.to_list([values.W_Fixnum(1), W_String.fromstr_utf8("a")])
+    l2 = values.to_list([values.W_Fixnum(1), W_String.fromascii("a", immutable=True)])
+    assert equal_hash_key(l1) == equal_hash_key(l2)
+    assert equal_hash_key(l1) != equal_hash_key(values.to_list([values.W_Fixnum(2)]))
+    v1 = W_Vector.fromelements([l1, values.W_Flonum(1.5)])
+    v2 = W_Vector.fromelements([l2, values.W_Flonum(1.5)])
+    assert equal_hash_key(v1) == equal_hash_key(v2)
+    assert equal_hash_key(v1)[0]
+
+def test_hash_compound_keys(doctest):
+    """
+    ! (struct point (x y) #:transparent)
+    ! (define ht (make-hash))
+    ! (for ([i 100]) (hash-set! ht (list i (* 2 i)) i) (hash-set! ht (vector i "v") (- i)) (hash-set! ht (point i i) (* i i)))
+    > (hash-count ht)
+    300
+    > (hash-ref ht (list 42 84))
+    42
+    > (hash-ref ht (vector 42 (string-copy "v")))
+    -42
+    > (hash-ref ht (point 9 9))
+    81
+    > (hash-ref ht (list 42 85) #f)
+    #f
+    ! (hash-set! ht (list 42 84) 'replaced)
+    > (hash-ref ht (list 42 84))
+    'replaced
+    > (hash-count ht)
+    300
+    """
+
+def test_hash_impersonated_keys(doctest):
+    """
+    ! (define ht (make-hash))
+    ! (for ([i 10]) (hash-set! ht (vector i) i))
+    ! (define v (chaperone-vector (vector 3) (lambda (v i x) x) (lambda (v i x) x)))
+    > (hash-ref ht v)
+    3
+    ! (hash-set! ht v 'chaperoned)
+    > (hash-ref ht (vector 3))
+    'chaperoned
+    ! (hash-set! ht (chaperone-vector (vector 20) (lambda (v i x) x) (lambda (v i x) x)) 20)
+    > (hash-ref ht (vector 20))
+    20
+    > (hash-count ht)
+    11
+    """
+
+def test_hash_equal_hash_property(doctest):
+    """
+    ! (struct mod3 (n) #:property prop:equal+hash (list (lambda (a b r) (= (modulo (mod3-n a) 3) (modulo (mod3-n b) 3))) (lambda (a r) 0) (lambda (a r) 0)))
+    ! (define ht (make-hash))
+    ! (hash-set! ht (mod3 1) 'one)
+    ! (hash-set! ht (list 1 2) 'list)
+    > (hash-ref ht (mod3 4))
+    'one
+    > (hash-ref ht (list 1 2))
+    'list
+    > (hash-count ht)
+    2
+    """
+
+def test_hash_switch_to_object_strategy():
+    from pycket.hash.equal import W_EqualHashTable
+    from pycket.values_string import W_String
+    ht = W_EqualHashTable([values.W_Fixnum(i) for i in range(10)],
+                          [values.W_Fixnum(-i) for i in range(10)])
+    ht.strategy.switch_to_object_strategy(ht)
+    assert ht.strategy is ObjectHashmapStrategy.singleton
+    assert ht.length() == 10
+    storage = ht.strategy.unerase(ht.hstorage)
+    hashable, h = equal_hash_key(values.W_Fixnum(3))
+    [index] = storage.candidates(hashable, h)
+    assert storage.entries[index][1].value == -3
+    hashable, h = equal_hash_key(W_String.fromstr_utf8("x"))
+    assert storage.candidates(hashable, h) == []
+
+def test_immutable_equal_hash(doctest):
+    """
+    ! (define h (for/fold ([acc (hash)]) ([i 1000]) (hash-set acc (list i "x") i)))
+    ! (define h^ (hash-set h (list 7 "x") 'seven))
+    > (hash-count h)
+    1000
+    > (hash-ref h (list 7 (string-copy "x")))
+    7
+    > (hash-ref h^ (list 7 "x"))
+    'seven
+    > (hash-count h^)
+    1000
+    > (hash-ref (hash-remove h (list 7 "x")) (list 7 "x") #f)
+    #f
+    > (hash-count (hash-remove h (list 7 "x")))
+    999
+    > (hash-count (hash-remove h (list 7 "y")))
+    1000
+    > (hash-ref (make-immutable-hash '(((a) . 1) (#(b) . 2))) (vector 'b))
+    2
+    > (hash-ref (hash-set #hash((1 . 2)) (list 1) 3) (list 1))
+    3
+    > (hash-ref (hash-remove #hash((1 . 2) (3 . 4)) 1) 1 #f)
+    #f
+    """
+
+def test_immutable_equal_hash_impersonated_keys(doctest):
+    """
+    ! (define (chp v) (chaperone-vector v (lambda (v i x) x) (lambda (v i x) x)))
+    ! (define h (hash (vector 1) 'one (chp (vector 2)) 'two))
+    > (hash-ref h (chp (vector 1)))
+    'one
+    > (hash-ref h (vector 2))
+    'two
+    > (hash-count (hash-set h (vector 2) 'deux))
+    2
+    > (hash-ref (hash-set h (vector 2) 'deux) (chp (vector 2)))
+    'deux
+    > (hash-count (hash-set h (chp (vector 1)) 'un))
+    2
+    > (hash-count (hash-remove (hash-remove h (vector 2)) (chp (vector 1))))
+    0
+    """
+
+def test_immutable_equal_hash_sharing():
+    from pycket.hash.equal import (W_EqualImmutableHashTable,
+        make_equal_immutable_table, equal_simple)
+    from pycket.values_string import W_String
+    keys = [values.to_list([values.W_Fixnum(i), W_String.fromstr_utf8("k")])
+                for i in range(100)]
+    vals = [values.W_Fixnum(i) for i in range(100)]
+    table = make_equal_immutable_table(keys, vals)
+    assert isinstance(table, W_EqualImmutableHashTable)
+    assert table.length() == 100 and not table.others
+    validate_persistent_hash(table.hamt)
+    key = values.to_list([values.W_Fixnum(5), W_String.fromstr_utf8("k")])
+    assert equal_simple(key, keys[5])
+    assert not equal_simple(key, keys[6])
+    assert table.hamt.val_at(key, None) is vals[5]
+    smaller = table.hamt.without(key)
+    assert len(smaller) == 99 and len(table.hamt) == 100
+    validate_persistent_hash(smaller)
+
+def test_weak_hash(doctest):
+    """
+    ! (define ht (make-weak-hash))
+    ! (define k (list 1 2))
+    ! (hash-set! ht k 'a)
+    ! (hash-set! ht 3 'three)
+    > (hash-ref ht (list 1 2))
+    'a
+    > (hash-ref ht 3)
+    'three
+    ! (hash-remove! ht (list 1 2))
+    > (hash-ref ht k #f)
+    #f
+    > (hash-weak? ht)
+    #t
+    > (hash-weak? (make-hash))
+    #f
+    ! (define eq-ht (make-weak-hasheq))
+    ! (hash-set! eq-ht k 'b)
+    > (hash-ref eq-ht k)
+    'b
+    > (hash-ref eq-ht (list 1 2) #f)
+    #f
+    > (hash-ref (make-weak-hasheqv '((1.5 . x))) 1.5)
+    'x
+    """
+
+def test_weak_hash_purge():
+    import gc
+    from pycket.hash.weak import W_WeakEqualHashTable, MIN_PURGE
+    from pycket.values_string import W_String
+    table = W_WeakEqualHashTable()
+    kept = [W_String.fromstr_utf8("kept %d" % i) for i in range(10)]
+    for w_key in kept:
+        hashable, h = table.hash_key(w_key)
+        table.add(hashable, h, w_key, values.W_Fixnum(1))
+    for i in range(10000):
+        w_key = values.to_list([values.W_Fixnum(i)])
+        hashable, h = table.hash_key(w_key)
+        table.add(hashable, h, w_key, values.W_Fixnum(i))
+        del w_key
+        if i % 1000 == 0:
+            gc.collect()
+    table.purge()
+    assert len(table.entries) == len(kept)
+    assert table.purge_at == MIN_PURGE
+    for w_key in kept:
+        assert table.find(table.hash_key(w_key)[1], w_key) >= 0
+    for k, v in table.hash_items():
+        assert k in kept
+
+def test_weak_hash_iterate_skips_collected_keys():
+    import gc
+    from pycket.hash.weak import W_WeakEqHashTable
+    table = W_WeakEqHashTable()
+    kept = [values.W_MBox(values.W_Fixnum(i)) for i in range(3)]
+    for i in range(6):
+        if i % 2 == 0:
+            w_key = kept[i / 2]
+        else:
+            w_key = values.W_MBox(values.W_Fixnum(i))
+        hashable, h = table.hash_key(w_key)
+        table.add(hashable, h, w_key, values.W_Fixnum(i))
+        del w_key
+    gc.collect()
+    assert table.length() == 3
+    keys = []
+    pos = table.next_position(-1)
+    while pos >= 0:
+        keys.append(table.get_item(pos)[0])
+        pos = table.next_position(pos)
+    assert keys == kept
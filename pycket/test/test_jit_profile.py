@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for warm-start JIT profiles
+#
+
+from pycket             import config
+from pycket.expand      import expand_string, parse_module
+from pycket.interpreter import ToplevelEnv, interpret_module
+from pycket.jit_profile import (JitProfile, lambda_asts, lambda_key,
+                                module_lambdas)
+from pycket.values      import W_Symbol
+
+PROGRAM = """
+    #lang pycket
+    (define (g x) (if (= x 0) (g 5) (h x)))
+    (define (h x) x)
+    (define (append a b)
+      (if (null? a)
+          b
+          (cons (car a) (append (cdr a) b))))
+    (g 0)
+    (append (list 1 2 3) (list 4 5 6))
+    """
+
+def callgraph_env():
+    return ToplevelEnv(config.get_testing_config(**{"pycket.callgraph":True}))
+
+def lambda_of(m, name):
+    return m.defs[W_Symbol.make(name)].closure.caselam.lams[0]
+
+def marked(lam):
+    return [i for i, ast in enumerate(lambda_asts(lam)) if ast.should_enter]
+
+def test_lambda_asts():
+    env = callgraph_env()
+    ast = parse_module(expand_string(PROGRAM))
+    m = interpret_module(ast, env)
+    lams = module_lambdas(ast)
+    for name in ["g", "h", "append"]:
+        assert lambda_of(m, name) in lams
+    for lam in lams:
+        assert lambda_asts(lam)[0] is lam.body[0]
+
+def test_save_and_load(tmpdir):
+    env = callgraph_env()
+    m = interpret_module(parse_module(expand_string(PROGRAM)), env)
+    g = lambda_of(m, "g")
+    append = lambda_of(m, "append")
+    g_marks = marked(g)
+    append_marks = marked(append)
+    assert 0 in g_marks
+    assert len(append_marks) > 1
+    path = str(tmpdir.join("jit.profile"))
+    env.callgraph.write_jit_profile(path)
+
+    env = callgraph_env()
+    assert env.callgraph.load_jit_profile(path)
+    ast = parse_module(expand_string(PROGRAM))
+    # marked when the module is instantiated, before anything is called
+    env.callgraph.warm_start(ast)
+    lams = {}
+    for lam in module_lambdas(ast):
+        lams[lambda_key(lam)] = lam
+    assert marked(lams[lambda_key(g)]) == g_marks
+    assert marked(lams[lambda_key(append)]) == append_marks
+
+def test_read_errors(tmpdir):
+    path = tmpdir.join("bad.profile")
+    path.write("not a profile\n")
+    assert not JitProfile().read(str(path))
+    assert not callgraph_env().callgraph.load_jit_profile(str(tmpdir.join("missing")))
+    path.write("12 0,3 /some/file.rkt\n")
+    profile = JitProfile()
+    assert profile.read(str(path))
+    assert profile.entries == {"12 /some/file.rkt": [0, 3]}
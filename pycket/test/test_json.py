@@ -1,6 +1,6 @@
 
 import pytest
-from pycket.pycket_json import loads
+from pycket.pycket_json import loads, JsonPullParser
 import json as pyjson
 
 def _compare(string, expected):
@@ -44,3 +44,62 @@ def test_bug():
             [{"quote" : { "string": "\\" }},{"quote" : { "string": "Hi" }}])
 
     _compare(r'{"string" : "\\\\"}', {"string": "\\\\"})
+
+def test_keys_are_shared():
+    json = loads('[{"lexical": "a"}, {"lexical": "b"}]')
+    k1, = json.value_array()[0].value_object().keys()
+    k2, = json.value_array()[1].value_object().keys()
+    assert k1 == k2 == "lexical"
+    assert k1 is k2
+
+def test_pull_parser():
+    parser = JsonPullParser(' {"a": 1, "body" : [ {"x": [1, 2]}, "s" ,3], "c": {}} ')
+    parser.start_object()
+    assert parser.next_key() == "a"
+    assert parser.read_value()._unpack_deep() == 1
+    assert parser.next_key() == "body"
+    parser.start_array()
+    elems = []
+    while parser.next_element():
+        elems.append(parser.read_value()._unpack_deep())
+    assert elems == [{"x": [1, 2]}, "s", 3]
+    assert parser.next_key() == "c"
+    assert parser.read_value()._unpack_deep() == {}
+    assert parser.next_key() is None
+    parser.finish()
+
+def test_pull_parser_empty():
+    parser = JsonPullParser('{"a": []}')
+    parser.start_object()
+    assert parser.next_key() == "a"
+    parser.start_array()
+    assert not parser.next_element()
+    assert parser.next_key() is None
+    parser.finish()
+
+def test_pull_parser_errors():
+    parser = JsonPullParser('{"a" 1}')
+    parser.start_object()
+    with pytest.raises(ValueError):
+        parser.next_key()
+    parser = JsonPullParser('[1 2]')
+    parser.start_array()
+    assert parser.next_element()
+    parser.read_value()
+    with pytest.raises(ValueError):
+        parser.next_element()
+    parser = JsonPullParser('{} x')
+    parser.start_object()
+    assert parser.next_key() is None
+    with pytest.raises(ValueError):
+        parser.finish()
+
+def test_streaming_module_matches_tree():
+    from pycket.expand import (expand_string, _to_module, to_module_streaming,
+        ModTable)
+    from pycket.test.testhelper import format_pycket_mod
+    data = expand_string(format_pycket_mod(
+        "(define (f x) (if (zero? x) 'done (f (sub1 x)))) (define y (f 10))"))
+    tree = _to_module(loads(data), ModTable()).assign_convert_module()
+    streamed = to_module_streaming(data, ModTable()).assign_convert_module()
+    assert streamed.tostring() == tree.tostring()
@@ -3,6 +3,9 @@ from pycket.expand import expand, to_ast, parse_module, expand_string
 from pycket.interpreter import *
 from pycket.values import *
 from pycket.prims import *
+from pycket.error import SchemeException
+from pycket.interpreter import LazyDefinition, interpret_module
+from pycket.values import W_Fixnum, W_PromotableClosure, W_Symbol
 
 from pycket.test.testhelper import run, run_fix, run_mod_expr, run_mod_defs, run_mod
 
@@ -154,3 +157,53 @@ def test_module_star():
     d = m.defs[W_Symbol.make("d")]
     assert isinstance(d, W_Integer) and d.value == 4
 
+
+def run_mod_lazily(m):
+    from pycket.env import ToplevelEnv
+    ast = parse_module(expand_string(m))
+    env = ToplevelEnv()
+    env.globalconfig.load(ast)
+    env.module_env.lazy_instantiation = True
+    interpret_module(ast, env)
+    return ast
+
+def test_lazy_instantiation():
+    m = run_mod_lazily(
+    """
+    #lang pycket
+    (module lib pycket
+      (provide used unused k)
+      (define (used x) (+ x k))
+      (define (unused x) (car x))
+      (define k 5))
+    (require (submod "." lib))
+    (define y (used 1))
+    """)
+    lib = m.resolve_submodule_path(["lib"])
+    assert isinstance(lib.defs[W_Symbol.make("unused")], LazyDefinition)
+    assert isinstance(lib.defs[W_Symbol.make("used")], W_PromotableClosure)
+    assert isinstance(lib.defs[W_Symbol.make("k")], W_Fixnum)
+    assert m.defs[W_Symbol.make("y")].value == 6
+
+def test_lazy_instantiation_effects():
+    # definitions with effects are still evaluated eagerly and in order
+    m = run_mod_lazily(
+    """
+    #lang pycket
+    (define count 0)
+    (define (f) (set! count (+ count 1)) count)
+    (define a (f))
+    (define g (begin (f) (lambda () count)))
+    (define b (g))
+    """)
+    assert isinstance(m.defs[W_Symbol.make("b")], W_Fixnum)
+    assert m.defs[W_Symbol.make("b")].value == 2
+    assert m.defs[W_Symbol.make("count")].get_val().value == 2
+
+def test_lazy_use_before_definition():
+    with pytest.raises(SchemeException):
+        run_mod_lazily("""
+        #lang pycket
+        (f)
+        (define (f) 1)
+    """)
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the AST optimizer
+#
+
+from pycket                 import config
+from pycket.expand          import expand_string, parse_module
+from pycket.interpreter     import (App, CaseLambda, DefineValues, If, Let,
+                                    Quote, SimplePrimApp2,
+                                    SimplePrimAppN)
+from pycket.optimizer       import count_nodes, stats
+from pycket.test.testhelper import format_pycket_mod, run_fix, run_mod_expr
+from pycket.values          import W_Fixnum, w_true
+
+def setup_function(function):
+    config.optimize_ast = True
+
+def teardown_function(function):
+    config.optimize_ast = False
+
+def expr_ast(s):
+    m = parse_module(expand_string(format_pycket_mod(s, extra="(define x 0)")))
+    return m.body[-1]
+
+def lambda_body(s):
+    p = expr_ast(s)
+    assert isinstance(p, CaseLambda)
+    return p.lams[0].body[0]
+
+def test_fold_primitives():
+    p = expr_ast("(+ 1 (* 2 3))")
+    assert isinstance(p, Quote)
+    assert p.w_val.equal(W_Fixnum(7))
+    p = expr_ast("(not (< 1 2))")
+    assert isinstance(p, Quote)
+    # errors are left for runtime
+    p = expr_ast("(/ 1 0)")
+    assert isinstance(p, App)
+    # impure or allocating primitives are not folded
+    p = expr_ast("(cons 1 2)")
+    assert isinstance(p, SimplePrimApp2)
+
+def test_fold_identity():
+    p = expr_ast("(eq? 'a 'a)")
+    assert isinstance(p, Quote)
+    assert p.w_val is w_true
+    p = expr_ast("(eqv? 1 2)")
+    assert isinstance(p, Quote)
+    # the identity of flonums is not fixed at compile time
+    p = expr_ast("(eq? 1.5 1.5)")
+    assert isinstance(p, SimplePrimApp2)
+
+def test_propagate_constants():
+    body = lambda_body("(lambda (y) (let ([a 5]) (+ a y)))")
+    assert isinstance(body, SimplePrimAppN)
+    assert isinstance(body.rands[0], Quote)
+    # every use gets its own node
+    body = lambda_body("(lambda (y) (let ([a 5]) (+ a y a)))")
+    assert isinstance(body.rands[0], Quote)
+    assert isinstance(body.rands[2], Quote)
+    assert body.rands[0] is not body.rands[2]
+    # mutated variables stay
+    body = lambda_body("(lambda (y) (let ([a 5]) (set! a y) a))")
+    assert isinstance(body, Let)
+    # shadowed variables are not replaced
+    body = lambda_body("(lambda (y) (let ([a 5]) (lambda (a) a)))")
+    assert isinstance(body, CaseLambda)
+    assert not isinstance(body.lams[0].body[0], Quote)
+
+def test_fold_if():
+    body = lambda_body("(lambda (y) (let ([a #f]) (if a (car y) (cdr y))))")
+    assert not isinstance(body, If)
+    assert body.rator.srcsym.variable_name() == "cdr"
+
+def test_drop_unused_bindings():
+    body = lambda_body("(lambda (y) (let ([f (lambda () y)] [b y]) (car y)))")
+    assert not isinstance(body, Let)
+    # effects are kept
+    body = lambda_body("(lambda (y) (let ([b (display y)]) (car y)))")
+    assert isinstance(body, Let)
+
+def test_node_counts():
+    start = len(stats.modules)
+    m = parse_module(expand_string(format_pycket_mod(
+        "(define z (let ([a 1] [b 2]) (if (< a b) (+ a b) (- a b))))")))
+    assert [name for name, before, after in stats.modules[start:]
+                 if after < before]
+    rhs = m.body[-1]
+    assert isinstance(rhs, DefineValues)
+    assert isinstance(rhs.rhs, Quote)
+    assert count_nodes(rhs.rhs) == 1
+
+def test_results_unchanged():
+    run_fix("(let ([a 1] [b 2]) (if (< a b) (+ a b) (- a b)))", 3)
+    run_fix("(let ([a 1]) (let ([a 2]) a))", 2)
+    run_fix("(let ([a 1]) ((lambda (a) (+ a 1)) 5))", 6)
+    run_fix("(letrec ([f (lambda (n) (if (= n 0) 0 (+ 1 (f (- n 1)))))]) (f 10))", 10)
+    run_fix("(let ([a 1]) (set! a 3) a)", 3)
+    assert run_mod_expr("(let ([t #t]) (if t t 0))") is w_true
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for places
+#
+
+from pycket                 import values
+from pycket.place           import encode_length, decode_length, message_allowed
+from pycket.scheduler       import scheduler
+from pycket.test.testhelper import run_mod
+
+def setup_function(function):
+    scheduler.reset()
+
+def test_length_encoding():
+    for n in [0, 1, 255, 256, 65537, 2**31 - 1]:
+        assert decode_length(encode_length(n), 0) == n
+
+def test_message_allowed():
+    assert message_allowed(values.W_Fixnum(1))
+    assert message_allowed(values.to_list([values.W_Symbol.make("a"),
+                                           values.W_Flonum(1.5)]))
+    assert not message_allowed(values.W_MBox(values.w_void))
+
+def test_place_roundtrip(tmpdir):
+    worker = tmpdir.join("worker.rkt")
+    worker.write("""#lang racket/base
+(require pycket/primitives)
+(provide start)
+(define (start ch)
+  (let loop ()
+    (define msg (place-channel-get ch))
+    (unless (eq? msg 'done)
+      (place-channel-put ch (cons (car msg) (* 2 (cdr msg))))
+      (loop))))
+""")
+    m = run_mod("""
+    #lang pycket
+    (require pycket/primitives)
+    (define p (dynamic-place %s 'start))
+    (place-channel-put p (cons 'x 21))
+    (define answer (place-channel-get p))
+    (place-channel-put p 'done)
+    (define status (place-wait p))
+    (define is-place (place? p))
+    """ % ('"%s"' % worker))
+    def lookup(name):
+        return m.defs[values.W_Symbol.make(name)]
+    answer = lookup("answer")
+    assert answer.car() is values.W_Symbol.make("x")
+    assert answer.cdr().value == 42
+    assert lookup("status").value == 0
+    assert lookup("is-place") is values.w_true
+
+def test_place_large_messages_both_ways(tmpdir):
+    # each message is larger than a pipe buffer, both sides put before they
+    # get, the parent reads in a thread while its put waits for the child
+    worker = tmpdir.join("worker.rkt")
+    worker.write("""#lang racket/base
+(require pycket/primitives)
+(provide start)
+(define (start ch)
+  (place-channel-put ch (make-string 200000 #\\a))
+  (place-channel-put ch (string-length (place-channel-get ch))))
+""")
+    m = run_mod("""
+    #lang pycket
+    (require pycket/primitives)
+    (define p (dynamic-place %s 'start))
+    (define got #f)
+    (define t (thread (lambda () (set! got (place-channel-get p)))))
+    (place-channel-put p (make-string 300000 #\\b))
+    (thread-wait t)
+    (define got-length (string-length got))
+    (define echoed (place-channel-get p))
+    (define status (place-wait p))
+    """ % ('"%s"' % worker))
+    def lookup(name):
+        return m.defs[values.W_Symbol.make(name)]
+    assert lookup("got-length").value == 200000
+    assert lookup("echoed").value == 300000
+    assert lookup("status").value == 0
@@ -999,3 +999,36 @@ def test_procedure_result_arity(doctest):
     > (procedure-result-arity node-x)
     1
     """
+
+def test_jit_stats():
+    from pycket.jit_stats import stats
+    stats.reset()
+    stats.record_loop("loop at 1")
+    stats.record_loop("loop at 1")
+    stats.record_bridge("loop at 1")
+    stats.record_abort("ABORT_TOO_LONG", "loop at 2")
+    stats.record_too_long("loop at 2")
+    m = run_mod("""
+    #lang pycket
+    (require pycket/primitives)
+    (define stats (pycket-jit-stats))
+    (define loops (cdr (assq 'loops stats)))
+    (define bridges (cdr (assq 'bridges stats)))
+    (define aborts (cdr (assq 'aborts stats)))
+    (define too-long (cdr (assq 'trace-too-long stats)))
+    (define entry (assoc "loop at 1" (pycket-jit-stats-entries)))
+    (pycket-jit-stats-reset!)
+    (define after (cdr (assq 'loops (pycket-jit-stats))))
+    """)
+    def lookup(name):
+        return m.defs[values.W_Symbol.make(name)]
+    assert lookup("loops").value == 2
+    assert lookup("bridges").value == 1
+    assert lookup("too-long").value == 1
+    aborts = lookup("aborts")
+    assert aborts.car().car() is values.W_Symbol.make("ABORT_TOO_LONG")
+    assert aborts.car().cdr().value == 1
+    entry = values.from_list(lookup("entry"))
+    assert [e.value for e in entry[1:]] == [2, 1, 0, 0]
+    assert lookup("after").value == 0
+    assert not stats.entries
@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the binary value encoding and the AST cache
+#
+import os
+import pytest
+from rpython.rlib.rbigint import rbigint
+
+from pycket import values, values_string, values_regex, vector
+from pycket.astcache import serialize_module, deserialize_module
+from pycket.expand import (expand_string, parse_module, ModTable,
+    load_json_ast_cached, load_json_ast_rpython, _ast_cache_name)
+from pycket.hash.equal import W_EqualHashTable
+from pycket.interpreter import Module
+from pycket.serialize import (serialize_value, deserialize_value, Writer,
+    Reader, SerializationError)
+from pycket.test.testhelper import format_pycket_mod, run_ast
+
+
+def roundtrip(w_val):
+    return deserialize_value(serialize_value(w_val))
+
+def test_integers():
+    for n in [0, 1, -1, 63, 64, -64, -65, 127, 128, 2**31, -2**31, 2**62, -2**62]:
+        w = Writer()
+        w.write_int(n)
+        w.write_uint(abs(n))
+        r = Reader(w.getvalue())
+        assert r.read_int() == n
+        assert r.read_uint() == abs(n)
+        assert r.at_end()
+
+def test_truncated():
+    data = serialize_value(values_string.W_String.make("abcdef"))
+    with pytest.raises(SerializationError):
+        deserialize_value(data[:-2])
+
+def test_atoms():
+    for w_val in [values.w_true, values.w_false, values.w_void, values.w_null]:
+        assert roundtrip(w_val) is w_val
+    assert roundtrip(values.W_Fixnum(-17)).value == -17
+    assert roundtrip(values.W_Flonum(1.5)).value == 1.5
+    assert roundtrip(values.W_Flonum.INF).value == values.W_Flonum.INF.value
+    assert roundtrip(values.W_Character.make(u"λ")).value == u"λ"
+    big = values.W_Bignum(rbigint.fromdecimalstr("123456789012345678901234567890"))
+    assert roundtrip(big).equal(big)
+    rat = values.W_Rational.fromint(-3, 4)
+    assert roundtrip(rat).equal(rat)
+    cpx = values.W_Complex.make(values.W_Fixnum(1), values.W_Flonum(2.0))
+    assert roundtrip(cpx).equal(cpx)
+
+def test_strings_and_symbols():
+    w_str = values_string.W_String.make("h\xc3\xa9llo")
+    w_res = roundtrip(w_str)
+    assert w_res.equal(w_str)
+    assert w_res.immutable()
+    w_mstr = values_string.W_String.fromstr_utf8("abc")
+    assert not roundtrip(w_mstr).immutable()
+    w_sym = values.W_Symbol.make("foo")
+    assert roundtrip(w_sym) is w_sym
+    w_kw = values.W_Keyword.make("key")
+    assert roundtrip(w_kw) is w_kw
+    w_path = roundtrip(values.W_Path("/tmp/x"))
+    assert w_path.path == "/tmp/x"
+    w_rx = roundtrip(values_regex.W_PRegexp("a+b"))
+    assert isinstance(w_rx, values_regex.W_PRegexp)
+    assert w_rx.source == "a+b"
+
+def test_uninterned_symbol_identity():
+    w_sym = values.W_Symbol(u"gensym1")
+    w = Writer()
+    w.write_symbol(w_sym)
+    w.write_symbol(w_sym)
+    r = Reader(w.getvalue())
+    s1 = r.read_symbol()
+    s2 = r.read_symbol()
+    assert s1 is s2
+    assert s1 is not w_sym
+    assert not s1.is_interned()
+    assert s1.utf8value == "gensym1"
+
+def test_compound():
+    w_list = values.to_improper([values.W_Fixnum(1), values.W_Symbol.make("a")],
+                                values.W_Fixnum(2))
+    assert roundtrip(w_list).equal(w_list)
+    w_vec = vector.W_Vector.fromelements([values.W_Fixnum(1), w_list], immutable=True)
+    w_res = roundtrip(w_vec)
+    assert w_res.immutable()
+    assert w_res.equal(w_vec)
+    w_box = roundtrip(values.W_IBox(values.W_Fixnum(5)))
+    assert w_box.value.value == 5
+    w_hash = W_EqualHashTable([values.W_Symbol.make("k")],
+                              [values.W_Fixnum(3)], immutable=True)
+    w_res = roundtrip(w_hash)
+    assert isinstance(w_res, W_EqualHashTable)
+    assert w_res.length() == 1
+
+def test_prefab_struct():
+    from pycket.values_struct import W_Struct
+    w_struct = W_Struct.make_prefab(values.W_Symbol.make("point"),
+                                    [values.W_Fixnum(1), values.w_false])
+    w_res = roundtrip(w_struct)
+    assert w_res.struct_type() is w_struct.struct_type()
+    assert w_res._ref(0).value == 1
+    assert w_res._ref(1) is values.w_false
+
+def test_unsupported_value():
+    with pytest.raises(SerializationError):
+        serialize_value(values.W_MBox(values.w_void))
+
+def roundtrip_module(source):
+    module = parse_module(expand_string(format_pycket_mod(source)))
+    data = serialize_module(module)
+    return module, deserialize_module(data, ModTable())
+
+def test_module_roundtrip():
+    module, copy = roundtrip_module("""
+    (define (fact n) (if (= n 0) 1 (* n (fact (- n 1)))))
+    (define x (fact 10))
+    (define y (let loop ([i 0] [acc '()]) (if (= i 3) acc (loop (add1 i) (cons i acc)))))
+    (define z (let ([c 0]) (set! c (+ c 1)) c))
+    """)
+    assert isinstance(copy, Module)
+    assert copy.tostring() == module.tostring()
+    result = run_ast(copy)
+    assert result.defs[values.W_Symbol.make("x")].value == 3628800
+    assert result.defs[values.W_Symbol.make("z")].value == 1
+
+def test_module_roundtrip_version_mismatch():
+    module = parse_module(expand_string(format_pycket_mod("(define x 1)")))
+    data = serialize_module(module, source_hash="abc")
+    assert deserialize_module(data, ModTable(), source_hash="abd") is None
+    assert deserialize_module("garbage", ModTable()) is None
+
+def test_ast_cache_file(tmpdir):
+    json_file = tmpdir / "prog.rkt.json"
+    json_file.write(expand_string(format_pycket_mod("(define x (+ 1 2))")))
+    json_file = str(json_file)
+    cache_file = _ast_cache_name(json_file)
+    assert cache_file.endswith("prog.rkt.ast")
+    module = load_json_ast_cached(json_file, ModTable())
+    assert tmpdir.join("prog.rkt.ast").check()
+    cached = load_json_ast_cached(json_file, ModTable())
+    assert cached.tostring() == module.tostring()
+    expected = load_json_ast_rpython(json_file, ModTable())
+    assert cached.tostring() == expected.tostring()
+
+def test_ast_cache_same_size_change(tmpdir):
+    json_file = tmpdir / "prog.rkt.json"
+    json_file.write(expand_string(format_pycket_mod("(define x (+ 1 2))")))
+    json_file = str(json_file)
+    load_json_ast_cached(json_file, ModTable())
+    size = os.path.getsize(json_file)
+    # only the contents differ, and the cache looks newer than the json file
+    data = expand_string(format_pycket_mod("(define x (+ 1 3))"))
+    f = open(json_file, "w")
+    f.write(data)
+    f.close()
+    assert os.path.getsize(json_file) == size
+    os.utime(json_file, (0, 0))
+    cached = load_json_ast_cached(json_file, ModTable())
+    expected = load_json_ast_rpython(json_file, ModTable())
+    assert cached.tostring() == expected.tostring()
@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the resident server mode
+#
+
+import os
+import socket
+import time
+
+from pycket                 import server
+from pycket.interpreter     import ToplevelEnv
+from pycket.server          import frame, handle_request, serve
+from pycket.test.testhelper import run_mod
+
+MODULE = """
+#lang pycket
+(provide greet fail (rename-out [secret exposed]))
+(define (secret) 7)
+(define (hidden) 8)
+(define (greet name)
+  (printf "hello ~a~n" name)
+  (eprintf "to stderr")
+  (string-length name))
+(define (fail) (car 1))
+"""
+
+def read_frames(data, n):
+    frames = []
+    for i in range(n):
+        newline = data.index("\n")
+        header = data[:newline]
+        size = int(header.lstrip("!"))
+        frames.append((header.startswith("!"), data[newline + 1:newline + 1 + size]))
+        data = data[newline + 1 + size:]
+    return frames
+
+def test_frame():
+    assert frame("abc") == "3\nabc"
+    assert frame("", True) == "!0\n"
+
+def test_handle_request():
+    m = run_mod(MODULE)
+    env = ToplevelEnv()
+    reply = handle_request("greet\nworld", m, env)
+    assert read_frames(reply, 3) == [
+        (False, "5"), (False, "hello world\n"), (False, "to stderr")]
+    # the output ports are restored afterwards
+    reply = handle_request("greet\nx", m, env)
+    assert read_frames(reply, 3)[1] == (False, "hello x\n")
+    error, message = read_frames(handle_request("fail", m, env), 3)[0]
+    assert error
+    error, message = read_frames(handle_request("nothing", m, env), 3)[0]
+    assert error and "nothing" in message
+
+def test_only_provided_functions(monkeypatch):
+    m = run_mod(MODULE)
+    env = ToplevelEnv()
+    assert sorted(m.provides.keys()) == ["exposed", "fail", "greet"]
+    error, message = read_frames(handle_request("hidden", m, env), 3)[0]
+    assert error and "not provided" in message
+    error, message = read_frames(handle_request("secret", m, env), 3)[0]
+    assert error
+    assert read_frames(handle_request("exposed", m, env), 3)[0] == (False, "7")
+    # errors that are no Racket exceptions are reported as well
+    def crash(module, name, args, env):
+        raise KeyError(name)
+    monkeypatch.setattr(server, "call_function", crash)
+    error, message = read_frames(handle_request("greet\nx", m, env), 3)[0]
+    assert error and "internal error" in message
+
+def test_serve(tmpdir):
+    m = run_mod(MODULE)
+    path = str(tmpdir.join("pycket.sock"))
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve(path, m, ToplevelEnv())
+        finally:
+            os._exit(1)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        for i in range(100):
+            try:
+                client.connect(path)
+                break
+            except socket.error:
+                time.sleep(0.05)
+        for name in ["ab", "abc"]:
+            client.sendall(frame("greet\n" + name))
+            data = ""
+            while not data.endswith("to stderr"):
+                data += client.recv(4096)
+            assert read_frames(data, 3)[0] == (False, str(len(name)))
+        client.close()
+    finally:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for snapshots of loaded modules
+#
+import os
+from pycket import values, values_string, vector
+from pycket.env import ToplevelEnv
+from pycket.expand import ensure_json_ast_run, load_json_ast_cached, ModTable
+from pycket.interpreter import interpret_module
+from pycket.snapshot import (save_snapshot, load_snapshot, _is_plain_value,
+    serialize_snapshot, deserialize_snapshot)
+
+def load_and_run(fname, modtable):
+    json_file = ensure_json_ast_run(fname)
+    modtable.enter_module(fname)
+    ast = load_json_ast_cached(json_file, modtable)
+    modtable.exit_module(fname, ast)
+    env = ToplevelEnv()
+    env.globalconfig.load(ast)
+    env.module_env.add_module(fname, ast)
+    interpret_module(ast, env)
+    return env, ast
+
+def write_program(tmpdir, lib):
+    tmpdir.join("lib.rkt").write("#lang pycket\n(provide (all-defined-out))\n" + lib)
+    prog = tmpdir.join("prog.rkt")
+    prog.write('#lang pycket\n(require "lib.rkt")\n(define y (f 1))\n')
+    return str(tmpdir.join("lib.rkt")), str(prog)
+
+def test_plain_values():
+    assert _is_plain_value(values.W_Fixnum(1))
+    assert _is_plain_value(values.to_list([values.W_Symbol.make("a"),
+                                           values_string.W_String.make("b")]))
+    assert not _is_plain_value(values_string.W_String.fromstr_utf8("b"))
+    assert not _is_plain_value(vector.W_Vector.fromelements([values.W_Fixnum(1)]))
+    assert not _is_plain_value(values.to_list([values.W_MBox(values.w_void)]))
+
+def test_restore(tmpdir):
+    lib, prog = write_program(tmpdir, """
+    (define (f x) (+ x k (length lst)))
+    (define k 5)
+    (define lst (list 1 "two"))
+    """)
+    env, ast = load_and_run(prog, ModTable())
+    img = str(tmpdir.join("prelude.img"))
+    assert save_snapshot(img, env.module_env) > 0
+
+    modtable = ModTable()
+    assert load_snapshot(img, modtable)
+    restored = modtable.lookup(lib)
+    assert restored.snapshot_defs is not None
+    assert restored.snapshot_defs[values.W_Symbol.make("f")] is None
+    assert restored.snapshot_defs[values.W_Symbol.make("k")].value == 5
+    env, ast = load_and_run(prog, modtable)
+    assert ast.defs[values.W_Symbol.make("y")].value == 8
+    assert restored.interpreted
+
+def test_restore_with_state(tmpdir):
+    lib, prog = write_program(tmpdir, """
+    (define counter 0)
+    (define (f x) (set! counter (add1 counter)) (+ x counter))
+    (define v (make-vector 2 0))
+    """)
+    env, ast = load_and_run(prog, ModTable())
+    data = serialize_snapshot(env.module_env)
+    modtable = ModTable()
+    assert deserialize_snapshot(data, modtable)
+    # the module is instantiated again from its AST
+    assert modtable.lookup(lib).snapshot_defs is None
+    env, ast = load_and_run(prog, modtable)
+    assert ast.defs[values.W_Symbol.make("y")].value == 2
+
+def test_definitions_with_effects(tmpdir):
+    lib, prog = write_program(tmpdir, """
+    (define (f x) x)
+    (define k (begin (display "") 5))
+    """)
+    env, ast = load_and_run(prog, ModTable())
+    data = serialize_snapshot(env.module_env)
+    modtable = ModTable()
+    assert deserialize_snapshot(data, modtable)
+    assert modtable.lookup(lib).snapshot_defs is None
+
+def test_out_of_date(tmpdir):
+    lib, prog = write_program(tmpdir, "(define (f x) x)\n")
+    env, ast = load_and_run(prog, ModTable())
+    data = serialize_snapshot(env.module_env)
+    later = os.stat(lib).st_mtime + 10
+    os.utime(lib, (later, later))
+    modtable = ModTable()
+    assert not deserialize_snapshot(data, modtable)
+    assert not modtable.table
+    assert not deserialize_snapshot("garbage", modtable)
@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for green threads, channels and sync
+#
+
+import pytest
+from pycket                 import values
+from pycket.error           import SchemeException
+from pycket.scheduler       import scheduler
+from pycket.test.testhelper import run_mod
+
+def setup_function(function):
+    # threads left over by other tests must not run in this one
+    scheduler.reset()
+
+def test_thread_wait(doctest):
+    """
+    ! (define b (box 0))
+    ! (define t (thread (lambda () (set-box! b 42))))
+    ! (thread-wait t)
+    > (unbox b)
+    42
+    > (thread? t)
+    #t
+    > (thread-dead? t)
+    #t
+    > (thread-running? (current-thread))
+    #t
+    > (thread? 1)
+    #f
+    """
+
+def test_channel(doctest):
+    """
+    ! (define c (make-channel))
+    ! (define t (thread (lambda () (for ([i 3]) (channel-put c i)))))
+    ! (define got (let loop ([n 3]) (if (= n 0) '() (cons (channel-get c) (loop (- n 1))))))
+    > got
+    '(0 1 2)
+    > (channel? c)
+    #t
+    > (channel-try-get c)
+    #f
+    """
+
+def test_channel_put_evt(doctest):
+    """
+    ! (define c (make-channel))
+    ! (define t (thread (lambda () (channel-get c))))
+    ! (define e (channel-put-evt c 'x))
+    > (eq? (sync e) e)
+    #t
+    > (evt? e)
+    #t
+    > (evt? c)
+    #t
+    > (evt? 'x)
+    #f
+    """
+
+def test_semaphore(doctest):
+    """
+    ! (define s (make-semaphore 0))
+    ! (define b (box '()))
+    ! (define (worker n) (thread (lambda () (set-box! b (cons n (unbox b))) (semaphore-post s))))
+    ! (worker 1)
+    ! (worker 2)
+    ! (semaphore-wait s)
+    ! (semaphore-wait s)
+    > (length (unbox b))
+    2
+    > (semaphore-try-wait? s)
+    #f
+    > (begin (semaphore-post s) (semaphore-try-wait? s))
+    #t
+    > (call-with-semaphore (make-semaphore 1) (lambda (x) (+ x 1)) #f 1)
+    2
+    > (call-with-semaphore (make-semaphore 0) (lambda () 1) (lambda () 2))
+    2
+    """
+
+def test_sync(doctest):
+    """
+    ! (define s (make-semaphore 1))
+    ! (define c (make-channel))
+    > (eq? (sync c s) s)
+    #t
+    > (sync/timeout 0 c s)
+    #f
+    > (sync/timeout 0.01 c)
+    #f
+    > (let ([t (thread (lambda () (channel-put c 5)))]) (sync c))
+    5
+    > (let ([t (thread void)]) (eq? (sync t) t))
+    #t
+    E (sync 1)
+    """
+
+def test_sleep_order():
+    m = run_mod("""
+    #lang pycket
+    (define c (make-channel))
+    (thread (lambda () (sleep 0.02) (channel-put c 'slow)))
+    (thread (lambda () (sleep 0.01) (channel-put c 'fast)))
+    (define first (channel-get c))
+    (define second (channel-get c))
+    """)
+    assert m.defs[values.W_Symbol.make("first")] is values.W_Symbol.make("fast")
+    assert m.defs[values.W_Symbol.make("second")] is values.W_Symbol.make("slow")
+
+def test_preemption():
+    # the main thread never blocks, the other thread only runs when the main
+    # thread is preempted
+    m = run_mod("""
+    #lang pycket
+    (define b (box #f))
+    (thread (lambda () (set-box! b #t)))
+    (define n (let loop ([n 0]) (if (unbox b) n (loop (+ n 1)))))
+    """)
+    assert m.defs[values.W_Symbol.make("n")].value > 0
+
+def test_kill_thread(doctest):
+    """
+    ! (define c (make-channel))
+    ! (define t (thread (lambda () (channel-get c))))
+    ! (sleep)
+    ! (kill-thread t)
+    > (thread-dead? t)
+    #t
+    > (sync/timeout 0 (channel-put-evt c 1))
+    #f
+    """
+
+def test_thread_error():
+    m = run_mod("""
+    #lang pycket
+    (define t (thread (lambda () (car 1))))
+    (thread-wait t)
+    (define dead (thread-dead? t))
+    """)
+    assert m.defs[values.W_Symbol.make("dead")] is values.w_true
+
+def test_deadlock():
+    with pytest.raises(SchemeException):
+        run_mod("""
+        #lang pycket
+        (channel-get (make-channel))
+        """)
+
+def test_deadlock_is_catchable():
+    m = run_mod("""
+    #lang pycket
+    (define c (make-channel))
+    (define t (thread (lambda () (channel-get c))))
+    (define r
+      (with-handlers ([exn:fail? (lambda (e) 'caught)])
+        (channel-get c)))
+    (channel-put c 1)
+    (thread-wait t)
+    """)
+    assert m.defs[values.W_Symbol.make("r")] is values.W_Symbol.make("caught")
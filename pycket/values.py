@@ -737,9 +737,21 @@ class W_Character(W_Object):
 
 
 class W_Thread(W_Object):
+    """ A green thread run by pycket.scheduler. While the thread is not
+    running, thunk, ast or result together with env and cont describe where
+    it continues, or error is the message of an exception raised when it
+    does. """
     errorname = "thread"
-    def __init__(self):
-        pass
+    _attrs_ = ['done', 'thunk', 'ast', 'env', 'cont', 'waiter', 'result', 'error']
+    def __init__(self, thunk=None):
+        self.done = False
+        self.thunk = thunk
+        self.ast = None
+        self.env = None
+        self.cont = None
+        self.waiter = None
+        self.result = None
+        self.error = None
     def tostring(self):
         return "#<thread>"
 
@@ -749,16 +761,42 @@ class W_Semaphore(W_Object):
         self.n = n
     def post(self):
         self.n += 1
-    def wait(self):
+    def try_wait(self):
         if self.n >= 1:
-            return
-        else:
-            raise SchemeException("Waiting for a semaphore will never finish")
+            self.n -= 1
+            return True
+        return False
     def tostring(self):
         return "#<semaphore>"
 
 class W_Evt(W_Object):
     errorname = "evt"
+    def try_sync(self):
+        """ The result of syncing on the evt if it is ready, else None. """
+        return None
+    def needs_polling(self):
+        """ Whether the evt can become ready without any thread running. """
+        return False
+
+class W_Channel(W_Object):
+    """ A synchronous channel. getters are the waiters blocked on getting
+    from the channel, putters the waiters blocked on a channel-put-evt. """
+    errorname = "channel"
+    _attrs_ = ['getters', 'putters']
+    def __init__(self):
+        self.getters = []
+        self.putters = []
+    def tostring(self):
+        return "#<channel>"
+
+class W_ChannelPutEvt(W_Evt):
+    errorname = "channel-put-evt"
+    _immutable_fields_ = ["channel", "w_val"]
+    def __init__(self, channel, w_val):
+        self.channel = channel
+        self.w_val = w_val
+    def tostring(self):
+        return "#<channel-put-evt>"
 
 class W_SemaphorePeekEvt(W_Evt):
     errorname = "semaphore-peek-evt"
@@ -1061,16 +1099,22 @@ class W_ThunkProcCMK(W_Procedure):
 
 
 class W_Prim(W_Procedure):
-    _immutable_fields_ = ["name", "code", "arity", "result_arity", "simple1", "simple2"]
+    _immutable_fields_ = ["name", "code", "arity", "result_arity", "simple0",
+                          "simple1", "simple2", "simple3", "simplen"]
 
-    def __init__ (self, name, code, arity=Arity.unknown, result_arity=None, simple1=None, simple2=None):
+    def __init__ (self, name, code, arity=Arity.unknown, result_arity=None,
+                  simple0=None, simple1=None, simple2=None, simple3=None,
+                  simplen=None):
         self.name = W_Symbol.make(name)
         self.code = code
         assert isinstance(arity, Arity)
         self.arity = arity
         self.result_arity = result_arity
+        self.simple0 = simple0
         self.simple1 = simple1
         self.simple2 = simple2
+        self.simple3 = simple3
+        self.simplen = simplen
 
     def get_arity(self):
         return self.arity
@@ -1165,10 +1209,55 @@ class W_Continuation(W_Procedure):
         return Arity.unknown
     def call(self, args, env, cont):
         from pycket.interpreter import return_multi_vals
+        escape_epoch.bump()
         return return_multi_vals(Values.make(args), env, self.cont)
     def tostring(self):
         return "#<continuation>"
 
+class EscapeEpoch(object):
+    """ Counts the jumps that can leave the extent of a call/ec other than
+    through its own escape continuation: continuation calls, aborts, raises
+    and thread switches. """
+    def __init__(self):
+        self.n = 0
+
+    def bump(self):
+        self.n += 1
+
+escape_epoch = EscapeEpoch()
+
+class W_EscapeContinuation(W_Continuation):
+    """ The continuation call/ec passes to its procedure, cont is the
+    continuation of the call/ec. Jumping to it is only allowed while the call
+    has not returned: it is invalidated when the call returns or when it is
+    used. If it is used after that, or after any other jump that could have
+    left the call (see EscapeEpoch), it is checked against the current
+    continuation instead (the call can have been re-entered with call/cc, or
+    the jump was within the call). """
+    def __init__(self, cont):
+        W_Continuation.__init__(self, cont)
+        self.active = True
+        self.epoch = escape_epoch.n
+
+    def call(self, args, env, cont):
+        from pycket.interpreter import return_multi_vals
+        if not (self.active and self.epoch == escape_epoch.n):
+            if not self.in_extent(cont):
+                raise SchemeException("continuation application: attempt to "
+                                      "jump into an escape continuation")
+        self.active = False
+        escape_epoch.bump()
+        return return_multi_vals(Values.make(args), env, self.cont)
+
+    @jit.dont_look_inside
+    def in_extent(self, cont):
+        from pycket.cont import Cont
+        while isinstance(cont, Cont):
+            if cont is self.cont:
+                return True
+            cont = cont.prev
+        return cont is self.cont
+
 @inline_small_list(immutable=True, attrname="envs", factoryname="_make")
 class W_Closure(W_Procedure):
     _immutable_fields_ = ["caselam"]
@@ -1320,6 +1409,23 @@ class W_Closure1AsEnv(ConsEnv):
         prev = self.get_prev(env_structure)
         return prev.lookup(sym, env_structure.prev)
 
+    @jit.unroll_safe
+    def get_slot(self, index, frame):
+        jit.promote(frame)
+        if len(frame.elems) == self._get_size_list():
+            return ConsEnv.get_slot(self, index, frame)
+        # like lookup, the recursive references are not stored
+        recursive_sym = jit.promote(self.caselam).recursive_sym
+        if frame.elems[index] is recursive_sym:
+            return self
+        i = 0
+        for j in range(index):
+            if frame.elems[j] is not recursive_sym:
+                i += 1
+        v = self._get_list(i)
+        assert v is not None
+        return v
+
 
 class W_PromotableClosure(W_Procedure):
     """ A W_Closure that is promotable, ie that is cached in some place and